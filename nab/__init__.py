@@ -0,0 +1,10 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from nab.scorer import normalizeScore, scoreArrays
@@ -0,0 +1,216 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Bootstrap confidence intervals for NAB scores.
+
+The corpus is cut into units, either data files or, more finely, label windows
+and each data file's stretch outside its windows. The threshold curve of any
+resample of units is the weighted sum of the units' curves, so each unit's
+curve is computed once and every resample only costs a matrix product over
+the candidate thresholds.
+"""
+
+import numpy
+
+from nab.optimizer import calcCurveContribution
+from nab.sweeper import OUTSIDE_WINDOW, PROBATIONARY
+
+
+
+def calcUnitCurves(sweeper, sweepArrays, byWindow=False):
+  """
+  Return the threshold curves of the resampling units of a data set.
+
+  @param sweeper      (Sweeper)     Sweeper holding the cost matrix.
+  @param sweepArrays  (SweepArrays) Rows from `Sweeper.calcSweepScoreArrays()`
+  @param byWindow     (bool)        Split the data set into one unit per label
+                                    window, plus one for its rows outside any
+                                    window. Otherwise the data set is a single
+                                    unit.
+
+  @return (list) (unitKey, CurveContribution, numWindows) tuples, where
+                 `unitKey` is the window index, OUTSIDE_WINDOW, or None for a
+                 whole data set.
+  """
+  numWindows = len(sweepArrays.windowLimits)
+  if not byWindow:
+    return [(None, calcCurveContribution(sweeper, sweepArrays), numWindows)]
+
+  units = []
+  for unitKey in [OUTSIDE_WINDOW] + list(range(numWindows)):
+    windowIds = numpy.where(sweepArrays.windowIds == unitKey,
+                            sweepArrays.windowIds, PROBATIONARY)
+    contribution = calcCurveContribution(
+      sweeper, sweepArrays._replace(windowIds=windowIds))
+    units.append((unitKey, contribution, int(unitKey != OUTSIDE_WINDOW)))
+
+  return units
+
+
+def candidateThresholds(contributions):
+  """
+  Return the thresholds, highest first, at which the best score of some
+  resample can lie.
+
+  Lowering the threshold onto an anomaly score where no unit's score goes up
+  can't raise the score of any resample, since units are counted a
+  nonnegative number of times. Such thresholds are dropped; for a detector
+  this typically leaves only the scores seen inside windows.
+  """
+  thresholds = [numpy.array([1.1])]
+  for contribution in contributions:
+    thresholds.append(contribution.thresholds[contribution.scores > 0])
+  return numpy.unique(numpy.concatenate(thresholds))[::-1]
+
+
+def unitScores(contributions, thresholds):
+  """Return the score of each unit (rows) at each threshold (columns)."""
+  scores = numpy.empty((len(contributions), len(thresholds)))
+  for i, contribution in enumerate(contributions):
+    curve = contribution.baseScore + numpy.concatenate(
+      ([0.0], numpy.cumsum(contribution.scores)))
+    # Number of the unit's thresholds at or above each candidate.
+    detected = numpy.searchsorted(-contribution.thresholds, -thresholds,
+                                  side="right")
+    scores[i] = curve[detected]
+  return scores
+
+
+def scoreResamples(contributions, weights, blockSize=4096):
+  """
+  Optimize the threshold of each resample of units.
+
+  @param contributions  (list)          `CurveContribution` of each unit.
+  @param weights        (numpy.ndarray) Number of times each resample (rows)
+                                        draws each unit (columns).
+  @param blockSize      (int)           Number of candidate thresholds scored
+                                        at a time.
+
+  @return (tuple) Best score and threshold of each resample. Ties go to the
+                  highest threshold, as in `nab.optimizer`.
+  """
+  thresholds = candidateThresholds(contributions)
+  weights = numpy.asarray(weights, dtype=float)
+  bestScores = numpy.full(len(weights), -numpy.inf)
+  bestThresholds = numpy.zeros(len(weights))
+
+  for start in range(0, len(thresholds), blockSize):
+    blockThresholds = thresholds[start:start + blockSize]
+    scores = weights.dot(unitScores(contributions, blockThresholds))
+    best = scores.argmax(axis=1)
+    blockBest = scores[numpy.arange(len(scores)), best]
+    better = blockBest > bestScores
+    bestScores[better] = blockBest[better]
+    bestThresholds[better] = blockThresholds[best[better]]
+
+  return bestScores, bestThresholds
+
+
+def _scoreResamples(args):
+  """Pool wrapper of `scoreResamples()` for a chunk of resamples."""
+  contributionsList, weights = args
+  return [scoreResamples(contributions, weights)
+          for contributions in contributionsList]
+
+
+def drawWeights(strata, numUnits, numResamples, randomState):
+  """
+  Draw bootstrap resamples, with replacement within each stratum.
+
+  @param strata        (list)  Arrays of the unit indices in each stratum.
+  @param numUnits      (int)   Total number of units.
+  @param numResamples  (int)   Number of resamples.
+  @param randomState   (numpy.random.RandomState)
+
+  @return (numpy.ndarray) Number of times each resample draws each unit.
+  """
+  weights = numpy.zeros((numResamples, numUnits), dtype=int)
+  for stratum in strata:
+    if len(stratum):
+      weights[:, stratum] = randomState.multinomial(
+        len(stratum), [1.0 / len(stratum)] * len(stratum), size=numResamples)
+  return weights
+
+
+def summarize(pointEstimate, resamples, confidence):
+  """Return a point estimate with its percentile bootstrap interval."""
+  alpha = 100 * (1 - confidence) / 2
+  return {
+    "score": float(pointEstimate),
+    "low": float(numpy.percentile(resamples, alpha)),
+    "high": float(numpy.percentile(resamples, 100 - alpha)),
+    "stdev": float(numpy.std(resamples, ddof=1)) if len(resamples) > 1 else 0.0
+  }
+
+
+def bootstrapScores(pool,
+                    unitCurves,
+                    nullUnitCurves,
+                    tpWeight,
+                    numResamples=1000,
+                    confidence=0.95,
+                    seed=None,
+                    chunkSize=100):
+  """
+  Bootstrap the raw and normalized score of a detector under one profile.
+
+  Each resample re-optimizes the threshold of both the detector and the null
+  detector, and normalizes as `Runner.normalize()` does, counting the label
+  windows drawn for the perfect score.
+
+  @param pool             (multiprocessing.Pool)  Pool or nab.executor
+                                                  Executor to spread
+                                                  resamples over, or None.
+  @param unitCurves       (list)    Units of the detector, from
+                                    `calcUnitCurves()`.
+  @param nullUnitCurves   (list)    Units of the null detector, in the same
+                                    order.
+  @param tpWeight         (float)   True positive weight of the profile.
+  @param numResamples     (int)     Number of bootstrap resamples.
+  @param confidence       (float)   Coverage of the intervals.
+  @param seed             (int)     Seed of the resampling.
+  @param chunkSize        (int)     Resamples per pool task.
+
+  @return (dict) "raw" and "normalized" scores from `summarize()`, with the
+                 threshold optimized on the whole corpus.
+  """
+  contributions = [contribution for _, contribution, _ in unitCurves]
+  nullContributions = [contribution for _, contribution, _ in nullUnitCurves]
+  numWindows = numpy.array([n for _, _, n in unitCurves], dtype=float)
+  strata = [
+    numpy.flatnonzero([unitKey is None for unitKey, _, _ in unitCurves]),
+    numpy.flatnonzero([unitKey == OUTSIDE_WINDOW
+                       for unitKey, _, _ in unitCurves]),
+    numpy.flatnonzero([unitKey is not None and unitKey >= 0
+                       for unitKey, _, _ in unitCurves])]
+
+  randomState = numpy.random.RandomState(seed)
+  weights = drawWeights(strata, len(unitCurves), numResamples, randomState)
+  # The first row is the corpus itself, for the point estimate.
+  weights = numpy.vstack((numpy.ones((1, len(unitCurves)), dtype=int),
+                          weights))
+
+  chunks = [([contributions, nullContributions], weights[i:i + chunkSize])
+            for i in range(0, len(weights), chunkSize)]
+  if pool is None:
+    results = list(map(_scoreResamples, chunks))
+  else:
+    results = pool.map_async(_scoreResamples, chunks).get(999999)
+
+  raw, thresholds = [numpy.concatenate(x) for x in zip(
+    *[chunkResults[0] for chunkResults in results])]
+  null = numpy.concatenate([chunkResults[1][0] for chunkResults in results])
+  perfect = weights.dot(numWindows) * tpWeight
+  normalized = 100 * (raw - null) / (perfect - null)
+
+  return {
+    "threshold": float(thresholds[0]),
+    "raw": summarize(raw[0], raw[1:], confidence),
+    "normalized": summarize(normalized[0], normalized[1:], confidence)
+  }
@@ -0,0 +1,128 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Cross-validated threshold selection.
+
+Thresholds are optimized on the training folds of the corpus and scored on the
+held-out fold. Each data file's threshold curve is computed once, and a fold's
+training curve is the sum of its files' curves, so cross-validation costs
+about as much as a single optimization.
+"""
+
+import numpy
+
+from nab.bootstrap import scoreResamples, unitScores
+
+
+
+def makeFolds(relativePaths, numFolds=None, byCategory=False, seed=None):
+  """
+  Split data files into folds.
+
+  @param relativePaths  (list)  Data files, e.g. 'realKnownCause/nyc_taxi.csv'
+  @param numFolds       (int)   Number of folds for k-fold cross-validation.
+  @param byCategory     (bool)  Hold out one category (directory) at a time
+                                instead.
+  @param seed           (int)   Seed for shuffling files into k folds.
+
+  @return (list) (foldName, indices of the held-out files) tuples
+  """
+  if byCategory:
+    categories = [relativePath.split("/")[0] for relativePath in relativePaths]
+    return [(category, numpy.flatnonzero([c == category for c in categories]))
+            for category in sorted(set(categories))]
+
+  numFolds = min(numFolds, len(relativePaths))
+  order = numpy.random.RandomState(seed).permutation(len(relativePaths))
+  return [(str(i), numpy.sort(fold))
+          for i, fold in enumerate(numpy.array_split(order, numFolds))]
+
+
+def _optimizeFold(args):
+  """Optimize the thresholds of a fold's training files, for the pool."""
+  contributionsList, weights = args
+  return [scoreResamples(contributions, weights)[1][0]
+          for contributions in contributionsList]
+
+
+def crossValidateScores(pool,
+                        contributions,
+                        nullContributions,
+                        numWindows,
+                        folds,
+                        tpWeight):
+  """
+  Cross-validate the threshold of a detector under one profile.
+
+  Every data file is held out exactly once, so the held-out scores add up to
+  a corpus score comparable to the usual, in-sample, one. The null detector is
+  cross-validated over the same folds to normalize it.
+
+  @param pool               (multiprocessing.Pool)  Pool or nab.executor
+                                                    Executor to run folds on,
+                                                    or None.
+  @param contributions      (list)    `CurveContribution` of each data file.
+  @param nullContributions  (list)    Same for the null detector.
+  @param numWindows         (list)    Number of label windows in each file.
+  @param folds              (list)    From `makeFolds()`.
+  @param tpWeight           (float)   True positive weight of the profile.
+
+  @return (dict) Contains:
+        "folds"         (dict)    Fold name to its "threshold", held-out
+                                  "score", "trainScore" on the files it was
+                                  optimized on, and "numFiles" held out.
+        "score"         (float)   Sum of the held-out scores.
+        "normalized"    (float)   Normalized held-out score.
+        "inSampleScore" (float)   Score optimized on the whole corpus.
+        "inSampleNormalized" (float)  Normalized in-sample score.
+  """
+  numFiles = len(contributions)
+  weights = numpy.ones((len(folds) + 1, numFiles))
+  for i, (_, test) in enumerate(folds):
+    weights[i + 1, test] = 0
+
+  # The first row is the whole corpus, for the in-sample score.
+  tasks = [([contributions, nullContributions], weights[i:i + 1])
+           for i in range(len(weights))]
+  if pool is None:
+    thresholds = list(map(_optimizeFold, tasks))
+  else:
+    thresholds = pool.map_async(_optimizeFold, tasks).get(999999)
+
+  results = {"folds": {}}
+  heldOut = numpy.zeros(2)
+  for i, (foldName, test) in enumerate(folds):
+    threshold, nullThreshold = thresholds[i + 1]
+    fileScores = unitScores(contributions, numpy.array([threshold]))[:, 0]
+    nullFileScores = unitScores(nullContributions,
+                                numpy.array([nullThreshold]))[:, 0]
+    train = weights[i + 1] > 0
+    heldOut += (fileScores[test].sum(), nullFileScores[test].sum())
+    results["folds"][foldName] = {
+      "threshold": float(threshold),
+      "score": float(fileScores[test].sum()),
+      "trainScore": float(fileScores[train].sum()),
+      "numFiles": len(test)
+    }
+
+  perfect = tpWeight * numpy.sum(numWindows)
+  normalize = lambda score, nullScore: float(
+    100 * (score - nullScore) / (perfect - nullScore))
+
+  score, nullScore = heldOut
+  results["score"] = float(score)
+  results["normalized"] = normalize(score, nullScore)
+
+  threshold, nullThreshold = thresholds[0]
+  score = unitScores(contributions, numpy.array([threshold])).sum()
+  nullScore = unitScores(nullContributions, numpy.array([nullThreshold])).sum()
+  results["inSampleScore"] = float(score)
+  results["inSampleNormalized"] = normalize(score, nullScore)
+
+  return results
@@ -22,6 +22,10 @@ class ARTimeDetector(AnomalyDetector):
     #  for SSH ssh-add to ssh-agent to have julia git login via ssh
     #  for https login see https://docs.github.com/en/get-started/getting-started-with-git/caching-your-github-credentials-in-git
 
+    # The model is the global `p` of the process's one Julia runtime, which
+    # juliacall doesn't allow to be used from several threads.
+    threadSafe = False
+
     def __init__(self, *args, **kwargs):
         super(ARTimeDetector, self).__init__(*args, **kwargs)
         # import here so we install ARTime only once
@@ -36,6 +40,15 @@ class ARTimeDetector(AnomalyDetector):
         jl.seval(jline)
         self.jl = jl
         
+    def getState(self):
+        # The model lives in the Julia process, not in this object.
+        raise NotImplementedError("ARTime state is held in Julia and can't "
+                                  "be snapshot")
+
+    def setState(self, state):
+        raise NotImplementedError("ARTime state is held in Julia and can't "
+                                  "be restored")
+
     def handleRecord(self, inputData):
         value = inputData["value"]
         anomalyScore = getattr(self.jl.ARTime, "process_sample!")(value, self.jl.p)
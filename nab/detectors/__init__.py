@@ -0,0 +1,38 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import importlib
+
+from nab.util import detectorNameToClass
+
+
+
+# Module of each detector that runs in this Python.
+DETECTOR_MODULES = {
+  "bayesChangePt": "nab.detectors.bayes_changept.bayes_changept_detector",
+  "contextOSE": "nab.detectors.context_ose.context_ose_detector",
+  "earthgeckoSkyline":
+    "nab.detectors.earthgecko_skyline.earthgecko_skyline_detector",
+  "expose": "nab.detectors.expose.expose_detector",
+  "knncad": "nab.detectors.knncad.knncad_detector",
+  "null": "nab.detectors.null.null_detector",
+  "random": "nab.detectors.random.random_detector",
+  "relativeEntropy": "nab.detectors.relative_entropy.relative_entropy_detector",
+  "skyline": "nab.detectors.skyline.skyline_detector",
+  "windowedGaussian": "nab.detectors.gaussian.windowedGaussian_detector"
+}
+
+
+
+def getDetectorClass(detectorName):
+  """Imports and returns the class of a detector, by its name in NAB."""
+  if detectorName not in DETECTOR_MODULES:
+    raise ValueError("Unknown detector '%s'" % detectorName)
+  module = importlib.import_module(DETECTOR_MODULES[detectorName])
+  return getattr(module, detectorNameToClass(detectorName))
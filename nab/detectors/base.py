@@ -8,12 +8,20 @@
 # https://opensource.org/licenses/MIT.
 
 import abc
+import contextlib
+import io
+import numpy
 import os
 import pandas
 import sys
+import time
+import zipfile
+import zlib
 
 from datetime import datetime
-from nab.util import createPath, getProbationPeriod
+from nab.instrumentation import getTimingPath, LatencyRecorder
+from nab.util import getProbationPeriod
+from nab.writer import ResultsWriter
 
 
 
@@ -23,6 +31,35 @@ class AnomalyDetector(object, metaclass=abc.ABCMeta):
   take note of which methods MUST be overridden, as documented below.
   """
 
+  # Set by subclasses that implement handleRecords().
+  supportsBatch = False
+
+  # Set by subclasses that implement getWarmUpStart().
+  supportsSegments = False
+
+  # Set by subclasses that are cheap to build and run in the process that
+  # calls detect(), which times them over a few records to decide whether to
+  # run them together over each file. Others, such as detectors that start an
+  # external runtime, are taken to be costly without being run.
+  supportsCostProbe = False
+
+  # Set by subclasses whose instances share no state, so that several may run
+  # at once in threads of one process. Detection falls back to processes for
+  # the others; see Runner.getExecutor().
+  threadSafe = False
+
+  # What the detector learns from records, for getState(): the name of each
+  # array in a snapshot, with the dtype kinds it may have and its shape, where
+  # None is any length. None for detectors that can't be snapshot.
+  stateAttributes = None
+
+  # Rough bytes of memory a detector takes beyond its data set, and per
+  # record of it, at most while running over a file. Used to estimate the
+  # memory of detection tasks; see nab.memory.
+  memoryBase = 2 * 2 ** 20
+  memoryPerRecord = 256
+
+
   def __init__( self,
                 dataSet,
                 probationaryPercent):
@@ -68,6 +105,103 @@ class AnomalyDetector(object, metaclass=abc.ABCMeta):
     raise NotImplementedError
 
 
+  def handleRecords(self, timestamps, values):
+    """
+    Returns a list [anomalyScores, *] of columns, with one element per record.
+    The columns correspond to the values handleRecord() would return for each
+    record in turn. The records may be a whole data file or one chunk of it;
+    state carries over from one call to the next as it does between calls to
+    handleRecord().
+
+    @param timestamps (numpy.ndarray)  Timestamps of the records.
+    @param values     (numpy.ndarray)  Values of the records.
+
+    This method MAY be overridden, along with setting supportsBatch to True, by
+    detectors that can score records with array operations. handleRecord()
+    remains the reference implementation, and both must give the same results.
+    """
+    raise NotImplementedError
+
+
+  def getWarmUpStart(self, start):
+    """
+    Returns the index of the first record a new detector must handle to be in
+    the same state at record `start` as a detector that has handled every
+    record before it. Detectors whose state only depends on a bounded window
+    of past records can so run segments of a file independently; see
+    runSegment().
+
+    @param start (int) Index of the first record of a segment.
+
+    This method MAY be overridden, along with setting supportsSegments to
+    True, by such detectors.
+    """
+    raise NotImplementedError
+
+
+  def getState(self):
+    """
+    Returns a snapshot of the detector, as a dict of numpy arrays described by
+    stateAttributes.
+
+    The snapshot holds everything the detector has learned from the records it
+    has handled, and is independent of the detector: handling more records
+    doesn't change it. By default it has a copy of the attribute of each name
+    in stateAttributes.
+
+    This method MAY be overridden, together with setState(), by detectors with
+    state that isn't held in arrays or numbers.
+    """
+    if self.stateAttributes is None:
+      raise NotImplementedError(
+        "%s does not support snapshots" % type(self).__name__)
+    return {name: numpy.array(getattr(self, name))
+            for name in self.stateAttributes}
+
+
+  def setState(self, state):
+    """
+    Restores a snapshot from getState(), once checked by checkState(). The
+    detector must have been constructed and initialize()d as the one the
+    snapshot was taken from was; it then scores further records as that
+    detector would have.
+
+    @param state (dict) Snapshot from getState().
+    """
+    for name, value in self.checkState(state).items():
+      setattr(self, name, value)
+
+
+  def checkState(self, state):
+    """
+    Returns a copy of a snapshot, once checked to have exactly the arrays in
+    stateAttributes, each with one of its dtype kinds and its shape.
+
+    @param state (dict) Snapshot, e.g. from deserializeState().
+
+    @return (dict) Arrays of the snapshot, independent of it.
+    """
+    if self.stateAttributes is None:
+      raise NotImplementedError(
+        "%s does not support snapshots" % type(self).__name__)
+    if not isinstance(state, dict) or set(state) != set(self.stateAttributes):
+      raise ValueError("A %s snapshot must have the arrays %s" % (
+        type(self).__name__, ", ".join(sorted(self.stateAttributes))))
+
+    checked = {}
+    for name, (kinds, shape) in self.stateAttributes.items():
+      value = state[name]
+      if (not isinstance(value, numpy.ndarray) or
+          value.dtype.kind not in kinds or value.ndim != len(shape) or
+          any(length is not None and length != actual
+              for length, actual in zip(shape, value.shape))):
+        raise ValueError("Array '%s' of a %s snapshot must have shape %s and "
+                         "dtype kind in '%s'" % (name, type(self).__name__,
+                                                 shape, kinds))
+      checked[name] = value.copy()
+    return checked
+
+
   def getHeader(self):
     """
     Gets the outputPath and all the headers needed to write the results files.
@@ -81,38 +215,285 @@ class AnomalyDetector(object, metaclass=abc.ABCMeta):
     return headers
 
 
-  def run(self):
+  def run(self, writer=None, recorder=None):
     """
     Main function that is called to collect anomaly scores for a given file.
+
+    Detectors that set supportsBatch score records with calls to
+    handleRecords(). Otherwise records are read from columns extracted up front
+    rather than DataFrame rows, and passed to handleRecord() in a single dict
+    that is updated in place. Detectors must therefore not keep a reference to
+    `inputData` across calls.
+
+    @param writer (ResultsWriter) If given, records are processed in blocks of
+                                  `writer.blockSize`, each written out before
+                                  the next is processed, and None is returned.
+                                  Otherwise the whole file is processed at
+                                  once and the results returned as a
+                                  DataFrame.
+    @param recorder (LatencyRecorder) If given, calls to handleRecord() are
+                                  timed into it, one in every
+                                  `recorder.sampleInterval`. Records are then
+                                  always handled one by one, even by detectors
+                                  that support batches.
     """
 
     headers = self.getHeader()
 
-    rows = []
-    for i, row in self.dataSet.data.iterrows():
+    data = self.dataSet.data
+    names = list(data.columns)
+    numOutputs = len(headers) - len(names)
+    if writer is None:
+      blockSize = max(len(data), 1)
+    else:
+      blockSize = writer.blockSize
+
+    if self.supportsBatch and recorder is None:
+      blocks = self._runBatch(data, numOutputs, blockSize)
+    else:
+      blocks = self._runRecords(data, numOutputs, blockSize, recorder)
+
+    if writer is not None:
+      for start, stop, outputs in blocks:
+        writer.write([data[name].values[start:stop] for name in names] +
+                     outputs)
+      return None
+
+    blocks = list(blocks)
+    if blocks:
+      outputs = blocks[0][2]
+    else:
+      outputs = [[] for _ in range(numOutputs)]
+
+    ans = pandas.DataFrame(
+      dict(zip(headers, [data[name].values for name in names] + outputs)),
+      columns=headers)
+    return ans
+
 
-      inputData = row.to_dict()
+  def runSegment(self, start, stop):
+    """
+    Returns the output columns of records [start, stop) of the data set, the
+    same as from run(). The detector first handles the records from
+    getWarmUpStart(start), whose outputs are dropped. Only for detectors that
+    set supportsSegments.
 
-      detectorValues = self.handleRecord(inputData)
+    @param start  (int) Index of the first record of the segment.
+    @param stop   (int) Index after the last record of the segment.
+    """
+    if not self.supportsSegments:
+      raise NotImplementedError(
+        "%s does not support segments" % type(self).__name__)
+    warmUpStart = self.getWarmUpStart(start)
+    data = self.dataSet.data.iloc[warmUpStart:stop]
+    numOutputs = len(self.getHeader()) - len(data.columns)
+    if not len(data):
+      return [[] for _ in range(numOutputs)]
+
+    if self.supportsBatch:
+      blocks = self._runBatch(data, numOutputs, len(data))
+    else:
+      blocks = self._runRecords(data, numOutputs, len(data))
+    return [output[start - warmUpStart:] for output in list(blocks)[0][2]]
+
+
+  def _runRecords(self, data, numOutputs, blockSize, recorder=None):
+    """Yields (start, stop, output columns) of handleRecord(), called once per
+    record, for each block of records."""
+    names = list(data.columns)
+    numRecords = len(data)
+    if recorder is not None:
+      recorder.numRecords = numRecords
+    for start in range(0, numRecords, blockSize):
+      stop = min(start + blockSize, numRecords)
+      columns = [data[name].iloc[start:stop].tolist() for name in names]
+      yield start, stop, self._handleBlock(names, columns, start, numOutputs,
+                                           recorder)
+
+
+  def _handleBlock(self, names, columns, start, numOutputs, recorder=None):
+    """Returns the output columns of handleRecord(), called once per record of
+    a block, given as input columns. `start` is the index of its first
+    record."""
+    inputData = {}
+    handleRecord = self.handleRecord
+    if recorder is not None:
+      sampleInterval = recorder.sampleInterval
+      clock = time.perf_counter_ns
+    outputs = [[None] * len(columns[0]) for _ in range(numOutputs)]
+    for i, record in enumerate(zip(*columns)):
+      for name, value in zip(names, record):
+        inputData[name] = value
+
+      if recorder is not None and (start + i) % sampleInterval == 0:
+        began = clock()
+        detectorValues = handleRecord(inputData)
+        recorder.record(start + i, clock() - began)
+      else:
+        detectorValues = handleRecord(inputData)
 
       # Make sure anomalyScore is between 0 and 1
       if not 0 <= detectorValues[0] <= 1:
-        raise ValueError(
-          f"anomalyScore must be a number between 0 and 1. "
-          f"Please verify if '{self.handleRecord.__qualname__}' method is "
-          f"returning a value between 0 and 1")
-
-      outputRow = list(row) + list(detectorValues)
+        self._raiseScoreOutOfRange(self.handleRecord)
 
-      rows.append(outputRow)
+      for output, value in zip(outputs, detectorValues):
+        output[i] = value
 
       # Progress report
-      if (i % 1000) == 0:
+      if ((start + i) % 1000) == 0:
         print(".", end=' ')
         sys.stdout.flush()
 
-    ans = pandas.DataFrame(rows, columns=headers)
-    return ans
+    return outputs
+
+
+  def _runBatch(self, data, numOutputs, blockSize):
+    """Yields (start, stop, output columns) of a call to handleRecords() for
+    each block of records."""
+    timestamps = data["timestamp"].values
+    values = data["value"].values
+    for start in range(0, len(data), blockSize):
+      stop = min(start + blockSize, len(data))
+      yield start, stop, self._handleBatch(timestamps[start:stop],
+                                           values[start:stop], numOutputs)
+
+
+  def _handleBatch(self, timestamps, values, numOutputs):
+    """Returns the output columns of handleRecords() for a block of records,
+    once checked."""
+    outputs = list(self.handleRecords(timestamps, values))
+
+    if len(outputs) != numOutputs or any(
+        len(output) != len(values) for output in outputs):
+      raise ValueError(
+        f"'{self.handleRecords.__qualname__}' must return {numOutputs} "
+        f"columns of {len(values)} values each")
+
+    # Make sure anomalyScores are between 0 and 1
+    scores = numpy.asarray(outputs[0], dtype=float)
+    if not numpy.all((scores >= 0) & (scores <= 1)):
+      self._raiseScoreOutOfRange(self.handleRecords)
+
+    return outputs
+
+
+  @staticmethod
+  def _raiseScoreOutOfRange(method):
+    raise ValueError(
+      f"anomalyScore must be a number between 0 and 1. "
+      f"Please verify if '{method.__qualname__}' method is "
+      f"returning a value between 0 and 1")
+
+
+class StreamDataSet(object):
+  """
+  Stands in for the DataFile a detector is constructed on, for a stream
+  whose records are yet to come. Its data only has the extremes of the
+  stream's values.
+  """
+
+  def __init__(self, name, inputMin, inputMax):
+    self.fileName = name
+    self.srcPath = None
+    self.data = pandas.DataFrame({
+      "timestamp": pandas.to_datetime([0, 0]),
+      "value": [float(inputMin), float(inputMax)]})
+
+
+def serializeState(state):
+  """
+  Returns a detector snapshot from AnomalyDetector.getState() as the bytes of
+  a compressed numpy .npz archive, e.g. to checkpoint a detector mid-stream.
+
+  @param state (dict) Snapshot of a detector.
+  """
+  arrays = {name: numpy.asarray(value) for name, value in state.items()}
+  for name, value in arrays.items():
+    if value.dtype.hasobject:
+      raise ValueError("Array '%s' of a snapshot holds Python objects" % name)
+  stream = io.BytesIO()
+  numpy.savez_compressed(stream, **arrays)
+  return stream.getvalue()
+
+
+def deserializeState(data, maxSize=None):
+  """
+  Returns the detector snapshot serialized by serializeState().
+
+  The archive is read without unpickling anything, so the bytes needn't be
+  trusted; AnomalyDetector.setState() then checks the arrays.
+
+  @param data     (bytes) Serialized snapshot.
+  @param maxSize  (int)   If given, the most bytes the arrays may take once
+                          decompressed.
+  """
+  try:
+    arrays = numpy.load(io.BytesIO(data), allow_pickle=False)
+    if not isinstance(arrays, numpy.lib.npyio.NpzFile):
+      raise ValueError("not an .npz archive")
+    with arrays:
+      size = sum(info.file_size for info in arrays.zip.infolist())
+      if maxSize is not None and size > maxSize:
+        raise ValueError("%s bytes of arrays, more than %s" % (size, maxSize))
+      return {name: arrays[name] for name in arrays.files}
+  except (EOFError, OSError, ValueError, zipfile.BadZipFile, zlib.error) as e:
+    raise ValueError("Not a detector snapshot: %s" % e)
+
+
+def _outputPath(outputDir, detectorName, relativePath):
+  relativeDir, fileName = os.path.split(relativePath)
+  fileName =  detectorName + "_" + fileName
+  return os.path.join(outputDir, detectorName, relativeDir, fileName)
+
+
+def runDetectors(detectors, writers, recorders=None):
+  """
+  Runs several detectors over the same data set in lock-step: the records are
+  read once, a block at a time, and each block is fed to every detector and
+  its results written before the next block is read.
+
+  Each detector is run as by AnomalyDetector.run() with its writer and
+  recorder, so its results are the same as from a run on its own. The text of
+  the input columns and labels, the same in every results file, is only
+  formatted once per block.
+
+  @param detectors  (list)  Initialized detectors, all of the same data set.
+  @param writers    (list)  A ResultsWriter per detector, all with the same
+                            block size, and usually the same labels.
+  @param recorders  (list)  A LatencyRecorder or None per detector, if any.
+  """
+  if recorders is None:
+    recorders = [None] * len(detectors)
+  data = detectors[0].dataSet.data
+  names = list(data.columns)
+  timestamps = data["timestamp"].values
+  values = data["value"].values
+  numOutputs = [len(detector.getHeader()) - len(names)
+                for detector in detectors]
+  for recorder in recorders:
+    if recorder is not None:
+      recorder.numRecords = len(data)
+
+  blockSize = writers[0].blockSize
+  for start in range(0, len(data), blockSize):
+    stop = min(start + blockSize, len(data))
+    inputs = [data[name].values[start:stop] for name in names]
+    inputRows = writers[0].formatInputs(inputs)
+    columns = None
+    for detector, writer, recorder, count in zip(detectors, writers,
+                                                 recorders, numOutputs):
+      if detector.supportsBatch and recorder is None:
+        outputs = detector._handleBatch(timestamps[start:stop],
+                                        values[start:stop], count)
+      else:
+        if columns is None:
+          columns = [data[name].iloc[start:stop].tolist() for name in names]
+        outputs = detector._handleBlock(names, columns, start, count,
+                                        recorder)
+      if writer.labels is writers[0].labels:
+        writer.write(outputs, inputRows)
+      else:
+        writer.write(inputs + outputs)
 
 
 def detectDataSet(args):
@@ -121,25 +502,121 @@ def detectDataSet(args):
   given.
 
   @param args   (tuple)   Arguments to run a detector on a file and then
+                          write its results, optionally followed by a
+                          (timingDir, sampleInterval) tuple to also record
+                          the latency of each record.
   """
-  (i, detectorInstance, detectorName, labels, outputDir, relativePath) = args
+  (i, detectorInstance, detectorName, labels, outputDir,
+   relativePath) = args[:6]
+  # Directory and sample interval of the latency files, if timing the detector
+  timing = args[6] if len(args) > 6 else None
 
-  relativeDir, fileName = os.path.split(relativePath)
-  fileName =  detectorName + "_" + fileName
-  outputPath = os.path.join(outputDir, detectorName, relativeDir, fileName)
-  createPath(outputPath)
+  outputPath = _outputPath(outputDir, detectorName, relativePath)
 
   print("%s: Beginning detection with %s for %s" % \
                                                 (i, detectorName, relativePath))
   detectorInstance.initialize()
 
-  results = detectorInstance.run()
+  # Results are written block by block, with the labels joined on, and only
+  # appear at outputPath once complete.
+  recorder = None if timing is None else LatencyRecorder(
+    sampleInterval=timing[1])
+  with ResultsWriter(outputPath, detectorInstance.getHeader(),
+                     labels=labels) as writer:
+    detectorInstance.run(writer, recorder)
 
-  # label=1 for relaxed windows, 0 otherwise
-  results["label"] = labels
-
-  results.to_csv(outputPath, index=False)
+  if recorder is not None:
+    recorder.write(getTimingPath(timing[0], detectorName, relativePath),
+                   detector=detectorName, file=relativePath)
 
   print("%s: Completed processing %s records at %s" % \
-                                        (i, len(results.index), datetime.now()))
+                                        (i, writer.numRows, datetime.now()))
   print("%s: Results have been written to %s" % (i, outputPath))
+
+
+def detectDataSets(args):
+  """
+  Function called in each detector process to run several detectors over one
+  file: the fan-out counterpart of detectDataSet(). The file is sent to the
+  process, and its records iterated, once for all the detectors.
+
+  @param args   (tuple)   As for detectDataSet(), but with a list of detector
+                          instances and a list of their names.
+  """
+  (i, detectorInstances, detectorNames, labels, outputDir,
+   relativePath) = args[:6]
+  timing = args[6] if len(args) > 6 else None
+
+  outputPaths = [_outputPath(outputDir, detectorName, relativePath)
+                 for detectorName in detectorNames]
+
+  print("%s: Beginning detection with %s for %s" %
+        (i, ", ".join(detectorNames), relativePath))
+  for detectorInstance in detectorInstances:
+    detectorInstance.initialize()
+
+  recorders = [None if timing is None else LatencyRecorder(
+    sampleInterval=timing[1]) for _ in detectorInstances]
+  with contextlib.ExitStack() as stack:
+    writers = [stack.enter_context(ResultsWriter(
+      outputPath, detectorInstance.getHeader(), labels=labels))
+               for outputPath, detectorInstance in zip(outputPaths,
+                                                       detectorInstances)]
+    runDetectors(detectorInstances, writers, recorders)
+
+  if timing is not None:
+    for detectorName, recorder in zip(detectorNames, recorders):
+      recorder.write(getTimingPath(timing[0], detectorName, relativePath),
+                     detector=detectorName, file=relativePath)
+
+  print("%s: Completed processing %s records at %s" %
+        (i, writers[0].numRows, datetime.now()))
+  for outputPath in outputPaths:
+    print("%s: Results have been written to %s" % (i, outputPath))
+
+
+def detectSegment(args):
+  """
+  Function called in each detector process to run a detector over one segment
+  of a file, for detectors that support segments.
+
+  @param args   (tuple)   The task number, detector instance and name, path of
+                          the data file, and the start and stop of the
+                          segment.
+
+  @return (list) The detector's output columns for the segment.
+  """
+  i, detectorInstance, detectorName, relativePath, start, stop = args
+
+  print("%s: Beginning detection with %s for records %s-%s of %s" %
+        (i, detectorName, start, stop, relativePath))
+  detectorInstance.initialize()
+  return detectorInstance.runSegment(start, stop)
+
+
+def writeSegments(detectorInstance, detectorName, segments, labels, outputDir,
+                  relativePath):
+  """
+  Writes the results file of a detector run over a file in segments, from
+  the outputs of detectSegment() for each segment in order.
+
+  @param detectorInstance (AnomalyDetector) The detector, for its data set and
+                                            header.
+  @param segments         (list)            Output columns of each segment.
+  """
+  outputs = []
+  for parts in zip(*segments):
+    if all(isinstance(part, numpy.ndarray) for part in parts):
+      outputs.append(numpy.concatenate(parts))
+    else:
+      outputs.append([value for part in parts for value in part])
+
+  data = detectorInstance.dataSet.data
+  outputPath = _outputPath(outputDir, detectorName, relativePath)
+  with ResultsWriter(outputPath, detectorInstance.getHeader(),
+                     labels=labels) as writer:
+    for start in range(0, len(data), writer.blockSize):
+      stop = start + writer.blockSize
+      writer.write([data[name].values[start:stop] for name in data.columns] +
+                   [output[start:stop] for output in outputs])
+  print("Results have been written to %s" % outputPath)
@@ -44,6 +44,22 @@ class BayesChangePtDetector(AnomalyDetector):
   option -- discussed in the comments at the end of handleRecord().
   """
 
+  threadSafe = True
+
+  # Run length arrays of up to maxRunLength, and a score history per record
+  memoryBase = 4 * 2 ** 20
+  memoryPerRecord = 512
+
+  # The run length probabilities, and the parameters of the predictive
+  # distribution for each run length.
+  stateAttributes = {"runLengthProbs": ("f", (None, 2)),
+                     "recordNumber": ("iu", ()),
+                     "previousMaxRun": ("iu", ()),
+                     "alpha": ("f", (None,)),
+                     "beta": ("f", (None,)),
+                     "kappa": ("f", (None,)),
+                     "mu": ("f", (None,))}
+
   def __init__(self, *args, **kwargs):
 
     super(BayesChangePtDetector, self).__init__(*args, **kwargs)
@@ -136,6 +152,36 @@ class BayesChangePtDetector(AnomalyDetector):
     return [anomalyScore]
 
 
+  def getState(self):
+    distribution = self.observationLikelihoood
+    return {"runLengthProbs": self.runLengthProbs.copy(),
+            "recordNumber": numpy.array(self.recordNumber),
+            "previousMaxRun": numpy.array(self.previousMaxRun),
+            "alpha": distribution.alpha.copy(),
+            "beta": distribution.beta.copy(),
+            "kappa": distribution.kappa.copy(),
+            "mu": distribution.mu.copy()}
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    numParameters = len(state["alpha"])
+    if (len(state["runLengthProbs"]) != self.maxRunLength + 2 or
+        any(len(state[name]) != numParameters
+            for name in ("beta", "kappa", "mu"))):
+      raise ValueError("A BayesChangePtDetector snapshot must have %s run "
+                       "lengths, and as many of each parameter" %
+                       (self.maxRunLength + 2))
+    self.runLengthProbs = state["runLengthProbs"]
+    self.recordNumber = int(state["recordNumber"])
+    self.previousMaxRun = int(state["previousMaxRun"])
+    distribution = self.observationLikelihoood
+    distribution.alpha = state["alpha"]
+    distribution.beta = state["beta"]
+    distribution.kappa = state["kappa"]
+    distribution.mu = state["mu"]
+
+
 
 def constantHazard(arraySize, lambdaConst):
   """ The hazard function helps estimate the changepoint prior. Parameter
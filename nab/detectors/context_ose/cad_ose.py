@@ -7,6 +7,8 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import numpy
+
 from functools import cmp_to_key
 from nab.detectors.context_ose.context_operator import ContextOperator
 
@@ -126,3 +128,26 @@ class ContextualAnomalyDetectorOSE(object):
     self.aScoresHistory.append(currentAnomalyScore)
 
     return returnedAnomalyScore
+
+
+  def getState(self):
+    """
+    Returns what the detector has learned as a dict of numpy arrays: the
+    last group of left facts and the history of anomaly scores, along with
+    the context memory.
+    """
+    state = self.contextOperator.getState()
+    state["leftFactsGroup"] = numpy.array(self.leftFactsGroup,
+                                          dtype=numpy.int64)
+    state["aScoresHistory"] = numpy.array(self.aScoresHistory, dtype=float)
+    return state
+
+
+  def setState(self, state):
+    """Restores the state from getState(), given arrays of the right dtypes
+    and numbers of dimensions."""
+    if not len(state["aScoresHistory"]):
+      raise ValueError("The history of anomaly scores can't be empty")
+    self.contextOperator.setState(state)
+    self.leftFactsGroup = tuple(state["leftFactsGroup"].tolist())
+    self.aScoresHistory = state["aScoresHistory"].tolist()
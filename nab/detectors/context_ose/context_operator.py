@@ -7,6 +7,8 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import numpy
+
 class ContextOperator(object):
   
   """
@@ -213,3 +215,106 @@ class ContextOperator(object):
     self.newContextID = False
 
     return activeContexts, numSelectedContext, potentialNewContexts
+
+
+  def getState(self):
+    """
+    Returns the context memory as a dict of integer arrays, suffixed by side
+    (0 for left, 1 for right) where there is one per side. Semi-contexts are
+    known by their index in semiContValLists, and contexts by their ID.
+    """
+    state = {}
+    for side in (0, 1):
+      semiContValLists = self.semiContValLists[side]
+      indices = {id(values): i for i, values in enumerate(semiContValLists)}
+      # The IDs of the semi-contexts are their indices.
+      state["semiContextHashes%d" % side] = numpy.array(
+        list(self.semiContextDics[side]), dtype=numpy.int64)
+      state["semiContextSizes%d" % side] = numpy.array(
+        [values[1] for values in semiContValLists], dtype=numpy.int64)
+      # The facts each semi-context crossed, as many as its count of them.
+      state["crossedCounts%d" % side] = numpy.array(
+        [values[2] for values in semiContValLists], dtype=numpy.int64)
+      state["crossedFacts%d" % side] = numpy.array(
+        [fact for values in semiContValLists for fact in values[0]],
+        dtype=numpy.int64)
+      state["factSemiContexts%d" % side] = numpy.array(
+        [(fact, indices[id(values)])
+         for fact, semiContextList in self.factsDics[side].items()
+         for values in semiContextList], dtype=numpy.int64).reshape(-1, 2)
+      state["crossedSemiContexts%d" % side] = numpy.array(
+        [indices[id(values)]
+         for values in self.crossedSemiContextsLists[side]],
+        dtype=numpy.int64)
+
+    # The contexts of each left semi-context, in the order they were added.
+    state["contextLinks"] = numpy.array(
+      [(leftIndex, rightSemiContextID, contextID)
+       for leftIndex, values in enumerate(self.semiContValLists[0])
+       for rightSemiContextID, contextID in values[3].items()],
+      dtype=numpy.int64).reshape(-1, 3)
+    state["contextsValues"] = numpy.array(
+      self.contextsValuesList, dtype=numpy.int64).reshape(-1, 4)
+    state["newContextID"] = numpy.array(int(self.newContextID))
+    return state
+
+
+  def setState(self, state):
+    """
+    Restores the context memory from getState(), given arrays of the right
+    dtypes and numbers of dimensions.
+    """
+    factsDics = [{}, {}]
+    semiContextDics = [{}, {}]
+    semiContValLists = [[], []]
+    crossedSemiContextsLists = [[], []]
+    for side in (0, 1):
+      hashes = state["semiContextHashes%d" % side].tolist()
+      sizes = state["semiContextSizes%d" % side].tolist()
+      counts = state["crossedCounts%d" % side].tolist()
+      facts = state["crossedFacts%d" % side].tolist()
+      if (len(sizes) != len(hashes) or len(counts) != len(hashes) or
+          len(set(hashes)) != len(hashes) or min(counts, default=0) < 0 or
+          sum(counts) != len(facts)):
+        raise ValueError("Semi-contexts of the snapshot don't match up")
+
+      semiContextDics[side] = {semiContextHash: i
+                               for i, semiContextHash in enumerate(hashes)}
+      start = 0
+      for size, count in zip(sizes, counts):
+        values = [facts[start:start + count], size, count]
+        if side == 0:
+          values.append({})
+        semiContValLists[side].append(values)
+        start += count
+
+      factSemiContexts = state["factSemiContexts%d" % side]
+      _checkIndices(factSemiContexts[:, 1], len(hashes))
+      for fact, index in factSemiContexts.tolist():
+        factsDics[side].setdefault(fact, []).append(
+          semiContValLists[side][index])
+      crossed = state["crossedSemiContexts%d" % side]
+      _checkIndices(crossed, len(hashes))
+      crossedSemiContextsLists[side] = [semiContValLists[side][index]
+                                        for index in crossed.tolist()]
+
+    contextsValuesList = state["contextsValues"].tolist()
+    contextLinks = state["contextLinks"]
+    _checkIndices(contextLinks[:, 0], len(semiContValLists[0]))
+    _checkIndices(contextLinks[:, 1], len(semiContValLists[1]))
+    _checkIndices(contextLinks[:, 2], len(contextsValuesList))
+    for leftIndex, rightSemiContextID, contextID in contextLinks.tolist():
+      semiContValLists[0][leftIndex][3][rightSemiContextID] = contextID
+
+    self.factsDics = factsDics
+    self.semiContextDics = semiContextDics
+    self.semiContValLists = semiContValLists
+    self.crossedSemiContextsLists = crossedSemiContextsLists
+    self.contextsValuesList = contextsValuesList
+    self.newContextID = int(state["newContextID"])
+
+
+
+def _checkIndices(indices, size):
+  if len(indices) and (indices.min() < 0 or indices.max() >= size):
+    raise ValueError("Indices of the snapshot must be below %s" % size)
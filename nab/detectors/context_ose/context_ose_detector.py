@@ -18,6 +18,30 @@ class ContextOSEDetector(AnomalyDetector):
   https://github.com/smirmik/CAD
   """
 
+  supportsCostProbe = True
+
+  threadSafe = True
+
+  # The state of cadose, with semi-contexts of the left (0) and right (1)
+  # sides: see ContextualAnomalyDetectorOSE.getState().
+  stateAttributes = {"leftFactsGroup": ("i", (None,)),
+                     "aScoresHistory": ("f", (None,)),
+                     "semiContextHashes0": ("i", (None,)),
+                     "semiContextHashes1": ("i", (None,)),
+                     "semiContextSizes0": ("i", (None,)),
+                     "semiContextSizes1": ("i", (None,)),
+                     "crossedCounts0": ("i", (None,)),
+                     "crossedCounts1": ("i", (None,)),
+                     "crossedFacts0": ("i", (None,)),
+                     "crossedFacts1": ("i", (None,)),
+                     "factSemiContexts0": ("i", (None, 2)),
+                     "factSemiContexts1": ("i", (None, 2)),
+                     "crossedSemiContexts0": ("i", (None,)),
+                     "crossedSemiContexts1": ("i", (None,)),
+                     "contextLinks": ("i", (None, 3)),
+                     "contextsValues": ("i", (None, 4)),
+                     "newContextID": ("i", ())}
+
   def __init__(self, *args, **kwargs):
 
     super(ContextOSEDetector, self).__init__(*args, **kwargs)
@@ -29,6 +53,13 @@ class ContextOSEDetector(AnomalyDetector):
     anomalyScore = self.cadose.getAnomalyScore(inputData)
     return (anomalyScore,)
 
+  def getState(self):
+    return self.cadose.getState()
+
+  def setState(self, state):
+    self.cadose.setState(self.checkState(state))
+
+
   def initialize(self):
 
     self.cadose = ContextualAnomalyDetectorOSE (
@@ -1,5 +1,6 @@
 import time
 import sys
+import numpy
 from nab.detectors.base import AnomalyDetector
 
 from nab.detectors.earthgecko_skyline.algorithms import (
@@ -82,6 +83,18 @@ class EarthgeckoSkylineDetector(AnomalyDetector):
     Detects anomalies using earthgecko Skyline's ensemble of algorithms.
     """
 
+    # Two copies of the running history, which the algorithms run over.
+    memoryBase = 4 * 2 ** 20
+    memoryPerRecord = 768
+
+    # The running history, as epoch timestamps and values, and that of the
+    # records that weren't skipped with their anomaly scores.
+    stateAttributes = {"timestamps": ("iu", (None,)),
+                       "values": ("fiu", (None,)),
+                       "scoredTimestamps": ("iu", (None,)),
+                       "scoredValues": ("fiu", (None,)),
+                       "anomalyScores": ("f", (None,))}
+
     def __init__(self, *args, **kwargs):
 
         # Initialize the parent
@@ -262,3 +275,28 @@ class EarthgeckoSkylineDetector(AnomalyDetector):
         if AVERAGESCORE:
             return [averageScore]
         return [anomalyScore]
+
+    def getState(self):
+        scored = self.timeseries_and_anomalyscores
+        return {"timestamps": numpy.array([row[0] for row in self.timeseries],
+                                          dtype=numpy.int64),
+                "values": numpy.array([row[1] for row in self.timeseries]),
+                "scoredTimestamps": numpy.array([row[0] for row in scored],
+                                                dtype=numpy.int64),
+                "scoredValues": numpy.array([row[1] for row in scored]),
+                "anomalyScores": numpy.array([row[2] for row in scored],
+                                             dtype=float)}
+
+    def setState(self, state):
+        state = self.checkState(state)
+        numScored = len(state["anomalyScores"])
+        if (len(state["timestamps"]) != len(state["values"]) or
+                len(state["scoredTimestamps"]) != numScored or
+                len(state["scoredValues"]) != numScored):
+            raise ValueError("An EarthgeckoSkylineDetector snapshot must have "
+                             "a value for each timestamp")
+        self.timeseries = [list(row) for row in zip(
+            state["timestamps"].tolist(), state["values"].tolist())]
+        self.timeseries_and_anomalyscores = [list(row) for row in zip(
+            state["scoredTimestamps"].tolist(), state["scoredValues"].tolist(),
+            state["anomalyScores"].tolist())]
@@ -24,6 +24,15 @@ class ExposeDetector(AnomalyDetector):
   have been tuned to give the best performance.
   """
 
+  # The model and the number of records in it. The kernel is refit to each
+  # record, from a fixed random state, so isn't part of the state.
+  stateAttributes = {"previousExposeModel": ("f", (None, None)),
+                     "timestep": ("iu", ())}
+
+  # Arrays of the kernel's 20000 components: its weights and offsets, the
+  # feature vector of each record and the model, and their temporaries.
+  memoryBase = 16 * 2 ** 20
+
   def __init__(self, *args, **kwargs):
     super(ExposeDetector, self).__init__(*args, **kwargs)
 
@@ -70,3 +79,22 @@ class ExposeDetector(AnomalyDetector):
     self.timestep += 1
 
     return [anomalyScore]
+
+
+  def getState(self):
+    # Before the first record, there is no model yet.
+    model = numpy.array(self.previousExposeModel, dtype=float)
+    return {"previousExposeModel": model.reshape(-1,
+                                                 self.kernel.n_components),
+            "timestep": numpy.array(self.timestep)}
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    if state["previousExposeModel"].shape != (
+        min(int(state["timestep"]), 1), self.kernel.n_components):
+      raise ValueError("An ExposeDetector snapshot must have a model of %s "
+                       "components once past the first record" %
+                       self.kernel.n_components)
+    self.previousExposeModel = state["previousExposeModel"]
+    self.timestep = int(state["timestep"])
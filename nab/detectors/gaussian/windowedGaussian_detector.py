@@ -39,6 +39,21 @@ class WindowedGaussianDetector(AnomalyDetector):
   on NAB.
   """
 
+  supportsBatch = True
+
+  supportsSegments = True
+
+  supportsCostProbe = True
+
+  threadSafe = True
+
+  # The window and its statistics, and the records for its next step.
+  stateAttributes = {"windowData": ("fiu", (None,)),
+                     "stepBuffer": ("fiu", (None,)),
+                     "mean": ("fiu", ()),
+                     "std": ("fiu", ())}
+
+
   def __init__(self, *args, **kwargs):
     super(WindowedGaussianDetector, self).__init__(*args, **kwargs)
 
@@ -78,8 +93,83 @@ class WindowedGaussianDetector(AnomalyDetector):
     return (anomalyScore, )
 
 
-  def _updateWindow(self):
-    self.mean = numpy.mean(self.windowData)
-    self.std = numpy.std(self.windowData)
+  def handleRecords(self, timestamps, values):
+    """Returns a list [anomalyScores], the same as handleRecord() would return
+    record by record.
+
+    Records are grouped into runs that are scored against the same window
+    statistics: single records while the window fills, then whole steps once
+    it is full. The statistics are recomputed from the same values as in
+    handleRecord(), so the scores are identical.
+    """
+    numRecords = len(values)
+    history = numpy.concatenate((self.windowData, self.stepBuffer, values))
+    offset = len(self.windowData) + len(self.stepBuffer)
+    start = 0
+    windowLength = len(self.windowData)
+    bufferLength = len(self.stepBuffer)
+
+    means = numpy.empty(numRecords)
+    stds = numpy.empty(numRecords)
+    unscored = 0
+    i = 0
+    while i < numRecords:
+      if windowLength < self.windowSize:
+        if windowLength == 0:
+          unscored = 1
+        means[i] = self.mean
+        stds[i] = self.std
+        windowLength += 1
+        i += 1
+        self._updateWindow(history[start:start + windowLength])
+      else:
+        runLength = min(self.stepSize - bufferLength, numRecords - i)
+        means[i:i + runLength] = self.mean
+        stds[i:i + runLength] = self.std
+        bufferLength += runLength
+        i += runLength
+        if bufferLength == self.stepSize:
+          # slide window forward by stepSize
+          start += self.stepSize
+          bufferLength = 0
+          self._updateWindow(history[start:start + windowLength])
+
+    self.windowData = history[start:start + windowLength].tolist()
+    self.stepBuffer = history[start + windowLength:
+                              start + windowLength + bufferLength].tolist()
+
+    # normalProbability(), element-wise
+    x = history[offset:]
+    x = numpy.where(x < means, 2*means - x, x)
+    z = (x - means) / stds / math.sqrt(2)
+    tail = 0.5 * numpy.fromiter(map(math.erfc, z.tolist()), float, numRecords)
+    anomalyScores = 1 - tail
+    anomalyScores[:unscored] = 0.0
+
+    return [anomalyScores]
+
+
+  def getWarmUpStart(self, start):
+    """Returns the start of the window at record `start`. A new detector fed
+    from there fills its window with the same values, then its step buffer,
+    and recomputes the same statistics."""
+    if start <= self.windowSize:
+      return 0
+    return (start - self.windowSize) // self.stepSize * self.stepSize
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    self.windowData = state["windowData"].tolist()
+    self.stepBuffer = state["stepBuffer"].tolist()
+    self.mean = state["mean"][()]
+    self.std = state["std"][()]
+
+
+  def _updateWindow(self, windowData=None):
+    if windowData is None:
+      windowData = self.windowData
+    self.mean = numpy.mean(windowData)
+    self.std = numpy.std(windowData)
     if self.std == 0.0:
       self.std = 0.000001
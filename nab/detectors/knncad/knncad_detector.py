@@ -5,6 +5,20 @@ import math
 
 class KnncadDetector(AnomalyDetector):
 
+    supportsCostProbe = True
+
+    threadSafe = True
+
+    # The values so far, the training and calibration windows with the scores
+    # of the training ones, and the metric.
+    stateAttributes = {"buf": ("fiu", (None,)),
+                       "training": ("fiu", (None, None)),
+                       "calibration": ("fiu", (None, None)),
+                       "scores": ("f", (None,)),
+                       "record_count": ("iu", ()),
+                       "pred": ("iu", ()),
+                       "sigma": ("f", (None, None))}
+
     def __init__(self, *args, **kwargs):
         super(KnncadDetector, self).__init__(*args, **kwargs)
 
@@ -67,3 +81,27 @@ class KnncadDetector(AnomalyDetector):
                 elif result >= 0.9965:
                     self.pred = int(self.probationaryPeriod/5)
                 return [result]
+
+    def getState(self):
+        return {"buf": np.array(self.buf),
+                "training": np.array(self.training).reshape(-1, self.dim),
+                "calibration": np.array(self.calibration).reshape(-1, self.dim),
+                "scores": np.array(self.scores, dtype=float),
+                "record_count": np.array(self.record_count),
+                "pred": np.array(self.pred),
+                "sigma": self.sigma.copy()}
+
+    def setState(self, state):
+        state = self.checkState(state)
+        if (state["training"].shape[1] != self.dim or
+                state["calibration"].shape[1] != self.dim or
+                state["sigma"].shape != (self.dim, self.dim)):
+            raise ValueError("A KnncadDetector snapshot must have windows of "
+                             "%s values" % self.dim)
+        self.buf = state["buf"].tolist()
+        self.training = state["training"].tolist()
+        self.calibration = state["calibration"].tolist()
+        self.scores = state["scores"].tolist()
+        self.record_count = int(state["record_count"])
+        self.pred = int(state["pred"])
+        self.sigma = state["sigma"]
@@ -12,13 +12,30 @@ This detector establishes a baseline score by recording a constant value for all
 data points.
 """
 
+import numpy
+
 from nab.detectors.base import AnomalyDetector
 
 
 
 class NullDetector(AnomalyDetector):
 
+  supportsBatch = True
+
+  supportsCostProbe = True
+
+  threadSafe = True
+
+  # The scores don't depend on the records.
+  stateAttributes = {}
+
+
   def handleRecord(self, inputData):
     """The anomaly score is simply a constant 0.5."""
     anomalyScore = 0.5
     return (anomalyScore, )
+
+
+  def handleRecords(self, timestamps, values):
+    """The anomaly scores are all a constant 0.5."""
+    return [numpy.full(len(values), 0.5)]
@@ -7,6 +7,7 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import numpy
 import random
 from nab.detectors.base import AnomalyDetector
 
@@ -14,6 +15,18 @@ from nab.detectors.base import AnomalyDetector
 
 class RandomDetector(AnomalyDetector):
 
+  supportsBatch = True
+
+  supportsCostProbe = True
+
+  threadSafe = True
+
+  # The state of the generator: its 624 words and position, and the next
+  # gaussian if one is pending.
+  stateAttributes = {"randomState": ("u", (625,)),
+                     "randomGauss": ("f", (None,))}
+
+
   def __init__(self, *args, **kwargs):
 
     super(RandomDetector, self).__init__(*args, **kwargs)
@@ -25,9 +38,37 @@ class RandomDetector(AnomalyDetector):
     """Returns a tuple (anomalyScore).
     The anomalyScore is simply a random value from 0 to 1
     """
-    anomalyScore = random.uniform(0,1)
+    anomalyScore = self.random.uniform(0,1)
     return (anomalyScore, )
 
 
+  def handleRecords(self, timestamps, values):
+    """Returns a list [anomalyScores], drawn in the same sequence as by
+    handleRecord().
+    """
+    uniform = self.random.uniform
+    return [[uniform(0, 1) for _ in range(len(values))]]
+
+
   def initialize(self):
-    random.seed(self.seed)
+    """Each detector draws from its own generator, so detectors run in
+    threads of one process don't share a sequence. Seeded the same, it draws
+    the same values as the random module would."""
+    self.random = random.Random(self.seed)
+
+
+  def getState(self):
+    version, internalState, gaussNext = self.random.getstate()
+    return {"randomState": numpy.array(internalState, dtype=numpy.uint32),
+            "randomGauss": numpy.array([] if gaussNext is None
+                                       else [gaussNext])}
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    gaussNext = state["randomGauss"].tolist()
+    if len(gaussNext) > 1:
+      raise ValueError("A RandomDetector snapshot has at most one gaussian")
+    self.random.setstate((random.Random.VERSION,
+                          tuple(state["randomState"].tolist()),
+                          gaussNext[0] if gaussNext else None))
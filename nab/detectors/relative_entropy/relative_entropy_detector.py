@@ -36,6 +36,13 @@ class RelativeEntropyDetector(AnomalyDetector):
   have been tuned for best performance of NAB.
   """
 
+  threadSafe = True
+
+  # The values so far, and each hypothesis with its count of windows.
+  stateAttributes = {"util": ("fiu", (None,)),
+                     "P": ("f", (None, None)),
+                     "c": ("iu", (None,))}
+
   def __init__(self, *args, **kwargs):
     """ Variable names are kept consistent with algorithm's pseudo code in
     the paper."""
@@ -169,3 +176,21 @@ class RelativeEntropyDetector(AnomalyDetector):
         minEntropy = entropy
         index = i
     return index
+
+
+  def getState(self):
+    return {"util": numpy.array(self.util),
+            "P": numpy.array(self.P, dtype=float).reshape(-1, self.N_bins),
+            "c": numpy.array(self.c, dtype=int)}
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    if (state["P"].shape[1] != self.N_bins or
+        len(state["P"]) != len(state["c"])):
+      raise ValueError("A RelativeEntropyDetector snapshot must have a count "
+                       "for each hypothesis of %s bins" % self.N_bins)
+    self.util = state["util"].tolist()
+    self.P = list(state["P"])
+    self.c = state["c"].tolist()
+    self.m = len(self.P)
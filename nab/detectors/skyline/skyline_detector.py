@@ -1,3 +1,6 @@
+import numpy
+import pandas
+
 from nab.detectors.base import AnomalyDetector
 
 from nab.detectors.skyline.algorithms import (median_absolute_deviation,
@@ -19,6 +22,16 @@ class SkylineDetector(AnomalyDetector):
   of the algorithms' votes as an anomaly score.
   """
 
+  threadSafe = True
+
+  # The algorithms run over the whole series so far, at every record.
+  memoryBase = 6 * 2 ** 20
+  memoryPerRecord = 512
+
+  # The running history, as timestamps and values.
+  stateAttributes = {"timestamps": ("M", (None,)),
+                     "values": ("fiu", (None,))}
+
   def __init__(self, *args, **kwargs):
 
     # Initialize the parent
@@ -49,3 +62,18 @@ class SkylineDetector(AnomalyDetector):
 
     averageScore = score / (len(self.algorithms) + 1)
     return [averageScore]
+
+
+  def getState(self):
+    return {"timestamps": numpy.array([row[0] for row in self.timeseries],
+                                      dtype="datetime64[ns]"),
+            "values": numpy.array([row[1] for row in self.timeseries])}
+
+
+  def setState(self, state):
+    state = self.checkState(state)
+    if len(state["timestamps"]) != len(state["values"]):
+      raise ValueError("A SkylineDetector snapshot must have a value for "
+                       "each timestamp")
+    self.timeseries = [list(row) for row in zip(
+      pandas.DatetimeIndex(state["timestamps"]), state["values"].tolist())]
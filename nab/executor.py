@@ -0,0 +1,307 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Executors that the Runner spreads the tasks of its stages with.
+
+Each executor has the `map_async()` of a `multiprocessing.Pool`, which the
+stages call, and creates what it runs tasks on only when first given tasks.
+Close an executor, or use it as a context manager, to stop its workers.
+
+- "process": a pool of worker processes, the default. Tasks and their
+  results are pickled, but run on every CPU whatever they do.
+- "thread": a pool of threads in this process. Nothing is pickled or forked,
+  which suits tasks that spend their time outside the GIL, in numpy or in
+  subprocesses; pure Python tasks run one at a time.
+- "serial": tasks run one after the other in the calling thread, for
+  profiling and debugging.
+
+A `TaskQueue` runs sets of tasks on an executor, and can hold tasks back so
+those running at once fit in a memory budget.
+"""
+
+import collections
+import functools
+import multiprocessing
+import multiprocessing.pool
+import queue
+
+from nab.memory import measureTask
+
+
+
+class SerialResult(object):
+  """The result of SerialExecutor.map_async(), with the interface of
+  multiprocessing's AsyncResult."""
+
+  def __init__(self, results, error=None):
+    self.results = results
+    self.error = error
+
+
+  def get(self, timeout=None):
+    if self.error is not None:
+      raise self.error
+    return self.results
+
+
+  def ready(self):
+    return True
+
+
+
+class Executor(object):
+  """
+  Base class of executors, which run tasks on a pool created on first use.
+  """
+
+  def __init__(self, numWorkers=None):
+    """
+    @param numWorkers (int) Number of processes or threads; the number of
+                            CPUs by default.
+    """
+    self.numWorkers = numWorkers
+    self._pool = None
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, excType, excValue, traceback):
+    if excType is None:
+      self.close()
+    else:
+      self.terminate()
+
+
+  def _createPool(self):
+    raise NotImplementedError
+
+
+  @property
+  def pool(self):
+    if self._pool is None:
+      self._pool = self._createPool()
+    return self._pool
+
+
+  def map_async(self, function, iterable, callback=None, error_callback=None):
+    """
+    Starts calling `function` on each item of `iterable`.
+
+    @param callback       (callable)  Called with the list of results once
+                                      they are all done, if given.
+    @param error_callback (callable)  Called with the exception instead, if
+                                      one is raised.
+
+    @return An object whose get(timeout) returns the list of results, in
+            order, once they are all done.
+    """
+    return self.pool.map_async(function, iterable, callback=callback,
+                               error_callback=error_callback)
+
+
+  def map(self, function, iterable):
+    """Returns the list of the results of `function` on each item."""
+    # Using `map_async` instead of `map` so interrupts are properly handled.
+    # See: http://stackoverflow.com/a/1408476
+    return self.map_async(function, iterable).get(999999)
+
+
+  def close(self):
+    """Waits for the tasks given so far, then stops the workers."""
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+
+
+  def terminate(self):
+    """Stops the workers at once, abandoning any tasks."""
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool.join()
+      self._pool = None
+
+
+
+class ProcessExecutor(Executor):
+
+  def _createPool(self):
+    return multiprocessing.Pool(self.numWorkers)
+
+
+
+class ThreadExecutor(Executor):
+
+  def _createPool(self):
+    return multiprocessing.pool.ThreadPool(self.numWorkers)
+
+
+
+class SerialExecutor(Executor):
+  """Runs tasks as they are given. There is no pool to create or stop."""
+
+  def map_async(self, function, iterable, callback=None, error_callback=None):
+    try:
+      results = [function(item) for item in iterable]
+    except Exception as e:
+      if error_callback is None:
+        raise
+      error_callback(e)
+      return SerialResult(None, e)
+    if callback is not None:
+      callback(results)
+    return SerialResult(results)
+
+
+
+class TaskQueue(object):
+  """
+  Runs sets of tasks on an executor, and calls a function in this thread with
+  the results of each set once they are all done, which may submit more.
+
+  Given a memory budget, each task is submitted on its own with an estimate
+  of the memory it takes, and tasks are admitted in the order submitted only
+  while the sum of the estimates of those running stays within the budget; a
+  task estimated at more than the whole budget runs alone. The peak memory of
+  each task is then measured as it runs; see `nab.memory`.
+  """
+
+  def __init__(self, executor, memoryBudget=None):
+    """
+    @param executor     (Executor)  Executor to run the tasks on.
+    @param memoryBudget (int)       Bytes the tasks running at once may be
+                                    estimated to take, if limited.
+    """
+    self.executor = executor
+    self.memoryBudget = memoryBudget
+    # Each task or set of tasks puts the function to call with its results,
+    # the results, and any exception here when done.
+    self.done = queue.Queue()
+    self.numPending = 0
+    # Tasks held back by the budget, and the estimates of those admitted
+    self.waiting = collections.deque()
+    self.admitted = 0
+    self.numAdmitted = 0
+
+
+  def submit(self, function, args, then=None, estimates=None, measured=None):
+    """
+    Submits a set of tasks.
+
+    @param function   (callable)  Function to call on each of `args`.
+    @param args       (list)      Argument of each task.
+    @param then       (callable)  Called with the list of results once they
+                                  are all done, if given.
+    @param estimates  (list)      Bytes each task is estimated to take; none
+                                  by default. Only used with a budget.
+    @param measured   (callable)  Called as each task finishes with its index,
+                                  the peak RSS of its process and the RSS of
+                                  the process before its first task, if
+                                  given. Only used with a budget.
+    """
+    self.numPending += 1
+    if not args:
+      self.done.put((functools.partial(self._setDone, then), [], None))
+      return
+    if self.memoryBudget is None:
+      self.executor.map_async(
+        function, args,
+        callback=lambda results: self.done.put(
+          (functools.partial(self._setDone, then), results, None)),
+        error_callback=lambda error: self.done.put((None, None, error)))
+      return
+
+    taskSet = {"then": then,
+               "measured": measured,
+               "results": [None] * len(args),
+               "remaining": len(args)}
+    for i, arg in enumerate(args):
+      estimate = estimates[i] if estimates is not None else 0
+      self.waiting.append((taskSet, i, function, arg, estimate))
+    self._admit()
+
+
+  def _admit(self):
+    while self.waiting:
+      taskSet, i, function, arg, estimate = self.waiting[0]
+      if (self.numAdmitted and
+          self.admitted + estimate > self.memoryBudget):
+        return
+      self.waiting.popleft()
+      self.admitted += estimate
+      self.numAdmitted += 1
+      self.executor.map_async(
+        measureTask, [(function, arg)],
+        callback=functools.partial(self._taskFinished, taskSet, i, estimate),
+        error_callback=lambda error: self.done.put((None, None, error)))
+
+
+  def _taskFinished(self, taskSet, i, estimate, results):
+    self.done.put((functools.partial(self._taskDone, taskSet, i, estimate),
+                   results[0], None))
+
+
+  def _taskDone(self, taskSet, i, estimate, measurement):
+    result, peakRSS, baselineRSS = measurement
+    self.admitted -= estimate
+    self.numAdmitted -= 1
+    taskSet["results"][i] = result
+    if taskSet["measured"] is not None:
+      taskSet["measured"](i, peakRSS, baselineRSS)
+    taskSet["remaining"] -= 1
+    if taskSet["remaining"] == 0:
+      self._setDone(taskSet["then"], taskSet["results"])
+    self._admit()
+
+
+  def _setDone(self, then, results):
+    self.numPending -= 1
+    if then is not None:
+      then(results)
+
+
+  def run(self):
+    """
+    Runs until all the tasks submitted, including those submitted as others
+    finish, are done.
+
+    Raises the first exception of a task.
+    """
+    while self.numPending:
+      handler, results, error = self.done.get(True, 999999)
+      if error is not None:
+        raise error
+      handler(results)
+
+
+
+EXECUTORS = {
+  "process": ProcessExecutor,
+  "thread": ThreadExecutor,
+  "serial": SerialExecutor,
+}
+
+
+def getExecutor(executor, numWorkers=None):
+  """
+  Returns an executor.
+
+  @param executor   (string or Executor)  Name of the kind of executor, in
+                                          EXECUTORS, or an executor to return
+                                          as is.
+  @param numWorkers (int)                 Number of workers of a new one.
+  """
+  if isinstance(executor, Executor):
+    return executor
+  if executor not in EXECUTORS:
+    raise ValueError("Unknown executor '%s'; choose from %s" %
+                     (executor, ", ".join(sorted(EXECUTORS))))
+  return EXECUTORS[executor](numWorkers)
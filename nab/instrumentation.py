@@ -0,0 +1,269 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Per-record latency instrumentation of detectors.
+
+`AnomalyDetector.run()` can time its calls to handleRecord() into a
+`LatencyRecorder`, which keeps an HDR-style histogram of the latencies and a
+trace of latency against record index, to show how a detector slows down as
+its state grows.
+"""
+
+import math
+import os
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+from nab.util import createPath, writeJSON
+
+
+
+class LatencyHistogram(object):
+  """
+  Histogram of latencies in nanoseconds, with buckets of bounded relative
+  width, as in HdrHistogram.
+
+  Values below `subBucketCount` have a bucket each. Above that, each power of
+  two range is split into `subBucketCount / 2` buckets, so any value is
+  reported to within `10 ** -significantDigits` of itself, in constant memory
+  whatever the range of latencies.
+  """
+
+  def __init__(self, significantDigits=2):
+    """
+    @param significantDigits (int)  Decimal digits of precision of the buckets.
+    """
+    self.significantDigits = significantDigits
+    self.subBucketCount = 2 ** int(math.ceil(
+      math.log(2 * 10 ** significantDigits, 2)))
+    self.subBucketBits = self.subBucketCount.bit_length() - 1
+    self.counts = {}
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+
+  def _index(self, value):
+    shift = max(value.bit_length() - self.subBucketBits, 0)
+    if shift == 0:
+      return value
+    half = self.subBucketCount // 2
+    return (shift - 1) * half + (value >> shift) + half
+
+
+  def _highestEquivalent(self, index):
+    """Largest value that falls in a bucket."""
+    if index < self.subBucketCount:
+      return index
+    half = self.subBucketCount // 2
+    shift = (index - self.subBucketCount) // half + 1
+    subBucket = (index - self.subBucketCount) % half + half
+    return ((subBucket + 1) << shift) - 1
+
+
+  def record(self, value, count=1):
+    """
+    @param value  (int)   Latency in nanoseconds.
+    @param count  (int)   Number of times the latency was seen.
+    """
+    value = max(int(value), 0)
+    index = self._index(value)
+    self.counts[index] = self.counts.get(index, 0) + count
+    self.count += count
+    self.total += value * count
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+
+  def add(self, other):
+    """Add the counts of another histogram of the same precision."""
+    if other.significantDigits != self.significantDigits:
+      raise ValueError("Histograms must have the same precision")
+    for index, count in other.counts.items():
+      self.counts[index] = self.counts.get(index, 0) + count
+    self.count += other.count
+    self.total += other.total
+    for value in (other.min, other.max):
+      if value is not None:
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+  def percentile(self, percentile):
+    """
+    @param percentile (float) Between 0 and 100.
+
+    @return (int) Latency in nanoseconds at or below which `percentile` percent
+                  of the recorded latencies lie, to the histogram's precision;
+                  None if the histogram is empty.
+    """
+    if not self.count:
+      return None
+    rank = max(int(math.ceil(percentile / 100.0 * self.count)), 1)
+    seen = 0
+    for index in sorted(self.counts):
+      seen += self.counts[index]
+      if seen >= rank:
+        return min(self._highestEquivalent(index), self.max)
+    return self.max
+
+
+  def summary(self):
+    """Returns a dict of the usual statistics, in microseconds."""
+    micros = lambda nanos: None if nanos is None else nanos / 1000.0
+    return {
+      "count": self.count,
+      "meanMicros": micros(self.total / self.count) if self.count else None,
+      "minMicros": micros(self.min),
+      "p50Micros": micros(self.percentile(50)),
+      "p90Micros": micros(self.percentile(90)),
+      "p99Micros": micros(self.percentile(99)),
+      "p999Micros": micros(self.percentile(99.9)),
+      "maxMicros": micros(self.max)
+    }
+
+
+  def toDict(self):
+    return {
+      "significantDigits": self.significantDigits,
+      "counts": sorted([index, count] for index, count in self.counts.items()),
+      "count": self.count,
+      "total": self.total,
+      "min": self.min,
+      "max": self.max
+    }
+
+
+  @classmethod
+  def fromDict(cls, histogramDict):
+    histogram = cls(histogramDict["significantDigits"])
+    histogram.counts = {index: count
+                        for index, count in histogramDict["counts"]}
+    histogram.count = histogramDict["count"]
+    histogram.total = histogramDict["total"]
+    histogram.min = histogramDict["min"]
+    histogram.max = histogramDict["max"]
+    return histogram
+
+
+
+class LatencyRecorder(object):
+  """
+  Latencies of a detector's handleRecord() calls on one data file.
+
+  Only one in every `sampleInterval` records is timed. The trace splits the
+  file into segments of `segmentSize` records and keeps the mean and maximum
+  sampled latency of each.
+  """
+
+  def __init__(self, sampleInterval=1, segmentSize=1000, significantDigits=2):
+    """
+    @param sampleInterval     (int)   Time every this many records.
+    @param segmentSize        (int)   Records per segment of the trace.
+    @param significantDigits  (int)   Precision of the histogram.
+    """
+    self.sampleInterval = sampleInterval
+    self.segmentSize = segmentSize
+    self.histogram = LatencyHistogram(significantDigits)
+    self.numRecords = 0
+    # Segment start to [count, total, max], in nanoseconds.
+    self.segments = {}
+
+
+  def record(self, recordIndex, nanos):
+    """Record the latency of the record at `recordIndex`, in nanoseconds."""
+    self.histogram.record(nanos)
+    segment = self.segments.setdefault(
+      recordIndex - recordIndex % self.segmentSize, [0, 0, 0])
+    segment[0] += 1
+    segment[1] += nanos
+    segment[2] = max(segment[2], nanos)
+
+
+  def toDict(self):
+    result = self.histogram.summary()
+    result.update({
+      "records": self.numRecords,
+      "sampleInterval": self.sampleInterval,
+      "segmentSize": self.segmentSize,
+      "trace": [
+        {"start": start,
+         "count": count,
+         "meanMicros": total / count / 1000.0,
+         "maxMicros": maxNanos / 1000.0}
+        for start, (count, total, maxNanos) in sorted(self.segments.items())],
+      "histogram": self.histogram.toDict()
+    })
+    return result
+
+
+  def write(self, path, **info):
+    """
+    Write the latencies to a JSON file.
+
+    @param path (string)  Path of the file.
+    @param info (dict)    Extra fields to write, e.g. "detector" and "file".
+    """
+    result = dict(info)
+    result.update(self.toDict())
+    createPath(path)
+    writeJSON(path, result)
+
+
+
+def getTimingPath(timingDir, detectorName, relativePath):
+  """
+  Returns the path of the latency file of a detector on a data file.
+
+  @param timingDir    (string)  Root of the latency files.
+  @param detectorName (string)  Name of the detector.
+  @param relativePath (string)  Path of the data file within the corpus.
+  """
+  relativeDir, fileName = os.path.split(relativePath)
+  fileName = detectorName + "_" + os.path.splitext(fileName)[0] + ".json"
+  return os.path.join(timingDir, detectorName, relativeDir, fileName)
+
+
+
+def summarizeTiming(timingDir, detectorName):
+  """
+  Merge the latency files of a detector.
+
+  @param timingDir    (string)  Root of the latency files.
+  @param detectorName (string)  Name of the detector.
+
+  @return (dict)  Latency summary over all of the detector's data files, with
+                  each file's own summary under "files".
+  """
+  histogram = None
+  files = {}
+  detectorDir = os.path.join(timingDir, detectorName)
+  for dirpath, _, fileNames in os.walk(detectorDir):
+    for fileName in sorted(fileNames):
+      if not fileName.endswith(".json"):
+        continue
+      with open(os.path.join(dirpath, fileName)) as inFile:
+        result = json.load(inFile)
+      fileHistogram = LatencyHistogram.fromDict(result["histogram"])
+      if histogram is None:
+        histogram = fileHistogram
+      else:
+        histogram.add(fileHistogram)
+      files[result.get("file", fileName)] = {
+        key: value for key, value in result.items()
+        if key not in ("histogram", "trace")}
+
+  summary = (histogram or LatencyHistogram()).summary()
+  summary["files"] = files
+  return summary
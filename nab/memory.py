@@ -0,0 +1,196 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Memory use of detection tasks.
+
+Given a memory budget, the Runner only runs as many detection tasks at once as
+the sum of their estimated peak memory fits in; see `nab.executor.TaskQueue`.
+A task's estimate is the `memoryBase` of each of its detectors plus their
+`memoryPerRecord` times the number of records it handles, scaled by the
+largest ratio of measured to estimated memory of the detector in earlier runs.
+
+The peak memory of a task is measured in the worker process it runs in, as
+the growth of the process's resident set size (RSS) at its peak over the RSS
+it had before its first task. This needs Linux, where the peak can be reset
+before each task. Peaks are per process, so tasks running in threads of one
+process are measured together.
+"""
+
+from nab.util import getOldDict, writeJSON
+
+MB = 2 ** 20
+
+# RSS of this process before its first measured task
+_baselineRSS = None
+
+
+
+def _statusBytes(field):
+  """Returns a size in /proc/self/status, in bytes."""
+  with open("/proc/self/status") as f:
+    for line in f:
+      if line.startswith(field + ":"):
+        return int(line.split()[1]) * 1024
+  return None
+
+
+def resetPeakRSS():
+  """
+  Resets the peak RSS of this process to its current RSS.
+
+  @return (bool) Whether it could be, i.e. on Linux.
+  """
+  try:
+    with open("/proc/self/clear_refs", "w") as f:
+      f.write("5")
+  except (IOError, OSError):
+    return False
+  return True
+
+
+def measureTask(args):
+  """
+  Function called in each worker process to run a task and measure its peak
+  memory.
+
+  @param args (tuple) A function, and the argument to call it with.
+
+  @return (tuple) The result of the function, the peak RSS of the process
+                  while it ran, and the RSS of the process before its first
+                  task, both in bytes, or None where they can't be measured.
+  """
+  global _baselineRSS
+  function, taskArgs = args
+  if not resetPeakRSS():
+    return function(taskArgs), None, None
+  if _baselineRSS is None:
+    _baselineRSS = _statusBytes("VmRSS")
+  result = function(taskArgs)
+  return result, _statusBytes("VmHWM"), _baselineRSS
+
+
+
+class MemoryEstimator(object):
+  """
+  Estimates of the peak memory of detection tasks, and the peaks measured.
+  """
+
+  def __init__(self, detectors, path=None, margin=1.2):
+    """
+    @param detectors  (dict)    Detector classes by name.
+    @param path       (string)  JSON file of the measurements of earlier
+                                runs, to refine the estimates with, and where
+                                write() adds those of this run.
+    @param margin     (float)   Factor on estimates refined by measurements,
+                                for what they may have missed.
+    """
+    self.detectors = detectors
+    self.path = path
+    # Factor on each detector's estimates from earlier runs
+    self.scales = {}
+    previous = getOldDict(path) if path is not None else {}
+    for detectorName in detectors:
+      ratios = [task["growth"] / self.baseEstimate(detectorName,
+                                                   task["records"])
+                for task in previous.get(detectorName, {}).get("tasks", [])
+                if task["growth"] is not None]
+      self.scales[detectorName] = margin * max(ratios) if ratios else 1.0
+    # Measurements of this run, by detector
+    self.tasks = {detectorName: [] for detectorName in detectors}
+
+
+  def baseEstimate(self, detectorName, numRecords):
+    """Bytes a detector is expected to take for a number of records, from
+    its class alone."""
+    detectorClass = self.detectors[detectorName]
+    return detectorClass.memoryBase + detectorClass.memoryPerRecord * numRecords
+
+
+  def estimate(self, detectorName, numRecords):
+    """Bytes a detector is expected to take for a number of records."""
+    return int(self.scales[detectorName] *
+               self.baseEstimate(detectorName, numRecords))
+
+
+  def record(self, detectorNames, relativePath, numRecords, estimates,
+             peakRSS, baselineRSS):
+    """
+    Records the measured memory of a task.
+
+    @param detectorNames  (list)    Detectors the task ran.
+    @param relativePath   (string)  Data file of the task.
+    @param numRecords     (int)     Records each detector handled.
+    @param estimates      (list)    Estimate of each detector.
+    @param peakRSS        (int)     Peak RSS of the task's process, or None.
+    @param baselineRSS    (int)     RSS of the process before its first task,
+                                    or None.
+
+    The growth of a task run by several detectors is shared between them in
+    proportion to their estimates.
+    """
+    growth = None
+    if peakRSS is not None:
+      growth = max(peakRSS - baselineRSS, 0)
+    for detectorName, estimate in zip(detectorNames, estimates):
+      share = (None if growth is None else
+               growth * estimate // max(sum(estimates), 1))
+      self.tasks[detectorName].append({"file": relativePath,
+                                       "records": numRecords,
+                                       "estimate": estimate,
+                                       "peakRSS": peakRSS,
+                                       "growth": share})
+
+
+  def summary(self, detectorName):
+    """
+    @return (dict) The number of tasks of a detector, the scale of its
+                   estimates, and its largest estimate, peak RSS, growth, and
+                   ratio of growth to estimate, in bytes; the measured ones
+                   are None if none could be.
+    """
+    tasks = self.tasks[detectorName]
+    measured = [task for task in tasks if task["growth"] is not None]
+    return {
+      "numTasks": len(tasks),
+      "scale": self.scales[detectorName],
+      "maxEstimate": max([task["estimate"] for task in tasks] or [None]),
+      "maxPeakRSS": max([task["peakRSS"] for task in measured] or [None]),
+      "maxGrowth": max([task["growth"] for task in measured] or [None]),
+      "maxGrowthToEstimate": max([task["growth"] / max(task["estimate"], 1)
+                                  for task in measured] or [None])
+    }
+
+
+  def report(self):
+    """Prints the peak memory of each detector against its estimates."""
+    print("\nPeak memory of detection tasks, against their estimates:")
+    print("%-20s %12s %14s %14s %12s" % ("", "peak RSS MB", "growth MB",
+                                         "estimate MB", "ratio"))
+    for detectorName in sorted(self.tasks):
+      summary = self.summary(detectorName)
+      if not summary["numTasks"]:
+        continue
+      if summary["maxGrowth"] is None:
+        print("%-20s %12s %14s %14.1f %12s" % (
+          detectorName, "-", "-", summary["maxEstimate"] / MB, "-"))
+      else:
+        print("%-20s %12.1f %14.1f %14.1f %12.2f" % (
+          detectorName, summary["maxPeakRSS"] / MB, summary["maxGrowth"] / MB,
+          summary["maxEstimate"] / MB, summary["maxGrowthToEstimate"]))
+
+
+  def write(self):
+    """Writes the summary and tasks of each detector run to the JSON file,
+    replacing those of earlier runs."""
+    results = getOldDict(self.path)
+    for detectorName, tasks in self.tasks.items():
+      if tasks:
+        results[detectorName] = self.summary(detectorName)
+        results[detectorName]["tasks"] = tasks
+    writeJSON(self.path, results)
@@ -0,0 +1,608 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Runtime for scoring many concurrent streams in one process.
+
+A detector object per stream keeps its history in Python lists that grow
+without bound, at tens of bytes per record. Here the streams of a detector
+share one kernel instead, which keeps each stream's state in a row of numpy
+arrays, with ring buffers as long as the detector actually looks back. A
+batch of records from many streams is scored with array operations across the
+streams, so there is no Python call per stream or per record.
+
+Kernels exist for the bayesChangePt, null, random, windowedGaussian and
+relativeEntropy detectors. Other detectors run in a `DetectorKernel`, which
+still hosts one detector object per stream.
+"""
+
+import math
+import numpy
+import pandas
+import random
+
+from scipy import special, stats
+
+from nab.detectors import getDetectorClass
+from nab.detectors.base import StreamDataSet
+from nab.util import getProbationPeriod
+
+
+
+class StreamKernel(object):
+  """
+  Scores the streams of one detector. Each stream has a slot, indexing the
+  rows of the kernel's state arrays.
+
+  Subclasses implement `_newSlots()`, to make room for more streams,
+  `_resetSlot()` and `_handleRound()`.
+  """
+
+  def __init__(self):
+    self.capacity = 0
+    self.freeSlots = []
+    self.numStreams = 0
+
+
+  def addStream(self, inputMin, inputMax, probationaryPeriod):
+    """
+    @param inputMin           (float) Smallest value of the stream.
+    @param inputMax           (float) Largest value of the stream.
+    @param probationaryPeriod (int)   Records in the probationary period.
+
+    @return (int) Slot of the new stream.
+    """
+    if not self.freeSlots:
+      newCapacity = max(2 * self.capacity, 16)
+      self._newSlots(newCapacity)
+      self.freeSlots = list(range(newCapacity - 1, self.capacity - 1, -1))
+      self.capacity = newCapacity
+    slot = self.freeSlots.pop()
+    self._resetSlot(slot, inputMin, inputMax, probationaryPeriod)
+    self.numStreams += 1
+    return slot
+
+
+  def removeStream(self, slot):
+    self.freeSlots.append(slot)
+    self.numStreams -= 1
+
+
+  def handleRecords(self, slots, timestamps, values):
+    """
+    Score a batch of records, from any streams in any order.
+
+    The records of each stream are scored in the order they come in the batch.
+    The batch is cut into rounds, each with at most one record per stream, and
+    each round is scored across its streams at once.
+
+    @param slots      (numpy.ndarray) Slot of the stream of each record.
+    @param timestamps (numpy.ndarray) Timestamp of each record.
+    @param values     (numpy.ndarray) Value of each record.
+
+    @return (numpy.ndarray) Anomaly score of each record.
+    """
+    slots = numpy.asarray(slots, dtype=numpy.int64)
+    values = numpy.asarray(values, dtype=float)
+    scores = numpy.empty(len(slots))
+    rounds = _roundOfRecords(slots)
+    for roundIndex in range(rounds.max() + 1 if len(rounds) else 0):
+      records = numpy.flatnonzero(rounds == roundIndex)
+      scores[records] = self._handleRound(slots[records],
+                                          timestamps[records],
+                                          values[records])
+    return scores
+
+
+  def nbytes(self):
+    """Bytes held in the kernel's state arrays."""
+    return sum(value.nbytes for value in vars(self).values()
+               if isinstance(value, numpy.ndarray))
+
+
+
+def _roundOfRecords(slots):
+  """Returns how many earlier records of the same stream precede each record."""
+  order = numpy.argsort(slots, kind="stable")
+  sortedSlots = slots[order]
+  isFirst = numpy.ones(len(slots), dtype=bool)
+  isFirst[1:] = sortedSlots[1:] != sortedSlots[:-1]
+  firstIndex = numpy.maximum.accumulate(
+    numpy.where(isFirst, numpy.arange(len(slots)), 0))
+  rounds = numpy.empty(len(slots), dtype=numpy.int64)
+  rounds[order] = numpy.arange(len(slots)) - firstIndex
+  return rounds
+
+
+def _grow(array, capacity, fill=0):
+  """Returns `array` with its first dimension grown to `capacity` rows."""
+  grown = numpy.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+  grown[:len(array)] = array
+  return grown
+
+
+
+class NullKernel(StreamKernel):
+  """Streams of `NullDetector`, which have no state."""
+
+  def _newSlots(self, capacity):
+    pass
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    pass
+
+
+  def _handleRound(self, slots, timestamps, values):
+    return numpy.full(len(slots), 0.5)
+
+
+
+class RandomKernel(StreamKernel):
+  """
+  Streams of `RandomDetector`. Every stream draws the same sequence, from the
+  detector's seed, so the sequence is drawn once and shared, and each stream
+  only keeps its position in it.
+  """
+
+  def __init__(self, seed=42):
+    super(RandomKernel, self).__init__()
+    self.generator = random.Random(seed)
+    self.sequence = numpy.zeros(0)
+    self.positions = numpy.zeros(0, dtype=numpy.int64)
+
+
+  def _newSlots(self, capacity):
+    self.positions = _grow(self.positions, capacity)
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    self.positions[slot] = 0
+
+
+  def _handleRound(self, slots, timestamps, values):
+    positions = self.positions[slots]
+    needed = positions.max() + 1
+    if needed > len(self.sequence):
+      uniform = self.generator.uniform
+      more = max(needed, 2 * len(self.sequence)) - len(self.sequence)
+      self.sequence = numpy.concatenate(
+        (self.sequence, [uniform(0, 1) for _ in range(more)]))
+    self.positions[slots] += 1
+    return self.sequence[positions]
+
+
+
+class WindowedGaussianKernel(StreamKernel):
+  """
+  Streams of `WindowedGaussianDetector`. Each stream's window and step buffer
+  share a ring buffer row of windowSize + stepSize values.
+
+  Like the detector, a window's mean and standard deviation are recomputed
+  each time it grows or slides, for the same scores; streams whose windows
+  have the same length are recomputed together.
+  """
+
+  def __init__(self, windowSize=6400, stepSize=100):
+    super(WindowedGaussianKernel, self).__init__()
+    self.windowSize = windowSize
+    self.stepSize = stepSize
+    self.ring = numpy.zeros((0, windowSize + stepSize))
+    self.numValues = numpy.zeros(0, dtype=numpy.int64)
+    self.windowStart = numpy.zeros(0, dtype=numpy.int64)
+    self.windowLength = numpy.zeros(0, dtype=numpy.int64)
+    self.mean = numpy.zeros(0)
+    self.std = numpy.zeros(0)
+
+
+  def _newSlots(self, capacity):
+    for name in ("ring", "numValues", "windowStart", "windowLength", "mean",
+                 "std"):
+      setattr(self, name, _grow(getattr(self, name), capacity))
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    self.numValues[slot] = 0
+    self.windowStart[slot] = 0
+    self.windowLength[slot] = 0
+    self.mean[slot] = 0
+    self.std[slot] = 1
+
+
+  def _handleRound(self, slots, timestamps, values):
+    windowLength = self.windowLength[slots]
+    mean = self.mean[slots]
+    std = self.std[slots]
+
+    # WindowedGaussianDetector.handleRecord(), across streams
+    x = numpy.where(values < mean, 2*mean - values, values)
+    z = (x - mean) / std / math.sqrt(2)
+    tail = 0.5 * numpy.fromiter(map(math.erfc, z.tolist()), float, len(z))
+    scores = numpy.where(windowLength > 0, 1 - tail, 0.0)
+
+    capacity = self.windowSize + self.stepSize
+    self.ring[slots, self.numValues[slots] % capacity] = values
+    self.numValues[slots] += 1
+
+    # Windows that are still filling grow by the new value, from the start of
+    # their ring.
+    filling = windowLength < self.windowSize
+    fillSlots = slots[filling]
+    self.windowLength[fillSlots] += 1
+    lengths = windowLength[filling] + 1
+    for length in numpy.unique(lengths):
+      grown = fillSlots[lengths == length]
+      window = self.ring[grown, :length]
+      self.mean[grown] = window.mean(axis=1)
+      self.std[grown] = window.std(axis=1)
+
+    # Slide full windows forward by stepSize once their step buffer is full
+    fullSlots = slots[~filling]
+    slide = fullSlots[self.numValues[fullSlots] -
+                      self.windowStart[fullSlots] - self.windowSize ==
+                      self.stepSize]
+    if len(slide):
+      self.windowStart[slide] += self.stepSize
+      window = self.ring[
+        slide[:, numpy.newaxis],
+        (self.windowStart[slide][:, numpy.newaxis] +
+         numpy.arange(self.windowSize)) % capacity]
+      self.mean[slide] = window.mean(axis=1)
+      self.std[slide] = window.std(axis=1)
+
+    updated = numpy.concatenate((fillSlots, slide))
+    self.std[updated[self.std[updated] == 0.0]] = 0.000001
+    return scores
+
+
+
+class RelativeEntropyKernel(StreamKernel):
+  """
+  Streams of `RelativeEntropyDetector`. Only the last W values matter, as
+  their bins, so each stream keeps a ring buffer of W bin numbers and the
+  histogram of the ring, alongside its hypotheses.
+  """
+
+  def __init__(self, numBins=5, W=52, c_th=1):
+    super(RelativeEntropyKernel, self).__init__()
+    self.N_bins = numBins
+    self.W = W
+    self.T = stats.chi2.isf(0.01, self.N_bins - 1)
+    self.c_th = c_th
+    self.inputMin = numpy.zeros(0)
+    self.stepSize = numpy.zeros(0)
+    self.bins = numpy.zeros((0, W), dtype=numpy.int8)
+    self.numValues = numpy.zeros(0, dtype=numpy.int64)
+    self.counts = numpy.zeros((0, numBins), dtype=numpy.int16)
+    self.m = numpy.zeros(0, dtype=numpy.int32)
+    self.P = numpy.zeros((0, 1, numBins))
+    self.c = numpy.zeros((0, 1), dtype=numpy.int64)
+
+
+  def _newSlots(self, capacity):
+    for name in ("inputMin", "stepSize", "bins", "numValues", "counts", "m",
+                 "P", "c"):
+      setattr(self, name, _grow(getattr(self, name), capacity))
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    self.inputMin[slot] = inputMin
+    self.stepSize[slot] = (inputMax - inputMin) / self.N_bins
+    self.numValues[slot] = 0
+    self.counts[slot] = 0
+    self.m[slot] = 0
+
+
+  def _addHypotheses(self, slots, P_hat):
+    if not len(slots):
+      return
+    index = self.m[slots]
+    if index.max() >= self.P.shape[1]:
+      numHypotheses = 2 * self.P.shape[1]
+      P = numpy.zeros((len(self.P), numHypotheses, self.N_bins))
+      P[:, :self.P.shape[1]] = self.P
+      c = numpy.zeros((len(self.c), numHypotheses), dtype=self.c.dtype)
+      c[:, :self.c.shape[1]] = self.c
+      self.P, self.c = P, c
+    self.P[slots, index] = P_hat
+    self.c[slots, index] = 1
+    self.m[slots] += 1
+
+
+  def _handleRound(self, slots, timestamps, values):
+    scores = numpy.zeros(len(slots))
+    active = self.stepSize[slots] != 0.0
+    slots, values = slots[active], values[active]
+    if not len(slots):
+      return scores
+
+    # Bin of each value in the histogram of the window, or -1 if outside
+    B = numpy.ceil((values - self.inputMin[slots]) / self.stepSize[slots])
+    inRange = (B >= 0) & (B <= self.N_bins)
+    newBins = numpy.where(inRange, numpy.minimum(B, self.N_bins - 1), -1)
+
+    position = self.numValues[slots] % self.W
+    oldBins = self.bins[slots, position]
+    dropped = (self.numValues[slots] >= self.W) & (oldBins >= 0)
+    self.counts[slots[dropped], oldBins[dropped]] -= 1
+    self.bins[slots, position] = newBins
+    self.counts[slots[inRange], newBins[inRange].astype(int)] += 1
+    self.numValues[slots] += 1
+
+    ready = self.numValues[slots] >= self.W
+    readySlots = slots[ready]
+    # numpy.histogram(..., density=True)
+    counts = self.counts[readySlots].astype(float)
+    P_hat = counts / counts.sum(axis=1, keepdims=True)
+
+    first = self.m[readySlots] == 0
+    self._addHypotheses(readySlots[first], P_hat[first])
+
+    testSlots = readySlots[~first]
+    if len(testSlots):
+      # getAgreementHypothesis(), with stats.entropy() against every hypothesis
+      testP_hat = P_hat[~first]
+      pk = testP_hat / testP_hat.sum(axis=1, keepdims=True)
+      qk = self.P[testSlots]
+      with numpy.errstate(invalid="ignore", divide="ignore"):
+        qk = qk / qk.sum(axis=2, keepdims=True)
+      entropy = 2 * self.W * special.rel_entr(pk[:, numpy.newaxis], qk).sum(
+        axis=2)
+      agrees = ((numpy.arange(qk.shape[1]) < self.m[testSlots, numpy.newaxis])
+                & (entropy < self.T))
+      index = numpy.where(agrees, entropy, numpy.inf).argmin(axis=1)
+      found = agrees.any(axis=1)
+
+      foundSlots, foundIndex = testSlots[found], index[found]
+      self.c[foundSlots, foundIndex] += 1
+      testScores = numpy.ones(len(testSlots))
+      testScores[found] = self.c[foundSlots, foundIndex] <= self.c_th
+      self._addHypotheses(testSlots[~found], testP_hat[~found])
+
+      readyScores = numpy.zeros(len(readySlots))
+      readyScores[~first] = testScores
+      activeScores = numpy.zeros(len(slots))
+      activeScores[ready] = readyScores
+      scores[active] = activeScores
+
+    return scores
+
+
+
+class BayesChangePtKernel(StreamKernel):
+  """
+  Streams of `BayesChangePtDetector`, advanced in lock-step: each round
+  updates the run-length probabilities of all its streams as one matrix of
+  shape (streams, maxRunLength + 2).
+
+  The detector's Student's t parameters grow by one per record, but the entry
+  for run length k only depends on the last k values, and only run lengths up
+  to maxRunLength are used; so each stream keeps maxRunLength + 1 of them.
+  `kappa` and `alpha` only depend on the run length, and are shared.
+  """
+
+  def __init__(self, maxRunLength=500, lambdaConst=250, alpha=0.1,
+               beta=0.001, kappa=1.0, mu=0.0):
+    super(BayesChangePtKernel, self).__init__()
+    self.maxRunLength = maxRunLength
+    self.hazard = 1 / float(lambdaConst)
+    self.beta0 = beta
+    self.mu0 = mu
+    # Summed one record at a time, as by StudentTDistribution.updateTheta()
+    self.kappa = numpy.empty(maxRunLength + 1)
+    self.alpha = numpy.empty(maxRunLength + 1)
+    self.kappa[0], self.alpha[0] = kappa, alpha
+    for k in range(maxRunLength):
+      self.kappa[k + 1] = self.kappa[k] + 1.
+      self.alpha[k + 1] = self.alpha[k] + 0.5
+
+    self.runLengthProbs = numpy.zeros((0, maxRunLength + 2))
+    self.mu = numpy.zeros((0, maxRunLength + 1))
+    self.beta = numpy.zeros((0, maxRunLength + 1))
+    self.recordNumber = numpy.zeros(0, dtype=numpy.int64)
+    self.previousMaxRun = numpy.zeros(0, dtype=numpy.int64)
+
+
+  def _newSlots(self, capacity):
+    for name in ("runLengthProbs", "mu", "beta", "recordNumber",
+                 "previousMaxRun"):
+      setattr(self, name, _grow(getattr(self, name), capacity))
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    self.runLengthProbs[slot] = 0
+    self.runLengthProbs[slot, 0] = 1.0
+    self.mu[slot] = self.mu0
+    self.beta[slot] = self.beta0
+    self.recordNumber[slot] = 0
+    self.previousMaxRun[slot] = 1
+
+
+  def _handleRound(self, slots, timestamps, values):
+    probs = numpy.zeros((len(slots), self.maxRunLength + 2))
+    runLengthIndex = numpy.minimum(self.recordNumber[slots], self.maxRunLength)
+    # Streams with as many run lengths are evaluated together, so that sums
+    # run over the same elements as in the detector.
+    for n in numpy.unique(runLengthIndex):
+      rows = numpy.flatnonzero(runLengthIndex == n)
+      rowSlots = slots[rows]
+      alpha = self.alpha[:n + 1]
+      kappa = self.kappa[:n + 1]
+      predProbs = stats.t.pdf(
+        x=values[rows, numpy.newaxis],
+        df=2 * alpha,
+        loc=self.mu[rowSlots, :n + 1],
+        scale=numpy.sqrt((self.beta[rowSlots, :n + 1] * (kappa + 1)) /
+                         (alpha * kappa)))
+      weighted = self.runLengthProbs[rowSlots, :n + 1] * predProbs
+      probs[rows, 1:n + 2] = weighted * (1 - self.hazard)
+      probs[rows, 0] = (weighted * self.hazard).sum(axis=1)
+    probs /= probs.sum(axis=1, keepdims=True)
+    self.runLengthProbs[slots] = probs
+
+    # StudentTDistribution.updateTheta(), keeping maxRunLength + 1 entries
+    kappa = self.kappa[:-1]
+    mu = self.mu[slots, :-1]
+    data = values[:, numpy.newaxis]
+    self.mu[slots, 1:] = (kappa * mu + data) / (kappa + 1)
+    self.beta[slots, 1:] = self.beta[slots, :-1] + (
+      kappa * (data - mu)**2) / (2. * (kappa + 1.))
+
+    maxRecursiveRunLength = probs.argmax(axis=1)
+    previousMaxRun = self.previousMaxRun[slots]
+    scores = numpy.where(
+      maxRecursiveRunLength < previousMaxRun,
+      1 - maxRecursiveRunLength / previousMaxRun.astype(float), 0.0)
+    self.recordNumber[slots] += 1
+    self.previousMaxRun[slots] = maxRecursiveRunLength
+    return scores
+
+
+
+class DetectorKernel(StreamKernel):
+  """
+  Streams of any detector, each with its own detector object. For detectors
+  without a compact kernel; records are handled one by one.
+  """
+
+  def __init__(self, detectorClass, probationaryPercent=0.15):
+    super(DetectorKernel, self).__init__()
+    self.detectorClass = detectorClass
+    self.probationaryPercent = probationaryPercent
+    self.detectors = []
+
+
+  def _newSlots(self, capacity):
+    self.detectors.extend([None] * (capacity - len(self.detectors)))
+
+
+  def _resetSlot(self, slot, inputMin, inputMax, probationaryPeriod):
+    detector = self.detectorClass(
+      dataSet=StreamDataSet(str(slot), inputMin, inputMax),
+      probationaryPercent=self.probationaryPercent)
+    detector.probationaryPeriod = probationaryPeriod
+    detector.initialize()
+    self.detectors[slot] = detector
+
+
+  def removeStream(self, slot):
+    super(DetectorKernel, self).removeStream(slot)
+    self.detectors[slot] = None
+
+
+  def _handleRound(self, slots, timestamps, values):
+    return numpy.array([
+      self.detectors[slot].handleRecord({"timestamp": pandas.Timestamp(t),
+                                         "value": value})[0]
+      for slot, t, value in zip(slots, timestamps, values.tolist())],
+      dtype=float)
+
+
+
+KERNELS = {
+  "bayesChangePt": BayesChangePtKernel,
+  "null": NullKernel,
+  "random": RandomKernel,
+  "relativeEntropy": RelativeEntropyKernel,
+  "windowedGaussian": WindowedGaussianKernel
+}
+
+
+
+class MultiStreamRuntime(object):
+  """
+  Scores records from many named streams, each with a detector, sharing one
+  kernel per detector.
+  """
+
+  def __init__(self, probationaryPercent=0.15):
+    self.probationaryPercent = probationaryPercent
+    self.kernels = {}
+    self.kernelNames = []
+    self.streamIds = {}
+    # Kernel and slot of each stream id
+    self.kernelOf = numpy.zeros(0, dtype=numpy.int64)
+    self.slotOf = numpy.zeros(0, dtype=numpy.int64)
+    self.freeIds = []
+
+
+  def _getKernel(self, detectorName):
+    if detectorName not in self.kernels:
+      if detectorName in KERNELS:
+        kernel = KERNELS[detectorName]()
+      else:
+        kernel = DetectorKernel(getDetectorClass(detectorName),
+                                self.probationaryPercent)
+      self.kernels[detectorName] = kernel
+      self.kernelNames.append(detectorName)
+    return self.kernelNames.index(detectorName), self.kernels[detectorName]
+
+
+  def addStream(self, name, detectorName, inputMin, inputMax, numRecords):
+    """
+    @param name         (string)  Name of the stream.
+    @param detectorName (string)  Detector to score it with, e.g. "null".
+    @param inputMin     (float)   Smallest value of the stream.
+    @param inputMax     (float)   Largest value of the stream.
+    @param numRecords   (int)     Length of the stream, for the probationary
+                                  period.
+
+    @return (int) Id of the stream, to pass to handleRecords().
+    """
+    if name in self.streamIds:
+      raise ValueError("Stream '%s' already exists" % name)
+    kernelIndex, kernel = self._getKernel(detectorName)
+    slot = kernel.addStream(
+      inputMin, inputMax,
+      getProbationPeriod(self.probationaryPercent, numRecords))
+
+    if self.freeIds:
+      streamId = self.freeIds.pop()
+    else:
+      streamId = len(self.kernelOf)
+      self.kernelOf = numpy.append(self.kernelOf, 0)
+      self.slotOf = numpy.append(self.slotOf, 0)
+    self.kernelOf[streamId] = kernelIndex
+    self.slotOf[streamId] = slot
+    self.streamIds[name] = streamId
+    return streamId
+
+
+  def removeStream(self, name):
+    streamId = self.streamIds.pop(name)
+    self.kernels[self.kernelNames[self.kernelOf[streamId]]].removeStream(
+      self.slotOf[streamId])
+    self.kernelOf[streamId] = -1
+    self.freeIds.append(streamId)
+
+
+  def handleRecords(self, streamIds, timestamps, values):
+    """
+    Score a batch of records from any streams, in any order.
+
+    @param streamIds  (numpy.ndarray) Id of the stream of each record.
+    @param timestamps (numpy.ndarray) Timestamp of each record.
+    @param values     (numpy.ndarray) Value of each record.
+
+    @return (numpy.ndarray) Anomaly score of each record.
+    """
+    streamIds = numpy.asarray(streamIds, dtype=numpy.int64)
+    timestamps = numpy.asarray(timestamps)
+    values = numpy.asarray(values, dtype=float)
+    kernelOf = self.kernelOf[streamIds]
+    if numpy.any(kernelOf < 0):
+      raise ValueError("Records for removed streams")
+
+    scores = numpy.empty(len(streamIds))
+    for kernelIndex in numpy.unique(kernelOf):
+      records = numpy.flatnonzero(kernelOf == kernelIndex)
+      kernel = self.kernels[self.kernelNames[kernelIndex]]
+      scores[records] = kernel.handleRecords(self.slotOf[streamIds[records]],
+                                             timestamps[records],
+                                             values[records])
+    return scores
@@ -6,14 +6,285 @@
 # Use of this source code is governed by the MIT
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
+from collections import namedtuple
+import numpy
 import os
+import tempfile
 
-from nab.sweeper import Sweeper
+from nab.sweeper import (OUTSIDE_WINDOW,
+                         Sweeper,
+                         ThresholdScore,
+                         bucketEdges,
+                         bucketSweepArrays,
+                         groupSweepArrays)
 from nab.util import convertResultsPathToDataPath
 
 
+CurveContribution = namedtuple(
+  "CurveContribution",
+  ["thresholds", "scores", "tps", "fps", "baseScore", "tn", "fn"]
+)
 
-def optimizeThreshold(args):
+
+
+def _bucketFalsePositiveScores(groups, numBuckets):
+  """Return the total false positive score within each bucket."""
+  groups = numpy.asarray(groups)
+  outside = groups["windowId"] == OUTSIDE_WINDOW
+  edges = bucketEdges(numBuckets)
+  buckets = numpy.searchsorted(edges, groups["anomalyScore"][outside])
+  return numpy.bincount(buckets, weights=groups["sweepScore"][outside],
+                        minlength=len(edges))
+
+
+def _bestBucketedScore(scoresByThreshold, fpScores, numBuckets):
+  """
+  Return the best `ThresholdScore` of a bucketed curve, and a bound on how
+  much higher the exact best score can be.
+
+  Take a threshold inside a bucket. Compared to the bucket's lower edge it
+  detects fewer rows, so no window scores better, while compared to the
+  bucket's upper neighbour on the curve it adds false positives, which never
+  raise the score. Its score is therefore at most the lower edge's score
+  without the bucket's false positives.
+  """
+  edges = bucketEdges(numBuckets)
+  bestParams = None
+  upperBound = -numpy.inf
+  for thresholdScore in scoresByThreshold:
+    if bestParams is None or thresholdScore.score > bestParams.score:
+      bestParams = thresholdScore
+    if thresholdScore.threshold <= edges[-1]:
+      bucket = numpy.searchsorted(edges, thresholdScore.threshold)
+      upperBound = max(upperBound, thresholdScore.score - fpScores[bucket])
+
+  return bestParams, max(0.0, float(upperBound - bestParams.score))
+
+
+def optimizeSweepArrays(sweeper, sweepArraysList, numBuckets=None):
+  """Find the threshold that maximizes the score over several data sets.
+
+  @param sweeper          (Sweeper)   Sweeper holding the cost matrix.
+
+  @param sweepArraysList  (iterable)  `SweepArrays` of each data set, from
+                                      `Sweeper.calcSweepScoreArrays()`. It is
+                                      only iterated once, so it may be a
+                                      generator.
+
+  @param numBuckets       (int)       If given, quantize anomaly scores into
+                                      this many buckets and only consider the
+                                      bucket edges as thresholds. This costs
+                                      O(rows + numBuckets) rather than a sort
+                                      of every distinct score.
+
+  @return (dict) Contains:
+        "threshold"   (float)   Threshold that returns the largest score.
+
+        "score"       (float)   The score given the threshold.
+
+        "errorBound"  (float)   Only with `numBuckets`: an upper bound on how
+                                much higher the exact best score can be.
+  """
+  if numBuckets is not None:
+    fpScores = numpy.zeros(len(bucketEdges(numBuckets)))
+
+  # Group and sort each data set's scorable rows on its own, spilling them to
+  # memory-mapped files, then merge them as a stream. This way the rows of the
+  # whole corpus are never gathered into a single list.
+  with tempfile.TemporaryDirectory() as groupsDir:
+    sweepGroups = []
+    for sweepArrays in sweepArraysList:
+      groupsPath = os.path.join(groupsDir, "%d.npy" % len(sweepGroups))
+      if numBuckets is None:
+        groups = groupSweepArrays(sweepArrays, groupsPath)
+      else:
+        groups = bucketSweepArrays(sweepArrays, numBuckets, groupsPath)
+        fpScores += _bucketFalsePositiveScores(groups.groups, numBuckets)
+      sweepGroups.append(groups)
+
+    scoresByThreshold = sweeper.iterScoreByThreshold(sweepGroups)
+    if numBuckets is None:
+      bestParams = max(scoresByThreshold, key=lambda x: x.score)
+    else:
+      bestParams, errorBound = _bestBucketedScore(
+        scoresByThreshold, fpScores, numBuckets)
+    del sweepGroups
+
+  results = {
+    "threshold": bestParams.threshold,
+    "score": bestParams.score
+  }
+  if numBuckets is not None:
+    results["errorBound"] = errorBound
+
+  return results
+
+
+def calcCurveContribution(sweeper, sweepArrays, sweepGroups=None):
+  """
+  Return what a data set adds to the corpus-wide threshold curve.
+
+  The curve of a corpus is the sum of its data sets' curves, and a data set's
+  curve is a base value (at a threshold above any score, where nothing is
+  detected) plus a step at each of its distinct anomaly scores. Keeping only
+  the steps makes the contribution of one data set cheap to add to, or take
+  away from, a `CorpusCurve`.
+
+  @param sweeper      (Sweeper)     Sweeper holding the cost matrix.
+  @param sweepArrays  (SweepArrays) Rows from `Sweeper.calcSweepScoreArrays()`
+  @param sweepGroups  (SweepGroups) The rows grouped by `groupSweepArrays()`,
+                                    if already at hand.
+
+  @return (CurveContribution) Distinct thresholds, highest first, with the
+                              change in score, true positives and false
+                              positives as the threshold drops to each, and
+                              the base score, true negatives and false
+                              negatives.
+  """
+  if sweepGroups is None:
+    sweepGroups = groupSweepArrays(sweepArrays)
+  groups = sweepGroups.groups
+  thresholds = groups["anomalyScore"]
+  windowIds = groups["windowId"]
+  counts = groups["count"]
+  sweepScores = groups["sweepScore"]
+
+  outside = windowIds == OUTSIDE_WINDOW
+  scoreSteps = numpy.where(outside, sweepScores, 0.0)
+  windows = numpy.unique(windowIds[~outside])
+  for windowId in windows:
+    # A window only gains when one of its rows beats its best score so far.
+    rows = numpy.flatnonzero(windowIds == windowId)
+    bestScores = numpy.maximum.accumulate(
+      numpy.concatenate(([-sweeper.fnWeight], sweepScores[rows])))
+    scoreSteps[rows] = numpy.diff(bestScores)
+
+  tpSteps = numpy.where(outside, 0, counts)
+  fpSteps = numpy.where(outside, counts, 0)
+  baseScore = -sweeper.fnWeight * len(windows)
+  tn = int(fpSteps.sum())
+  fn = int(tpSteps.sum())
+
+  if not len(thresholds):
+    return CurveContribution(thresholds, scoreSteps, tpSteps, fpSteps,
+                             baseScore, tn, fn)
+
+  starts = numpy.flatnonzero(numpy.concatenate(
+    ([True], thresholds[1:] != thresholds[:-1])))
+  return CurveContribution(thresholds[starts],
+                           numpy.add.reduceat(scoreSteps, starts),
+                           numpy.add.reduceat(tpSteps, starts),
+                           numpy.add.reduceat(fpSteps, starts),
+                           baseScore, tn, fn)
+
+
+
+class CorpusCurve(object):
+  """
+  Threshold curve of a corpus, kept as the sum of its data sets'
+  `CurveContribution`s.
+
+  Replacing the results of one data set subtracts its old contribution and
+  adds the new one, so the best threshold can be found again without sweeping
+  the rest of the corpus.
+  """
+
+  def __init__(self):
+    self.contributions = {}
+
+    self._baseScore = 0.0
+    self._tn = 0
+    self._fn = 0
+    # threshold -> [score step, tp step, fp step, number of data sets]
+    self._steps = {}
+
+
+  def setDataSet(self, name, contribution):
+    """Add a data set's contribution, replacing any previous one.
+
+    @param name         (string)            Key of the data set, e.g. its
+                                            relative path.
+    @param contribution (CurveContribution) From `calcCurveContribution()`
+    """
+    if name in self.contributions:
+      self.removeDataSet(name)
+    self._update(contribution, 1)
+    self.contributions[name] = contribution
+
+
+  def removeDataSet(self, name):
+    """Take a data set's contribution out of the curve."""
+    self._update(self.contributions.pop(name), -1)
+
+
+  def _update(self, contribution, sign):
+    self._baseScore += sign * contribution.baseScore
+    self._tn += sign * contribution.tn
+    self._fn += sign * contribution.fn
+
+    for threshold, score, tp, fp in zip(contribution.thresholds.tolist(),
+                                        contribution.scores.tolist(),
+                                        contribution.tps.tolist(),
+                                        contribution.fps.tolist()):
+      step = self._steps.setdefault(threshold, [0.0, 0, 0, 0])
+      step[0] += sign * score
+      step[1] += sign * tp
+      step[2] += sign * fp
+      step[3] += sign
+      # Thresholds no data set has any more would otherwise linger, carrying
+      # nothing but rounding residue.
+      if step[3] == 0:
+        del self._steps[threshold]
+
+
+  def scoresByThreshold(self):
+    """
+    Return the NAB scores for each threshold, like
+    `Sweeper.iterScoreByThreshold()` over the same data sets.
+
+    @return (list)  `ThresholdScore` objects, highest threshold first
+    """
+    score = self._baseScore
+    tp = 0
+    fp = 0
+    total = self._tn + self._fn
+    scores = [ThresholdScore(1.1, score, tp, self._tn, fp, self._fn, total)]
+    for threshold in sorted(self._steps, reverse=True):
+      scoreStep, tpStep, fpStep, _ = self._steps[threshold]
+      score += scoreStep
+      tp += tpStep
+      fp += fpStep
+      scores.append(ThresholdScore(
+        threshold, score, tp, self._tn - fp, fp, self._fn - tp, total))
+
+    return scores
+
+
+  def best(self):
+    """Return the `ThresholdScore` with the largest score."""
+    return max(self.scoresByThreshold(), key=lambda x: x.score)
+
+
+
+def thresholdForScores(threshold, integerScores):
+  """
+  Return a threshold as it is written to the thresholds file. The sweep works
+  on float scores, but a detector that only gives integer scores keeps an
+  integer threshold, as it always has.
+
+  @param threshold      (float) Threshold found by the sweep.
+  @param integerScores  (list)  Whether each data set's anomaly scores are
+                                integers.
+
+  @return (float or int)
+  """
+  if (integerScores and all(integerScores) and
+      threshold == int(threshold)):
+    return int(threshold)
+  return threshold
+
+
+def optimizeThreshold(args, numBuckets=None):
   """Optimize the threshold for a given combination of detector and profile.
 
   @param args       (tuple)   Contains:
@@ -32,12 +303,19 @@ def optimizeThreshold(args):
     probationaryPercent (float)                 Percent of each data file not
                                                 to be considered during scoring.
 
+  @param numBuckets (int)     Optionally optimize approximately over this many
+                              anomaly score buckets; see
+                              `optimizeSweepArrays()`.
+
   @return (dict) Contains:
-        "threshold" (float)   Threshold that returns the largest score from the
-                              Objective function.
+        "threshold"   (float)   Threshold that returns the largest score from
+                                the Objective function.
+
+        "score"       (float)   The score from the objective function given
+                                the threshold.
 
-        "score"     (float)   The score from the objective function given the
-                              threshold.
+        "errorBound"  (float)   Only with `numBuckets`: an upper bound on how
+                                much higher the exact best score can be.
   """
   (detectorName,
    costMatrix,
@@ -49,42 +327,42 @@ def optimizeThreshold(args):
     probationPercent=probationaryPercent,
     costMatrix=costMatrix
   )
+  integerScores = []
 
-  # First, get the sweep-scores for each row in each data set
-  allAnomalyRows = []
-  for relativePath, dataSet in resultsCorpus.dataFiles.items():
-    if "_scores.csv" in relativePath:
-      continue
-
-    # relativePath: raw dataset file,
-    # e.g. 'artificialNoAnomaly/art_noisy.csv'
-    relativePath = convertResultsPathToDataPath(
-      os.path.join(detectorName, relativePath))
-
-    windows = corpusLabel.windows[relativePath]
-    labels = corpusLabel.labels[relativePath]
-    timestamps = labels['timestamp']
-    anomalyScores = dataSet.data["anomaly_score"]
-
-    curAnomalyRows = sweeper.calcSweepScore(
-      timestamps,
-      anomalyScores,
-      windows,
-      relativePath
-    )
-    allAnomalyRows.extend(curAnomalyRows)
-
-  # Get scores by threshold for the entire corpus
-  scoresByThreshold = sweeper.calcScoreByThreshold(allAnomalyRows)
-  scoresByThreshold = sorted(
-    scoresByThreshold,key=lambda x: x.score, reverse=True)
-  bestParams = scoresByThreshold[0]
-
-  print(("Optimizer found a max score of {} with anomaly threshold {}.".format(
-    bestParams.score, bestParams.threshold
-  )))
-
-  return {
-    "threshold": bestParams.threshold,
-    "score": bestParams.score
-  }
+  def iterSweepArrays():
+    for relativePath, dataSet in resultsCorpus.dataFiles.items():
+      if "_scores.csv" in relativePath:
+        continue
+
+      # relativePath: raw dataset file,
+      # e.g. 'artificialNoAnomaly/art_noisy.csv'
+      relativePath = convertResultsPathToDataPath(
+        os.path.join(detectorName, relativePath))
+
+      windows = corpusLabel.windows[relativePath]
+      labels = corpusLabel.labels[relativePath]
+      timestamps = labels['timestamp']
+      anomalyScores = dataSet.data["anomaly_score"]
+      integerScores.append(anomalyScores.dtype.kind in "iu")
+
+      yield sweeper.calcSweepScoreArrays(
+        timestamps,
+        anomalyScores,
+        windows
+      )
+
+  bestParams = optimizeSweepArrays(sweeper, iterSweepArrays(), numBuckets)
+  bestParams["threshold"] = thresholdForScores(bestParams["threshold"],
+                                               integerScores)
+
+  if numBuckets is None:
+    print(("Optimizer found a max score of {} with anomaly threshold {}.".format(
+      bestParams["score"], bestParams["threshold"]
+    )))
+  else:
+    print(("Optimizer found a max score of {} with anomaly threshold {}, "
+           "within {} of the exact maximum.".format(
+      bestParams["score"], bestParams["threshold"], bestParams["errorBound"]
+    )))
+
+  return bestParams
@@ -0,0 +1,385 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Scoring of live streams partitioned across worker processes.
+
+Each stream belongs to one worker process, chosen by consistent hashing of its
+name, and is scored there by an unchanged NAB detector, as in `nab.service`.
+A batch of records from any streams is split by worker; each worker's records
+are written to a block of shared memory it reads them from, and it writes
+their scores to another, so only short control messages go through pipes.
+Workers score their parts of a batch in parallel.
+
+When workers are added or removed, only the streams whose place on the hash
+ring changes move, each through a snapshot of its detector's state.
+"""
+
+import bisect
+import hashlib
+import multiprocessing
+import numpy
+import pandas
+
+from multiprocessing import shared_memory
+
+from nab.detectors.base import serializeState
+from nab.service import Stream
+
+
+
+class HashRing(object):
+  """
+  Consistent hashing of keys onto nodes. Each node has many points on the
+  ring, so keys spread evenly, and adding or removing a node only moves the
+  keys next to its points.
+  """
+
+  def __init__(self, nodes=(), replicas=64):
+    """
+    @param nodes    (iterable)  Initial nodes.
+    @param replicas (int)       Points on the ring per node.
+    """
+    self.replicas = replicas
+    self.points = []
+    self.pointNodes = []
+    for node in nodes:
+      self.add(node)
+
+
+  @staticmethod
+  def _hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+  def __len__(self):
+    return len(set(self.pointNodes))
+
+
+  def add(self, node):
+    if node in self.pointNodes:
+      raise ValueError("Node '%s' is already on the ring" % node)
+    for i in range(self.replicas):
+      point = self._hash("%s#%d" % (node, i))
+      index = bisect.bisect(self.points, point)
+      self.points.insert(index, point)
+      self.pointNodes.insert(index, node)
+
+
+  def remove(self, node):
+    if node not in self.pointNodes:
+      raise ValueError("Node '%s' is not on the ring" % node)
+    keep = [i for i, other in enumerate(self.pointNodes) if other != node]
+    self.points = [self.points[i] for i in keep]
+    self.pointNodes = [self.pointNodes[i] for i in keep]
+
+
+  def getNode(self, key):
+    """Returns the node of a key: that of the first point after its hash."""
+    if not self.points:
+      raise ValueError("The ring has no nodes")
+    index = bisect.bisect(self.points, self._hash(key)) % len(self.points)
+    return self.pointNodes[index]
+
+
+
+def _recordArrays(inputMemory, outputMemory, capacity):
+  """Views of a worker's shared memory as arrays of records and scores."""
+  return (numpy.ndarray(capacity, numpy.int64, inputMemory.buf, 0),
+          numpy.ndarray(capacity, numpy.int64, inputMemory.buf, 8 * capacity),
+          numpy.ndarray(capacity, float, inputMemory.buf, 16 * capacity),
+          numpy.ndarray(capacity, float, outputMemory.buf, 0))
+
+
+def _workerMain(conn, inputMemory, outputMemory, capacity,
+                probationaryPercent):
+  """
+  Loop of a worker process: answers messages from the PartitionedService
+  until told to stop. Streams are known by their index in the worker.
+  """
+  streamIndices, timestamps, values, scores = _recordArrays(
+    inputMemory, outputMemory, capacity)
+  streams = {}
+  try:
+    while True:
+      message = conn.recv()
+      op = message[0]
+      if op == "stop":
+        conn.send((True, None))
+        break
+      try:
+        result = None
+        if op == "create":
+          index, name, detectorName, inputMin, inputMax, numRecords, state = (
+            message[1:])
+          streams[index] = Stream(name, detectorName, inputMin, inputMax,
+                                  numRecords, probationaryPercent, state)
+        elif op == "score":
+          count = message[1]
+          # Each stream's records in order, as pandas Timestamps and floats
+          # like in AnomalyDetector.run().
+          order = numpy.argsort(streamIndices[:count], kind="stable")
+          bounds = numpy.flatnonzero(numpy.diff(streamIndices[order])) + 1
+          for records in numpy.split(order, bounds):
+            stream = streams[int(streamIndices[records[0]])]
+            scores[records] = stream.score(
+              list(pandas.DatetimeIndex(timestamps[records])),
+              values[records].tolist())
+        elif op == "snapshot":
+          result = serializeState(streams[message[1]].detector.getState())
+        elif op == "delete":
+          del streams[message[1]]
+        else:
+          raise ValueError("Unknown op '%s'" % op)
+        conn.send((True, result))
+      except Exception as e:
+        conn.send((False, "%s: %s" % (type(e).__name__, e)))
+  finally:
+    inputMemory.close()
+    outputMemory.close()
+
+
+
+class Worker(object):
+  """A worker process and its shared memory, as seen by the service."""
+
+  def __init__(self, name, capacity, probationaryPercent):
+    self.name = name
+    self.capacity = capacity
+    self.inputMemory = shared_memory.SharedMemory(create=True,
+                                                  size=24 * capacity)
+    self.outputMemory = shared_memory.SharedMemory(create=True,
+                                                   size=8 * capacity)
+    (self.streamIndices, self.timestamps,
+     self.values, self.scores) = _recordArrays(self.inputMemory,
+                                               self.outputMemory, capacity)
+    self.conn, workerConn = multiprocessing.Pipe()
+    self.process = multiprocessing.Process(
+      target=_workerMain,
+      args=(workerConn, self.inputMemory, self.outputMemory, capacity,
+            probationaryPercent),
+      daemon=True)
+    self.process.start()
+    workerConn.close()
+
+    self.streams = set()
+    self.freeIndices = []
+    self.numIndices = 0
+
+
+  def send(self, *message):
+    self.conn.send(message)
+
+
+  def receive(self):
+    ok, result = self.conn.recv()
+    if not ok:
+      raise RuntimeError("Worker %s: %s" % (self.name, result))
+    return result
+
+
+  def request(self, *message):
+    self.send(*message)
+    return self.receive()
+
+
+  def newIndex(self):
+    if self.freeIndices:
+      return self.freeIndices.pop()
+    self.numIndices += 1
+    return self.numIndices - 1
+
+
+  def stop(self):
+    try:
+      self.request("stop")
+      self.process.join()
+    finally:
+      self.conn.close()
+      for memory in (self.inputMemory, self.outputMemory):
+        memory.close()
+        memory.unlink()
+
+
+
+class PartitionedService(object):
+  """
+  Scores named streams, each in the worker process it hashes to. Use as a
+  context manager, or call close(), to stop the workers.
+  """
+
+  def __init__(self, numWorkers=None, probationaryPercent=0.15,
+               capacity=2 ** 16, replicas=64):
+    """
+    @param numWorkers           (int)   Initial number of worker processes;
+                                        the number of CPUs by default.
+    @param probationaryPercent  (float) As in NAB.
+    @param capacity             (int)   Most records sent to a worker at once;
+                                        larger batches are sent in parts.
+    @param replicas             (int)   Points of each worker on the hash
+                                        ring.
+    """
+    self.probationaryPercent = probationaryPercent
+    self.capacity = capacity
+    self.ring = HashRing(replicas=replicas)
+    self.workers = {}
+    self.workerCount = 0
+    # Per stream: its worker, its index there and the arguments it was
+    # created with.
+    self.streams = {}
+
+    for _ in range(numWorkers or multiprocessing.cpu_count()):
+      self.addWorker()
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    self.close()
+
+
+  def close(self):
+    for worker in self.workers.values():
+      worker.stop()
+    self.workers = {}
+
+
+  def createStream(self, name, detectorName, inputMin, inputMax, numRecords,
+                   state=None):
+    """
+    @param name         (string)  Name of the stream.
+    @param detectorName (string)  Detector to score it with, e.g. "null".
+    @param inputMin     (float)   Smallest value of the stream.
+    @param inputMax     (float)   Largest value of the stream.
+    @param numRecords   (int)     Length of the stream, for the probationary
+                                  period.
+    @param state        (bytes)   A snapshot to carry on from, if any.
+    """
+    if name in self.streams:
+      raise ValueError("Stream '%s' already exists" % name)
+    args = (detectorName, inputMin, inputMax, numRecords)
+    self._place(name, self.workers[self.ring.getNode(name)], args, state)
+
+
+  def _place(self, name, worker, args, state):
+    index = worker.newIndex()
+    try:
+      worker.request("create", index, name, *(args + (state,)))
+    except Exception:
+      worker.freeIndices.append(index)
+      raise
+    worker.streams.add(name)
+    self.streams[name] = (worker, index, args)
+
+
+  def deleteStream(self, name):
+    worker, index, _ = self.streams.pop(name)
+    worker.request("delete", index)
+    worker.streams.discard(name)
+    worker.freeIndices.append(index)
+
+
+  def snapshot(self, name):
+    """Returns the serialized state of a stream's detector."""
+    worker, index, _ = self.streams[name]
+    return worker.request("snapshot", index)
+
+
+  def workerOf(self, name):
+    """Returns the name of the worker a stream is on."""
+    return self.streams[name][0].name
+
+
+  def addWorker(self):
+    """
+    Start a worker, and move to it the streams that now hash to it.
+
+    @return (string) Name of the new worker.
+    """
+    name = "worker-%d" % self.workerCount
+    self.workerCount += 1
+    self.workers[name] = Worker(name, self.capacity, self.probationaryPercent)
+    self.ring.add(name)
+    self._rebalance()
+    return name
+
+
+  def removeWorker(self, name):
+    """Move the streams of a worker to the others, and stop it."""
+    if len(self.workers) == 1:
+      raise ValueError("Cannot remove the last worker")
+    self.ring.remove(name)
+    self._rebalance()
+    self.workers.pop(name).stop()
+
+
+  def _rebalance(self):
+    """Migrate every stream not on the worker it hashes to."""
+    for name in list(self.streams):
+      worker, _, args = self.streams[name]
+      target = self.workers[self.ring.getNode(name)]
+      if target is not worker:
+        state = self.snapshot(name)
+        self.deleteStream(name)
+        self._place(name, target, args, state)
+
+
+  def score(self, names, timestamps, values):
+    """
+    Score a batch of records from any streams. Records of a stream are scored
+    in the order given.
+
+    @param names      (list)          Name of the stream of each record.
+    @param timestamps (numpy.ndarray) Timestamp of each record.
+    @param values     (numpy.ndarray) Value of each record.
+
+    @return (numpy.ndarray) Anomaly score of each record.
+    """
+    timestamps = numpy.asarray(timestamps, dtype="datetime64[ns]").view(
+      numpy.int64)
+    values = numpy.asarray(values, dtype=float)
+    streamNames, inverse = numpy.unique(numpy.asarray(names, dtype=object),
+                                        return_inverse=True)
+    placements = [self.streams[name] for name in streamNames]
+    workerNames = numpy.array([worker.name for worker, _, _ in placements])
+    indices = numpy.array([index for _, index, _ in placements],
+                          dtype=numpy.int64)[inverse]
+
+    scores = numpy.empty(len(values))
+    parts = {}
+    for name in numpy.unique(workerNames):
+      parts[name] = numpy.flatnonzero(
+        numpy.isin(inverse, numpy.flatnonzero(workerNames == name)))
+    # Every worker scores its next part at once; a part is what fits in its
+    # shared memory.
+    for start in range(0, max([len(records) for records in parts.values()] +
+                              [0]), self.capacity):
+      sent = []
+      for name, records in parts.items():
+        records = records[start:start + self.capacity]
+        if not len(records):
+          continue
+        worker = self.workers[name]
+        count = len(records)
+        worker.streamIndices[:count] = indices[records]
+        worker.timestamps[:count] = timestamps[records]
+        worker.values[:count] = values[records]
+        worker.send("score", count)
+        sent.append((worker, records))
+      errors = []
+      for worker, records in sent:
+        try:
+          worker.receive()
+          scores[records] = worker.scores[:len(records)]
+        except RuntimeError as e:
+          errors.append(e)
+      if errors:
+        raise errors[0]
+    return scores
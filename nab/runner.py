@@ -7,20 +7,51 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
-import multiprocessing
+import copy
+import functools
+import hashlib
+import numpy
 import os
 import pandas
+import time
 try:
   import simplejson as json
 except ImportError:
   import json
 
-from nab.corpus import Corpus
-from nab.detectors.base import detectDataSet
+from nab.bootstrap import bootstrapScores, calcUnitCurves
+from nab.corpus import Corpus, DataFile
+from nab.crossvalidation import crossValidateScores, makeFolds
+from nab.detectors.base import (detectDataSet,
+                                detectDataSets,
+                                detectSegment,
+                                writeSegments)
+from nab.executor import TaskQueue, getExecutor
+from nab.instrumentation import summarizeTiming
 from nab.labeler import CorpusLabel
-from nab.optimizer import optimizeThreshold
-from nab.scorer import scoreCorpus
-from nab.util import updateThresholds, updateFinalResults
+from nab.memory import MemoryEstimator
+from nab.optimizer import (CorpusCurve,
+                           calcCurveContribution,
+                           optimizeThreshold,
+                           thresholdForScores)
+from nab.scorer import (NULL_ANOMALY_SCORE,
+                        SCORE_COLUMNS,
+                        calcScoreBreakdown,
+                        normalizeScore,
+                        scoreCorpus,
+                        scoreDataSet,
+                        scoreDataSetArgs,
+                        scoreNullDetector,
+                        summarizeLatency,
+                        totalScores)
+from nab.sweeper import Sweeper, groupSweepArrays
+from nab.util import (absoluteFilePaths,
+                      convertResultsPathToDataPath,
+                      getOldDict,
+                      makeDirsExist,
+                      updateThresholds,
+                      updateFinalResults,
+                      writeJSON)
 
 
 
@@ -28,6 +59,10 @@ class Runner(object):
   """
   Class to run an endpoint (detect, optimize, or score) on the NAB
   benchmark using the specified set of profiles, thresholds, and/or detectors.
+
+  The executors that stages run their tasks on are only created when a stage
+  first needs one. Use the runner as a context manager, or call close(), to
+  stop them.
   """
 
   def __init__(self,
@@ -36,7 +71,9 @@ class Runner(object):
                labelPath,
                profilesPath,
                thresholdPath,
-               numCPUs=None):
+               numCPUs=None,
+               executor="process",
+               stageExecutors=None):
     """
     @param dataDir        (string)  Directory where all the raw datasets exist.
 
@@ -57,24 +94,101 @@ class Runner(object):
     @probationaryPercent  (float)   Percent of each dataset which will be
                                     ignored during the scoring process.
 
-    @param numCPUs        (int)     Number of CPUs to be used for calls to
-                                    multiprocessing.pool.map
+    @param numCPUs        (int)     Number of processes or threads of each
+                                    executor.
+
+    @param executor       (string)  Kind of executor stages run their tasks
+                                    on: "process", "thread" or "serial"; see
+                                    nab.executor. An Executor can also be
+                                    given, which is then left for the caller
+                                    to close.
+
+    @param stageExecutors (dict)    Executors of particular stages, by stage:
+                                    "detect", "score", "bootstrap",
+                                    "crossValidate" or "pipeline". Stages
+                                    with the same kind of executor share
+                                    one.
     """
     self.dataDir = dataDir
     self.resultsDir = resultsDir
+    self.timingDir = os.path.join(resultsDir, "timing")
 
     self.labelPath = labelPath
     self.profilesPath = profilesPath
     self.thresholdPath = thresholdPath
-    self.pool = multiprocessing.Pool(numCPUs)
+
+    self.numCPUs = numCPUs
+    self.executor = executor
+    self.stageExecutors = dict(stageExecutors or {})
+    # Executors created so far, by kind.
+    self.executors = {}
 
     self.probationaryPercent = 0.15
     self.windowSize = 0.10
 
+    # Detectors taking less than this many microseconds per record are run
+    # together over each file by detect().
+    self.fanOutMaxMicros = 100.0
+
     self.corpus = None
     self.corpusLabel = None
     self.profiles = None
 
+    # Scores of the last score() call, by path of their CSV.
+    self.resultsFiles = []
+    self.resultsDFs = {}
+
+    # State of watch mode: per detector, the corpus curve of each profile, the
+    # modification time of each results file they were built from, and per
+    # data set, the grouped rows of each profile and whether its scores are
+    # integers.
+    self.curves = {}
+    self.resultsModified = {}
+    self.sweepGroups = {}
+    self.integerScores = {}
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, excType, excValue, traceback):
+    for executor in self.executors.values():
+      executor.__exit__(excType, excValue, traceback)
+    self.executors = {}
+
+
+  def close(self):
+    """Wait for the tasks of the executors created so far, and stop them."""
+    self.__exit__(None, None, None)
+
+
+  def getExecutor(self, stage, detectors=None):
+    """
+    Returns the executor of a stage, created if it's the first to use it.
+
+    @param stage     (string) "detect", "score", "bootstrap", "crossValidate"
+                              or "pipeline".
+
+    @param detectors (dict)   Detector classes the stage runs, by name. If
+                              any is not `threadSafe`, worker processes are
+                              used in place of threads.
+    """
+    executor = self.stageExecutors.get(stage, self.executor)
+    if executor == "thread" and detectors is not None:
+      unsafe = sorted(detectorName
+                      for detectorName, detectorConstructor in detectors.items()
+                      if not detectorConstructor.threadSafe)
+      if unsafe:
+        print("Running detection in processes rather than threads, as these "
+              "detectors are not thread-safe: %s" % ", ".join(unsafe))
+        executor = "process"
+    if not isinstance(executor, str):
+      return executor
+    if executor not in self.executors:
+      self.executors[executor] = getExecutor(executor, self.numCPUs)
+    return self.executors[executor]
+
 
   def initialize(self):
     """Initialize all the relevant objects for the run."""
@@ -85,7 +199,8 @@ class Runner(object):
       self.profiles = json.load(p)
 
 
-  def detect(self, detectors):
+  def detect(self, detectors, timing=False, sampleInterval=1, fanOut=None,
+             segmentLength=None, memoryBudget=None):
     """Generate results file given a dictionary of detector classes
 
     Function that takes a set of detectors and a corpus of data and creates a
@@ -94,40 +209,276 @@ class Runner(object):
     @param detectors     (dict)         Dictionary with key value pairs of a
                                         detector name and its corresponding
                                         class constructor.
+
+    @param timing        (bool)         Also time each detector's calls to
+                                        handleRecord(). The latencies of each
+                                        data file go to
+                                        timing/<detector>/<category>/ in the
+                                        results directory, and a summary per
+                                        detector to timing_results.json.
+
+    @param sampleInterval (int)         When timing, only time one in this
+                                        many records.
+
+    @param fanOut        (bool)         Whether to run the detectors over each
+                                        file in a single task, which sends and
+                                        iterates the file once for them all,
+                                        rather than in a task per detector and
+                                        file. By default only detectors that
+                                        set `supportsCostProbe` and are
+                                        measured to take less than
+                                        `fanOutMaxMicros` per record are run
+                                        together, as the time saved only
+                                        matters for those; costlier detectors
+                                        keep their own tasks, which spread
+                                        better across CPUs.
+
+    @param segmentLength (int)          If given, detectors that support
+                                        segments run over each file in
+                                        segments of this many records, in
+                                        parallel tasks, each warmed up on the
+                                        records before it. Their results are
+                                        the same as from a run over the whole
+                                        file, and a long file no longer takes
+                                        one CPU the whole time. Not used when
+                                        timing.
+
+    @param memoryBudget  (int)          If given, the bytes of memory the
+                                        detection tasks running at once may
+                                        take beyond that of the idle workers.
+                                        Tasks wait until the sum of their
+                                        estimated peak memory fits in it, and
+                                        the peaks measured are reported and
+                                        added to memory_results.json in the
+                                        results directory, which refines the
+                                        estimates of later runs.
     """
     print("\nRunning detection step")
 
+    jobs = self._detectionJobs(detectors, timing, sampleInterval, fanOut,
+                               segmentLength)
+
+    tasks = TaskQueue(self.getExecutor("detect", detectors), memoryBudget)
+    estimator = self._memoryEstimator(detectors, memoryBudget)
+    for detectorNames, function, args, finish, sizes in jobs:
+      self._submitDetection(tasks, estimator, detectorNames, function, args,
+                            sizes, finish)
+    tasks.run()
+
+    if timing:
+      self._writeTimingSummary(detectors)
+    if estimator is not None:
+      estimator.write()
+      estimator.report()
+
+
+  def _detectionJobs(self, detectors, timing, sampleInterval, fanOut,
+                     segmentLength):
+    """
+    Returns the jobs of detection, as arguments are described for detect().
+    Each job is a tuple of the names of the detectors it runs, a function
+    to map over a list of arguments, a function to call in this process
+    with the list of results once they are all done, or None, and the data
+    file of each task with the number of records each detector handles.
+    """
+    segmented = {}
+    if segmentLength and not timing:
+      segmented = {detectorName: detectorConstructor
+                   for detectorName, detectorConstructor in detectors.items()
+                   if detectorConstructor.supportsSegments}
+      detectors = {detectorName: detectorConstructor
+                   for detectorName, detectorConstructor in detectors.items()
+                   if detectorName not in segmented}
+
+    if fanOut is None:
+      fanned = [detectorName for detectorName, detectorConstructor
+                in detectors.items()
+                if self._measureCost(detectorConstructor) <
+                self.fanOutMaxMicros]
+    else:
+      fanned = list(detectors) if fanOut else []
+    if len(fanned) < 2:
+      fanned = []
+    if fanned:
+      print("Running %s together over each file" % ", ".join(fanned))
+
+    timingArgs = ((self.timingDir, sampleInterval),) if timing else ()
+    labelledFiles = [(relativePath, dataSet)
+                     for relativePath, dataSet in self.corpus.dataFiles.items()
+                     if relativePath in self.corpusLabel.labels]
+
+    sizes = [(relativePath, len(dataSet.data))
+             for relativePath, dataSet in labelledFiles]
+
     count = 0
-    args = []
+    jobs = []
     for detectorName, detectorConstructor in detectors.items():
-      for relativePath, dataSet in self.corpus.dataFiles.items():
+      if detectorName in fanned:
+        continue
+      args = []
+      for relativePath, dataSet in labelledFiles:
+        args.append(
+          (
+            count,
+            detectorConstructor(
+              dataSet=dataSet,
+              probationaryPercent=self.probationaryPercent),
+            detectorName,
+            self.corpusLabel.labels[relativePath]["label"],
+            self.resultsDir,
+            relativePath
+          ) + timingArgs
+        )
+
+        count += 1
+      jobs.append(([detectorName], detectDataSet, args, None, sizes))
+
+    if fanned:
+      args = []
+      for relativePath, dataSet in labelledFiles:
+        args.append(
+          (
+            count,
+            [detectors[detectorName](
+              dataSet=dataSet,
+              probationaryPercent=self.probationaryPercent)
+             for detectorName in fanned],
+            fanned,
+            self.corpusLabel.labels[relativePath]["label"],
+            self.resultsDir,
+            relativePath
+          ) + timingArgs
+        )
 
-        if relativePath in self.corpusLabel.labels:
+        count += 1
+      jobs.append((fanned, detectDataSets, args, None, sizes))
+
+    # The segments of each file with each segmented detector, whose outputs
+    # are then written to its results file here.
+    for detectorName, detectorConstructor in segmented.items():
+      for relativePath, dataSet in labelledFiles:
+        args = []
+        segmentSizes = []
+        for start in range(0, len(dataSet.data), segmentLength):
+          detectorInstance = detectorConstructor(
+            dataSet=dataSet,
+            probationaryPercent=self.probationaryPercent)
+          stop = min(start + segmentLength, len(dataSet.data))
           args.append(
             (
               count,
-              detectorConstructor(
-                dataSet=dataSet,
-                probationaryPercent=self.probationaryPercent),
+              detectorInstance,
               detectorName,
-              self.corpusLabel.labels[relativePath]["label"],
-              self.resultsDir,
-              relativePath
+              relativePath,
+              start,
+              stop
             )
           )
+          segmentSizes.append(
+            (relativePath, stop - detectorInstance.getWarmUpStart(start)))
 
           count += 1
+        finish = functools.partial(
+          self._writeSegments,
+          detectorConstructor(dataSet=dataSet,
+                              probationaryPercent=self.probationaryPercent),
+          detectorName, relativePath)
+        jobs.append(([detectorName], detectSegment, args, finish,
+                     segmentSizes))
+
+    return jobs
+
 
-    # Using `map_async` instead of `map` so interrupts are properly handled.
-    # See: http://stackoverflow.com/a/1408476
-    self.pool.map_async(detectDataSet, args).get(999999)
+  def _memoryEstimator(self, detectors, memoryBudget):
+    """Returns the estimator of the memory of detection tasks under a budget,
+    or None without one."""
+    if memoryBudget is None:
+      return None
+    return MemoryEstimator(
+      detectors, os.path.join(self.resultsDir, "memory_results.json"))
 
 
-  def optimize(self, detectorNames):
+  def _submitDetection(self, tasks, estimator, detectorNames, function, args,
+                       sizes, then):
+    """Submits the tasks of a detection job to a TaskQueue, with estimates of
+    their memory when under a budget."""
+    if estimator is None:
+      tasks.submit(function, args, then)
+      return
+    detectorEstimates = [[estimator.estimate(detectorName, numRecords)
+                          for detectorName in detectorNames]
+                         for _, numRecords in sizes]
+
+    def measured(i, peakRSS, baselineRSS):
+      relativePath, numRecords = sizes[i]
+      estimator.record(detectorNames, relativePath, numRecords,
+                       detectorEstimates[i], peakRSS, baselineRSS)
+
+    tasks.submit(function, args, then,
+                 [sum(estimates) for estimates in detectorEstimates], measured)
+
+
+  def _writeSegments(self, detectorInstance, detectorName, relativePath,
+                     segments):
+    writeSegments(detectorInstance, detectorName, segments,
+                  self.corpusLabel.labels[relativePath]["label"],
+                  self.resultsDir, relativePath)
+
+
+  def _writeTimingSummary(self, detectorNames):
+    timingPath = os.path.join(self.resultsDir, "timing_results.json")
+    results = getOldDict(timingPath)
+    for detectorName in detectorNames:
+      results[detectorName] = summarizeTiming(self.timingDir, detectorName)
+    writeJSON(timingPath, results)
+
+
+  def _measureCost(self, detectorConstructor, maxRecords=500, maxSeconds=0.5):
+    """
+    Returns the microseconds a detector takes per record, timed over the
+    first records of the first labelled data file, or infinity if it fails
+    on them. Detectors that don't set `supportsCostProbe` are not built here
+    at all, and also cost infinity.
+
+    @param maxRecords   (int)   Time at most this many records.
+
+    @param maxSeconds   (float) Stop timing after this long, for slow
+                                detectors.
+    """
+    if not detectorConstructor.supportsCostProbe:
+      return float("inf")
+    relativePaths = [relativePath for relativePath in sorted(
+      self.corpus.dataFiles) if relativePath in self.corpusLabel.labels]
+    if not relativePaths:
+      return float("inf")
+    dataSet = self.corpus.dataFiles[relativePaths[0]]
+
+    numRecords = 0
+    try:
+      detector = detectorConstructor(
+        dataSet=dataSet, probationaryPercent=self.probationaryPercent)
+      detector.initialize()
+      began = time.time()
+      for record in dataSet.data.iloc[:maxRecords].to_dict("records"):
+        detector.handleRecord(record)
+        numRecords += 1
+        if time.time() - began > maxSeconds:
+          break
+      elapsed = time.time() - began
+    except Exception:
+      return float("inf")
+    return 1e6 * elapsed / max(numRecords, 1)
+
+
+  def optimize(self, detectorNames, numBuckets=None):
     """Optimize the threshold for each combination of detector and profile.
 
     @param detectorNames  (list)  List of detector names.
 
+    @param numBuckets     (int)   If given, optimize approximately over this
+                                  many anomaly score buckets. See
+                                  nab.optimizer.optimizeSweepArrays().
+
     @return thresholds    (dict)  Dictionary of dictionaries with detector names
                                   then profile names as keys followed by another
                                   dictionary containing the score and the
@@ -135,35 +486,370 @@ class Runner(object):
     """
     print("\nRunning optimize step")
 
-    scoreFlag = False
     thresholds = {}
+    for detectorName in detectorNames:
+      thresholds[detectorName] = _optimizeDetector(
+        self._optimizeArgs(detectorName, numBuckets))
+
+    updateThresholds(thresholds, self.thresholdPath)
+
+    return thresholds
+
+
+  def _optimizeArgs(self, detectorName, numBuckets):
+    """Returns the arguments of _optimizeDetector()."""
+    # Only the labels are needed, not the data files, which tasks would
+    # otherwise be sent with them.
+    corpusLabel = copy.copy(self.corpusLabel)
+    corpusLabel.corpus = None
+    return (detectorName,
+            self.profiles,
+            os.path.join(self.resultsDir, detectorName),
+            corpusLabel,
+            self.probationaryPercent,
+            numBuckets)
+
+
+  def _resultsPath(self, detectorName, relativePath):
+    """Return the results file of a detector for a data file."""
+    relativeDir, fileName = os.path.split(relativePath)
+    return os.path.join(self.resultsDir, detectorName, relativeDir,
+                        detectorName + "_" + fileName)
+
+
+  def _unitCurves(self, detectorName, sweepers, byWindow):
+    """
+    Return the bootstrap units of a detector's results for each profile, over
+    the labeled data files in sorted order. With `detectorName` None, these
+    are the units of the null detector, which need no results files.
+    """
+    unitCurves = {profileName: [] for profileName in sweepers}
+    for relativePath in sorted(self.corpusLabel.windows):
+      if detectorName is None:
+        anomalyScores = numpy.full(len(self.corpusLabel.labels[relativePath]),
+                                   NULL_ANOMALY_SCORE)
+      else:
+        anomalyScores = pandas.read_csv(
+          self._resultsPath(detectorName, relativePath),
+          usecols=["anomaly_score"])["anomaly_score"]
+      for profileName, sweeper in sweepers.items():
+        sweepArrays = sweeper.calcSweepScoreArrays(
+          self.corpusLabel.labels[relativePath]["timestamp"],
+          anomalyScores,
+          self.corpusLabel.windows[relativePath])
+        unitCurves[profileName].extend(
+          calcUnitCurves(sweeper, sweepArrays, byWindow))
+    return unitCurves
+
+
+  def bootstrap(self, detectorNames, numResamples=1000, confidence=0.95,
+                byWindow=False, seed=None):
+    """
+    Bootstrap confidence intervals for the raw and normalized scores of each
+    combination of detector and profile.
+
+    Data files (or, with `byWindow`, label windows and the stretches of data
+    outside them) are resampled with replacement, and each resample has its
+    threshold optimized again.
+
+    @param detectorNames  (list)  List of detector names.
+
+    @param numResamples   (int)   Number of bootstrap resamples.
+
+    @param confidence     (float) Coverage of the intervals.
+
+    @param byWindow       (bool)  Resample windows rather than data files.
 
+    @param seed           (int)   Seed of the resampling.
+
+    @return results       (dict)  Dictionary of dictionaries with detector
+                                  names then profile names as keys, followed by
+                                  the output of nab.bootstrap.bootstrapScores().
+    """
+    print("\nRunning bootstrap step")
+
+    sweepers = {profileName: Sweeper(probationPercent=self.probationaryPercent,
+                                     costMatrix=profile["CostMatrix"])
+                for profileName, profile in self.profiles.items()}
+    nullUnitCurves = self._unitCurves(None, sweepers, byWindow)
+
+    results = {}
     for detectorName in detectorNames:
-      resultsDetectorDir = os.path.join(self.resultsDir, detectorName)
-      resultsCorpus = Corpus(resultsDetectorDir)
+      unitCurves = self._unitCurves(detectorName, sweepers, byWindow)
+      results[detectorName] = {}
+      for profileName, profile in self.profiles.items():
+        result = bootstrapScores(self.getExecutor("bootstrap"),
+                                 unitCurves[profileName],
+                                 nullUnitCurves[profileName],
+                                 profile["CostMatrix"]["tpWeight"],
+                                 numResamples=numResamples,
+                                 confidence=confidence,
+                                 seed=seed)
+        results[detectorName][profileName] = result
+
+        print(("Normalized score for \'%s\' detector on \'%s\' profile = "
+               "%.2f, %d%% interval [%.2f, %.2f]" % (
+                 detectorName, profileName, result["normalized"]["score"],
+                 100 * confidence, result["normalized"]["low"],
+                 result["normalized"]["high"])))
+
+    resultsPath = os.path.join(self.resultsDir, "bootstrap_results.json")
+    updateFinalResults(results, resultsPath)
+    print("Bootstrap results have been written to %s." % resultsPath)
+
+    return results
+
+
+  def crossValidate(self, detectorNames, numFolds=5, byCategory=False,
+                    seed=None):
+    """
+    Score each combination of detector and profile with thresholds optimized
+    on other data files than the ones they are scored on.
+
+    @param detectorNames  (list)  List of detector names.
 
-      thresholds[detectorName] = {}
+    @param numFolds       (int)   Number of folds for k-fold cross-validation.
 
+    @param byCategory     (bool)  Hold out one data category at a time instead.
+
+    @param seed           (int)   Seed for shuffling files into folds.
+
+    @return results       (dict)  Dictionary of dictionaries with detector
+                                  names then profile names as keys, followed by
+                                  the output of
+                                  nab.crossvalidation.crossValidateScores().
+    """
+    print("\nRunning cross-validation step")
+
+    relativePaths = sorted(self.corpusLabel.windows)
+    folds = makeFolds(relativePaths, numFolds, byCategory, seed)
+    numWindows = [len(self.corpusLabel.windows[relativePath])
+                  for relativePath in relativePaths]
+
+    sweepers = {profileName: Sweeper(probationPercent=self.probationaryPercent,
+                                     costMatrix=profile["CostMatrix"])
+                for profileName, profile in self.profiles.items()}
+    nullUnitCurves = self._unitCurves(None, sweepers, False)
+
+    results = {}
+    for detectorName in detectorNames:
+      unitCurves = self._unitCurves(detectorName, sweepers, False)
+      results[detectorName] = {}
       for profileName, profile in self.profiles.items():
-        thresholds[detectorName][profileName] = optimizeThreshold(
-          (detectorName,
-           profile["CostMatrix"],
-           resultsCorpus,
-           self.corpusLabel,
-           self.probationaryPercent))
+        result = crossValidateScores(
+          self.getExecutor("crossValidate"),
+          [contribution for _, contribution, _ in unitCurves[profileName]],
+          [contribution for _, contribution, _ in nullUnitCurves[profileName]],
+          numWindows,
+          folds,
+          profile["CostMatrix"]["tpWeight"])
+        results[detectorName][profileName] = result
+
+        print(("Cross-validated score for \'%s\' detector on \'%s\' profile "
+               "= %.2f (%.2f in-sample)" % (
+                 detectorName, profileName, result["normalized"],
+                 result["inSampleNormalized"])))
+
+    resultsPath = os.path.join(self.resultsDir,
+                               "crossvalidation_results.json")
+    updateFinalResults(results, resultsPath)
+    print("Cross-validation results have been written to %s." % resultsPath)
+
+    return results
+
+
+  def _listResultsFiles(self, detectorName):
+    """Return the modification time of each results file of a detector."""
+    resultsDetectorDir = os.path.join(self.resultsDir, detectorName)
+    modified = {}
+    for path in absoluteFilePaths(resultsDetectorDir):
+      if path.endswith(".csv") and not path.endswith("_scores.csv"):
+        modified[path] = os.path.getmtime(path)
+    return modified
 
-    updateThresholds(thresholds, self.thresholdPath)
+
+  def _updateCurves(self, detectorName):
+    """
+    Bring a detector's corpus curves up to date with its results files.
+
+    Only the files that are new, changed or deleted since the last call are
+    read, and their contributions swapped in or out of the curves.
+
+    @return (bool) Whether any of the curves changed.
+    """
+    resultsDetectorDir = os.path.join(self.resultsDir, detectorName)
+    if detectorName not in self.curves:
+      self.curves[detectorName] = {profileName: CorpusCurve()
+                                   for profileName in self.profiles}
+      self.resultsModified[detectorName] = {}
+      self.sweepGroups[detectorName] = {}
+      self.integerScores[detectorName] = {}
+    curves = self.curves[detectorName]
+    lastModified = self.resultsModified[detectorName]
+    sweepGroups = self.sweepGroups[detectorName]
+
+    sweepers = {profileName: Sweeper(probationPercent=self.probationaryPercent,
+                                     costMatrix=profile["CostMatrix"])
+                for profileName, profile in self.profiles.items()}
+
+    modified = self._listResultsFiles(detectorName)
+    changed = False
+    for path in set(lastModified) - set(modified):
+      relativePath = lastModified.pop(path)[1]
+      for curve in curves.values():
+        curve.removeDataSet(relativePath)
+      del sweepGroups[relativePath]
+      del self.integerScores[detectorName][relativePath]
+      changed = True
+
+    for path, mtime in modified.items():
+      if path in lastModified and lastModified[path][0] == mtime:
+        continue
+
+      relativePath = convertResultsPathToDataPath(os.path.join(
+        detectorName, os.path.relpath(path, resultsDetectorDir)))
+      if relativePath not in self.corpusLabel.labels:
+        continue
+
+      labels = self.corpusLabel.labels[relativePath]
+      try:
+        dataSet = DataFile(path)
+      except (pandas.errors.EmptyDataError, pandas.errors.ParserError):
+        dataSet = None
+      if dataSet is None or len(dataSet.data) != len(labels):
+        # The detector is most likely still writing the file; it is picked up
+        # again on the next poll.
+        continue
+
+      anomalyScores = dataSet.data["anomaly_score"]
+      sweepGroups[relativePath] = {}
+      for profileName, curve in curves.items():
+        sweepArrays = sweepers[profileName].calcSweepScoreArrays(
+          labels["timestamp"],
+          anomalyScores,
+          self.corpusLabel.windows[relativePath])
+        groups = groupSweepArrays(sweepArrays)
+        curve.setDataSet(relativePath,
+                         calcCurveContribution(sweepers[profileName],
+                                               sweepArrays, groups))
+        sweepGroups[relativePath][profileName] = groups
+      self.integerScores[detectorName][relativePath] = (
+        anomalyScores.dtype.kind in "iu")
+      lastModified[path] = (mtime, relativePath)
+      changed = True
+
+    return changed
+
+
+  def _bestThreshold(self, detectorName, profileName, tolerance=1e-6):
+    """
+    Return the best threshold and score of a detector's corpus curve, exactly
+    as `optimize()` would.
+
+    The curve adds and takes away float steps, so its scores may be off by
+    rounding. It only gives the candidates, the thresholds within `tolerance`
+    of its best score, whose scores are then computed again over the data
+    sets in the order `optimize()` reads them.
+    """
+    sweeper = Sweeper(probationPercent=self.probationaryPercent,
+                      costMatrix=self.profiles[profileName]["CostMatrix"])
+    lastModified = self.resultsModified[detectorName]
+    relativePaths = [lastModified[path][1]
+                     for path in self._listResultsFiles(detectorName)
+                     if path in lastModified]
+    sweepGroups = [self.sweepGroups[detectorName][relativePath][profileName]
+                   for relativePath in relativePaths]
+
+    scores = self.curves[detectorName][profileName].scoresByThreshold()
+    bestScore = max(x.score for x in scores)
+    bestParams = max(
+      (sweeper.calcCorpusScoreAtThreshold(sweepGroups, x.threshold)
+       for x in scores if x.score >= bestScore - tolerance),
+      key=lambda x: x.score)
+
+    integerScores = [self.integerScores[detectorName][relativePath]
+                     for relativePath in relativePaths]
+    return {
+      "threshold": thresholdForScores(bestParams.threshold, integerScores),
+      "score": bestParams.score
+    }
+
+
+  def pollResults(self, detectorNames, normalize=False):
+    """
+    Re-optimize and re-score the detectors whose results files changed.
+
+    The first call for a detector reads all of its results files; later calls
+    only read the files that changed since, updating the corpus curves by
+    swapping those files' contributions.
+
+    @param detectorNames  (list)  List of detector names.
+
+    @param normalize      (bool)  Whether to also normalize the new scores.
+
+    @return thresholds    (dict)  Like `optimize()`, for the detectors that
+                                  were re-optimized.
+    """
+    thresholds = {}
+    for detectorName in detectorNames:
+      if not self._updateCurves(detectorName):
+        continue
+
+      thresholds[detectorName] = {
+        profileName: self._bestThreshold(detectorName, profileName)
+        for profileName in self.curves[detectorName]}
+
+    if thresholds:
+      updateThresholds(thresholds, self.thresholdPath)
+      self.score(list(thresholds), thresholds)
+
+      # Scoring rewrites the results files with their S(t) columns, which does
+      # not change their anomaly scores.
+      for detectorName in thresholds:
+        lastModified = self.resultsModified[detectorName]
+        for path, mtime in self._listResultsFiles(detectorName).items():
+          if path in lastModified:
+            lastModified[path] = (mtime, lastModified[path][1])
+
+      if normalize:
+        self.normalize()
 
     return thresholds
 
 
+  def watch(self, detectorNames, interval=10.0, normalize=False,
+            maxPolls=None):
+    """
+    Poll the detectors' results directories, re-optimizing and re-scoring as
+    results files land. See `pollResults()`.
+
+    @param detectorNames  (list)  List of detector names.
+
+    @param interval       (float) Seconds to wait between polls.
+
+    @param normalize      (bool)  Whether to also normalize the new scores.
+
+    @param maxPolls       (int)   Stop after this many polls; by default poll
+                                  until interrupted.
+    """
+    print("\nWatching results of %s" % ", ".join(detectorNames))
+
+    polls = 0
+    while maxPolls is None or polls < maxPolls:
+      if polls:
+        time.sleep(interval)
+      self.pollResults(detectorNames, normalize=normalize)
+      polls += 1
+
+
   def score(self, detectorNames, thresholds):
     """Score the performance of the detectors.
 
     Function that must be called only after detection result files have been
     generated and thresholds have been optimized. This looks at the result files
     and scores the performance of each detector specified and stores these
-    results in a csv file.
+    results in a csv file. The detection latency of each label window, and its
+    median and 90th percentile, are written to latency_results.json.
 
     @param detectorNames  (list)    List of detector names.
 
@@ -174,35 +860,236 @@ class Runner(object):
     """
     print("\nRunning scoring step")
 
-    scoreFlag = True
     baselines = {}
 
     self.resultsFiles = []
+    latencies = {}
     for detectorName in detectorNames:
-      resultsDetectorDir = os.path.join(self.resultsDir, detectorName)
-      resultsCorpus = Corpus(resultsDetectorDir)
+      resultsCorpus = Corpus(os.path.join(self.resultsDir, detectorName))
+      latencies[detectorName] = {}
 
-      for profileName, profile in self.profiles.items():
+      for profileName in self.profiles:
 
         threshold = thresholds[detectorName][profileName]["threshold"]
-        resultsDF = scoreCorpus(threshold,
-                                (self.pool,
-                                 detectorName,
-                                 profileName,
-                                 profile["CostMatrix"],
-                                 resultsDetectorDir,
-                                 resultsCorpus,
-                                 self.corpusLabel,
-                                 self.probationaryPercent,
-                                 scoreFlag))
-
-        scorePath = os.path.join(resultsDetectorDir, "%s_%s_scores.csv" %\
-          (detectorName, profileName))
-
-        resultsDF.to_csv(scorePath, index=False)
-        print("%s detector benchmark scores written to %s" %\
-          (detectorName, scorePath))
-        self.resultsFiles.append(scorePath)
+        resultsDF, latencyDF = scoreCorpus(threshold,
+                                self._scoreCorpusArgs(
+                                  self.getExecutor("score"),
+                                  detectorName,
+                                  profileName,
+                                  resultsCorpus),
+                                withLatency=True)
+        self.resultsFiles.append(self._writeScores(
+          detectorName, profileName, resultsDF, latencyDF, latencies))
+
+    self._writeLatencies(latencies)
+
+
+  def _scoreCorpusArgs(self, pool, detectorName, profileName, resultsCorpus):
+    """Returns the arguments of scoreCorpus() but the threshold."""
+    return (pool,
+            detectorName,
+            profileName,
+            self.profiles[profileName]["CostMatrix"],
+            os.path.join(self.resultsDir, detectorName),
+            resultsCorpus,
+            self.corpusLabel,
+            self.probationaryPercent,
+            True)
+
+
+  def _writeScores(self, detectorName, profileName, resultsDF, latencyDF,
+                   latencies):
+    """
+    Writes the scores of a detector with a profile, and adds the latency of
+    each of its windows to `latencies`.
+
+    @return (string) Path of the scores file.
+    """
+    scorePath = os.path.join(self.resultsDir, detectorName,
+                             "%s_%s_scores.csv" % (detectorName, profileName))
+
+    resultsDF.to_csv(scorePath, index=False)
+    print("%s detector benchmark scores written to %s" %\
+      (detectorName, scorePath))
+    self.resultsDFs[scorePath] = resultsDF
+
+    latency = summarizeLatency(latencyDF)
+    latency["perWindow"] = latencyDF.drop(
+      columns=["Detector", "Profile"]).astype(object).where(
+        latencyDF.notnull(), None).to_dict("records")
+    latencies.setdefault(detectorName, {})[profileName] = latency
+    return scorePath
+
+
+  def _writeLatencies(self, latencies):
+    latencyPath = os.path.join(self.resultsDir, "latency_results.json")
+    updateFinalResults(latencies, latencyPath)
+    print("Detection latencies have been written to %s." % latencyPath)
+
+
+  def pipeline(self, detectors, numBuckets=None, timing=False,
+               sampleInterval=1, fanOut=None, segmentLength=None,
+               memoryBudget=None):
+    """
+    Detect, optimize and score, with the same results as detect(), optimize()
+    and score() in turn, but without waiting for every detector at each step.
+    The work is a graph of tasks on the executor of the "pipeline" stage: the
+    thresholds of a detector are optimized as soon as all its results files
+    are written, and its results scored with each profile in turn as soon as
+    its thresholds are known. The workers left idle as the last detectors finish
+    detection so take on the later steps of the others, and the whole run
+    takes little longer than its longest detection.
+
+    Arguments as for detect() and optimize(). Under a memory budget, tasks
+    of optimizing and scoring are not estimated to take any.
+
+    @return thresholds  (dict)  As from optimize().
+    """
+    print("\nRunning detection, optimize and scoring steps together")
+
+    tasks = TaskQueue(self.getExecutor("pipeline", detectors), memoryBudget)
+    estimator = self._memoryEstimator(detectors, memoryBudget)
+
+    jobs = self._detectionJobs(detectors, timing, sampleInterval, fanOut,
+                               segmentLength)
+    remaining = {detectorName: 0 for detectorName in detectors}
+    for detectorNames, _, _, _, _ in jobs:
+      for detectorName in detectorNames:
+        remaining[detectorName] += 1
+
+    thresholds = {}
+    latencies = {}
+    scorePaths = {}
+
+    def optimize(detectorName):
+      tasks.submit(_optimizeDetector,
+                   [self._optimizeArgs(detectorName, numBuckets)],
+                   functools.partial(optimized, detectorName))
+
+    def detected(detectorNames, finish, outputs):
+      if finish is not None:
+        finish(outputs)
+      for detectorName in detectorNames:
+        remaining[detectorName] -= 1
+        if remaining[detectorName] == 0:
+          optimize(detectorName)
+
+    def optimized(detectorName, results):
+      thresholds[detectorName] = results[0]
+      score(detectorName, list(self.profiles))
+
+    def score(detectorName, profileNames):
+      # Scoring adds a column to each results file, so the profiles of a
+      # detector are scored one after the other, as by score().
+      profileName = profileNames[0]
+      resultsCorpus = Corpus(os.path.join(self.resultsDir, detectorName))
+      threshold = thresholds[detectorName][profileName]["threshold"]
+      tasks.submit(scoreDataSet,
+                   scoreDataSetArgs(threshold, self._scoreCorpusArgs(
+                     None, detectorName, profileName, resultsCorpus)),
+                   functools.partial(scored, detectorName, profileNames))
+
+    def scored(detectorName, profileNames, results):
+      resultsDF, latencyDF = totalScores(results, withLatency=True)
+      scorePaths[detectorName, profileNames[0]] = self._writeScores(
+        detectorName, profileNames[0], resultsDF, latencyDF, latencies)
+      if len(profileNames) > 1:
+        score(detectorName, profileNames[1:])
+
+    for detectorNames, function, args, finish, sizes in jobs:
+      self._submitDetection(tasks, estimator, detectorNames, function, args,
+                            sizes,
+                            functools.partial(detected, detectorNames, finish))
+    for detectorName, count in remaining.items():
+      if count == 0:
+        optimize(detectorName)
+
+    tasks.run()
+
+    if timing:
+      self._writeTimingSummary(detectors)
+    if estimator is not None:
+      estimator.write()
+      estimator.report()
+    updateThresholds(thresholds, self.thresholdPath)
+    self.resultsFiles = [scorePaths[detectorName, profileName]
+                         for detectorName in detectors
+                         for profileName in self.profiles]
+    self._writeLatencies(latencies)
+
+    return thresholds
+
+
+  def _readScores(self, scorePath):
+    """Return the scores written to `scorePath`, from memory if they were
+    computed by this runner."""
+    if scorePath in self.resultsDFs:
+      return self.resultsDFs[scorePath]
+    with open(scorePath) as f:
+      return pandas.read_csv(f)
+
+
+  def _labelsHash(self, costMatrix):
+    """
+    Return a hash of everything the null detector's scores depend on: the
+    label windows and length of each data file, the probationary percent and
+    the cost matrix.
+    """
+    labelsHash = hashlib.sha1(json.dumps(
+      {"costMatrix": costMatrix,
+       "probationaryPercent": self.probationaryPercent},
+      sort_keys=True).encode("utf-8"))
+    for relativePath in sorted(self.corpusLabel.labels):
+      labelsHash.update(("%s:%d;" % (
+        relativePath, len(self.corpusLabel.windows[relativePath]))
+      ).encode("utf-8"))
+      labelsHash.update(numpy.ascontiguousarray(
+        self.corpusLabel.labels[relativePath]["label"].values,
+        dtype=numpy.int8).tobytes())
+    return labelsHash.hexdigest()
+
+
+  def scoreNullDetector(self):
+    """
+    Return the null detector's scores for each profile, without running it.
+
+    The scores follow from the labels alone; see
+    nab.scorer.scoreNullDetector(). They are cached in the results directory,
+    keyed by a hash of the labels and the profile.
+
+    @return (dict)  Profile names to scores in the layout of the
+                    null_<profile>_scores.csv files.
+    """
+    cachePath = os.path.join(self.resultsDir, "null_baselines.json")
+    cache = getOldDict(cachePath)
+    cacheChanged = False
+
+    nullResults = {}
+    for profileName, profile in self.profiles.items():
+      labelsHash = self._labelsHash(profile["CostMatrix"])
+      if labelsHash not in cache:
+        sweeper = Sweeper(probationPercent=self.probationaryPercent,
+                          costMatrix=profile["CostMatrix"])
+        sweepArrays = {}
+        for relativePath, labels in self.corpusLabel.labels.items():
+          sweepArrays[relativePath] = sweeper.calcSweepScoreArrays(
+            labels["timestamp"],
+            numpy.full(len(labels), NULL_ANOMALY_SCORE),
+            self.corpusLabel.windows[relativePath])
+        results = scoreNullDetector(sweeper, sweepArrays, profileName)
+        cache[labelsHash] = results.astype(object).where(
+          results.notnull(), None).to_dict("records")
+        cacheChanged = True
+
+      nullResults[profileName] = pandas.DataFrame(cache[labelsHash],
+                                                  columns=SCORE_COLUMNS)
+      nullResults[profileName]["Profile"] = profileName
+
+    if cacheChanged:
+      makeDirsExist(self.resultsDir)
+      writeJSON(cachePath, cache)
+
+    return nullResults
 
 
   def normalize(self):
@@ -218,51 +1105,70 @@ class Runner(object):
     multiplying by 100 and dividing by perfect less the baseline, where the
     perfect score is the number of TPs possible.
 
+    Once the runner is initialized, the baseline is computed from the labels
+    by scoreNullDetector(), so the null detector need not have been run.
+    Otherwise it is read from the null detector's scores files.
+
     Note the results CSVs still contain the original scores, not normalized.
     """
     print("\nRunning score normalization step")
 
     # Get baseline scores for each application profile.
-    nullDir = os.path.join(self.resultsDir, "null")
-    if not os.path.isdir(nullDir):
-      raise IOError("No results directory for null detector. You must "
-                    "run the null detector before normalizing scores.")
+    if self.corpusLabel is not None:
+      nullResults = self.scoreNullDetector()
+    else:
+      # Without the corpus, fall back on the null detector's scores files.
+      nullDir = os.path.join(self.resultsDir, "null")
+      if not os.path.isdir(nullDir):
+        raise IOError("No results directory for null detector. You must "
+                      "run the null detector before normalizing scores.")
+
+      nullResults = {}
+      for profileName, _ in self.profiles.items():
+        fileName = os.path.join(nullDir,
+                                "null_" + profileName + "_scores.csv")
+        nullResults[profileName] = self._readScores(fileName)
 
     baselines = {}
-    for profileName, _ in self.profiles.items():
-      fileName = os.path.join(nullDir,
-                              "null_" + profileName + "_scores.csv")
-      with open(fileName) as f:
-        results = pandas.read_csv(f)
-        baselines[profileName] = results["Score"].iloc[-1]
+    for profileName, results in nullResults.items():
+      baselines[profileName] = results["Score"].iloc[-1]
 
     # Get total number of TPs
     with open(self.labelPath, "rb") as f:
       labelsDict = json.load(f)
     tpCount = 0
-    for labels in list(labelsDict.values()):
+    windowCounts = {}
+    for relativePath, labels in list(labelsDict.items()):
       tpCount += len(labels)
+      windowCounts[relativePath] = len(labels)
 
     # Normalize the score from each results file.
     finalResults = {}
+    breakdowns = {}
     for resultsFile in self.resultsFiles:
       profileName = [k for k in list(baselines.keys()) if k in resultsFile][0]
       base = baselines[profileName]
 
-      with open(resultsFile) as f:
-        results = pandas.read_csv(f)
+      results = self._readScores(resultsFile)
+
+      # Calculate score:
+      tpWeight = self.profiles[profileName]["CostMatrix"]["tpWeight"]
+      perfect = tpCount * tpWeight
+      score = normalizeScore(results["Score"].iloc[-1], base, perfect)
 
-        # Calculate score:
-        perfect = tpCount * self.profiles[profileName]["CostMatrix"]["tpWeight"]
-        score = 100 * (results["Score"].iloc[-1] - base) / (perfect - base)
+      # Add to results dict:
+      resultsInfo = resultsFile.split(os.path.sep)[-1].split('.')[0]
+      detector = resultsInfo.split('_')[0]
+      profile = resultsInfo.replace(detector + "_", "").replace("_scores", "")
+      if detector not in finalResults:
+        finalResults[detector] = {}
+      finalResults[detector][profile] = score
 
-        # Add to results dict:
-        resultsInfo = resultsFile.split(os.path.sep)[-1].split('.')[0]
-        detector = resultsInfo.split('_')[0]
-        profile = resultsInfo.replace(detector + "_", "").replace("_scores", "")
-        if detector not in finalResults:
-          finalResults[detector] = {}
-        finalResults[detector][profile] = score
+      # Break the scores down by category and file, when the results have
+      # per-file rows.
+      if "File" in results and "File" in nullResults[profileName]:
+        breakdowns.setdefault(detector, {})[profile] = calcScoreBreakdown(
+          results, nullResults[profileName], windowCounts, tpWeight)
 
       print(("Final score for \'%s\' detector on \'%s\' profile = %.2f"
              % (detector, profile, score)))
@@ -271,3 +1177,32 @@ class Runner(object):
     updateFinalResults(finalResults, resultsPath)
     print("Final scores have been written to %s." % resultsPath)
 
+    if breakdowns:
+      breakdownPath = os.path.join(self.resultsDir, "breakdown_results.json")
+      updateFinalResults(breakdowns, breakdownPath)
+      print("Scores by category and file have been written to %s."
+            % breakdownPath)
+
+
+
+def _optimizeDetector(args):
+  """
+  Optimize the threshold of a detector for each profile, from its results
+  files.
+
+  @param args (tuple) The detector name, the profiles, the detector's results
+                      directory, the CorpusLabel, the probationary percent and
+                      the number of buckets to optimize over, or None.
+
+  @return (dict) The result of optimizeThreshold() for each profile.
+  """
+  (detectorName, profiles, resultsDetectorDir, corpusLabel,
+   probationaryPercent, numBuckets) = args
+  resultsCorpus = Corpus(resultsDetectorDir)
+  return {profileName: optimizeThreshold((detectorName,
+                                          profile["CostMatrix"],
+                                          resultsCorpus,
+                                          corpusLabel,
+                                          probationaryPercent),
+                                         numBuckets=numBuckets)
+          for profileName, profile in profiles.items()}
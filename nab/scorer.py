@@ -7,14 +7,115 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import numpy
 import os
 import pandas
 
+from nab.optimizer import optimizeSweepArrays
 from nab.sweeper import Sweeper
 from nab.util import convertResultsPathToDataPath
 
 
-def scoreCorpus(threshold, args):
+# The null detector emits this anomaly score for every record.
+NULL_ANOMALY_SCORE = 0.5
+
+# Columns of the scores of a corpus, as from `scoreCorpus()`.
+SCORE_COLUMNS = ("Detector", "Profile", "File", "Threshold", "Score", "TP", "TN",
+                 "FP", "FN", "Total_Count")
+
+# Columns of the detection latency of each label window.
+LATENCY_COLUMNS = ("Detector", "Profile", "File", "Window", "Start",
+                   "Latency_Rows", "Latency_Seconds")
+
+
+
+def normalizeScore(score, nullScore, perfectScore):
+  """Scale a raw score so the null detector scores 0 and a perfect one 100.
+
+  @param score        (float)   Raw score.
+  @param nullScore    (float)   Raw score of the null detector.
+  @param perfectScore (float)   Raw score of a perfect detector, i.e. the number
+                                of label windows times the true positive weight.
+
+  @return (float) Normalized score.
+  """
+  return 100 * (score - nullScore) / (perfectScore - nullScore)
+
+
+def scoreArrays(streams, profiles, probationaryPercent=0.15, numBuckets=None):
+  """Optimize, score and normalize a detector on in-memory data.
+
+  This is the library counterpart of running the optimize, score and
+  normalize steps on a results directory, with the same logic but no files.
+  The null detector baseline comes from `scoreNullDetector()` on the same
+  streams.
+
+  @param streams    (dict)  Maps each stream name to a tuple of
+                            (timestamps, anomalyScores, windowLimits): arrays
+                            of the record timestamps and anomaly scores, and
+                            the first and last timestamp of each label window.
+
+  @param profiles   (dict)  Maps profile names to dicts holding a
+                            "CostMatrix", as in config/profiles.json.
+
+  @param probationaryPercent  (float) Percent of each stream not to be
+                                      considered during scoring.
+
+  @param numBuckets (int)   Optionally optimize approximately over this many
+                            anomaly score buckets; see
+                            nab.optimizer.optimizeSweepArrays().
+
+  @return (dict)  For each profile name, a dict containing:
+        "threshold"   (float)   Optimized threshold.
+        "score"       (float)   Raw score of the corpus at the threshold.
+        "normalized"  (float)   Normalized score of the corpus.
+        "nullScore"   (float)   Raw score of the null detector.
+        "streams"     (dict)    For each stream name, its "score", "tp", "tn",
+                                "fp" and "fn" counts at the threshold, and
+                                "sweepScores", the array of per-record S(t)
+                                values.
+  """
+  results = {}
+  for profileName, profile in profiles.items():
+    sweeper = Sweeper(probationPercent=probationaryPercent,
+                      costMatrix=profile["CostMatrix"])
+
+    sweepArrays = {}
+    numWindows = 0
+    for name, (timestamps, anomalyScores, windowLimits) in streams.items():
+      sweepArrays[name] = sweeper.calcSweepScoreArrays(
+        timestamps, anomalyScores, windowLimits)
+      numWindows += len(windowLimits)
+
+    bestParams = optimizeSweepArrays(sweeper, sweepArrays.values(), numBuckets)
+    nullScore = scoreNullDetector(
+      sweeper, sweepArrays, profileName)["Score"].iloc[-1]
+
+    streamResults = {}
+    for name, x in sweepArrays.items():
+      row = sweeper.calcScoreAtThreshold(x, bestParams["threshold"])
+      streamResults[name] = {
+        "score": row.score,
+        "tp": row.tp,
+        "tn": row.tn,
+        "fp": row.fp,
+        "fn": row.fn,
+        "sweepScores": x.sweepScores
+      }
+
+    perfect = numWindows * profile["CostMatrix"]["tpWeight"]
+    results[profileName] = {
+      "threshold": bestParams["threshold"],
+      "score": bestParams["score"],
+      "normalized": normalizeScore(bestParams["score"], nullScore, perfect),
+      "nullScore": nullScore,
+      "streams": streamResults
+    }
+
+  return results
+
+
+def scoreCorpus(threshold, args, withLatency=False):
   """Scores the corpus given a detector's results and a user profile.
 
   Scores the corpus in parallel.
@@ -24,8 +125,8 @@ def scoreCorpus(threshold, args):
 
   @param args       (tuple)   Contains:
 
-    pool                (multiprocessing.Pool)  Pool of processes to perform
-                                                tasks in parallel.
+    pool                (multiprocessing.Pool)  Pool or nab.executor Executor
+                                                to perform tasks in parallel.
     detectorName        (string)                Name of detector.
 
     profileName         (string)                Name of scoring profile.
@@ -43,8 +144,28 @@ def scoreCorpus(threshold, args):
                                                 the NAB corpus.
     probationaryPercent (float)                 Percent of each data file not
                                                 to be considered during scoring.
+
+  @param withLatency  (bool)  Also return the detection latency of each label
+                              window, found in the same pass.
+
+  @return (pandas.DataFrame)  Scores of each data file and their totals, and
+                              with `withLatency`, a second DataFrame of
+                              LATENCY_COLUMNS.
   """
-  (pool,
+  pool = args[0]
+  # Using `map_async` instead of `map` so interrupts are properly handled.
+  # See: http://stackoverflow.com/a/1408476
+  # Magic number is a timeout in seconds.
+  results = pool.map_async(scoreDataSet,
+                           scoreDataSetArgs(threshold, args)).get(999999)
+  return totalScores(results, withLatency)
+
+
+def scoreDataSetArgs(threshold, args):
+  """Returns the arguments of scoreDataSet() for each results file of a
+  detector, for scoreCorpus(), or for callers that run the tasks themselves
+  and total them with totalScores(). Arguments as for scoreCorpus()."""
+  (_,
    detectorName,
    profileName,
    costMatrix,
@@ -89,10 +210,14 @@ def scoreCorpus(threshold, args):
       probationaryPercent,
       scoreFlag))
 
-  # Using `map_async` instead of `map` so interrupts are properly handled.
-  # See: http://stackoverflow.com/a/1408476
-  # Magic number is a timeout in seconds.
-  results = pool.map_async(scoreDataSet, args).get(999999)
+  return args
+
+
+def totalScores(results, withLatency=False):
+  """Returns the scores of scoreDataSet() on each file of a corpus, as
+  returned by scoreCorpus()."""
+  latencies = [latency for _, latency in results]
+  results = [row for row, _ in results]
 
   # Total the 6 scoring metrics for all data files
   totals = [None]*3 + [0]*6
@@ -102,20 +227,141 @@ def scoreCorpus(threshold, args):
 
   results.append(["Totals"] + totals)
 
-  resultsDF = pandas.DataFrame(data=results,
-                               columns=("Detector", "Profile", "File",
-                                        "Threshold", "Score", "TP", "TN",
-                                        "FP", "FN", "Total_Count"))
+  resultsDF = pandas.DataFrame(data=results, columns=SCORE_COLUMNS)
+
+  if withLatency:
+    latencyDF = pandas.DataFrame(
+      data=[row for latency in latencies for row in latency],
+      columns=LATENCY_COLUMNS)
+    return resultsDF, latencyDF
 
   return resultsDF
 
 
+def summarizeLatency(latencyDF):
+  """Summarize the detection latency of a detector under one profile.
+
+  Windows that are never detected are counted, but left out of the latency
+  percentiles.
+
+  @param latencyDF  (pandas.DataFrame)  Latency of each window, as from
+                                        `scoreCorpus()`.
+
+  @return (dict) The number of "windows" and of "detected" windows, and the
+                 median and 90th percentile latency in rows and seconds (None
+                 when no window is detected).
+  """
+  detected = latencyDF.dropna(subset=["Latency_Rows"])
+  summary = {
+    "windows": len(latencyDF),
+    "detected": len(detected)
+  }
+  for column, name in (("Latency_Rows", "Rows"),
+                       ("Latency_Seconds", "Seconds")):
+    for percentile, prefix in ((50, "median"), (90, "p90")):
+      summary[prefix + name] = (
+        float(numpy.percentile(detected[column], percentile))
+        if len(detected) else None)
+  return summary
+
+
+def scoreNullDetector(sweeper, sweepArrays, profileName):
+  """Score the null detector without running it.
+
+  The null detector gives every record NULL_ANOMALY_SCORE, so its threshold
+  curve only has two points: above that score nothing is detected, and at it
+  every record is. Optimizing its threshold picks the better of the two, which
+  only depends on the label windows, the lengths and probationary periods of
+  the data sets, and the cost matrix.
+
+  @param sweeper      (Sweeper) Sweeper holding the cost matrix.
+
+  @param sweepArrays  (dict)    Maps data set names to their `SweepArrays`;
+                                their anomaly scores are ignored.
+
+  @param profileName  (string)  Name of the profile, for the "Profile" column.
+
+  @return (pandas.DataFrame) Scores in the layout of `scoreCorpus()`, as if the
+                             null detector had been run, optimized and scored.
+  """
+  best = None
+  for threshold in (1.1, NULL_ANOMALY_SCORE):
+    rows = []
+    for name, x in sweepArrays.items():
+      row = sweeper.calcScoreAtThreshold(
+        x._replace(anomalyScores=numpy.full(len(x.anomalyScores),
+                                            NULL_ANOMALY_SCORE)),
+        threshold)
+      rows.append(["null", profileName, name, threshold, row.score,
+                   row.tp, row.tn, row.fp, row.fn, row.total])
+    score = sum(row[4] for row in rows)
+    if best is None or score > best[0]:
+      best = (score, rows)
+
+  totals = [sum(row[i] for row in best[1]) for i in range(4, 10)]
+  results = best[1] + [["Totals", None, None, None] + totals]
+
+  return pandas.DataFrame(data=results, columns=SCORE_COLUMNS)
+
+
+def calcScoreBreakdown(resultsDF, nullDF, windowCounts, tpWeight):
+  """Break a detector's scores down by data category and by data file.
+
+  Each category and file is normalized like the whole corpus is in
+  `Runner.normalize()`, against the null detector's score on the same files.
+
+  @param resultsDF    (pandas.DataFrame)  Scores from `scoreCorpus()`.
+
+  @param nullDF       (pandas.DataFrame)  Scores of the null detector under
+                                          the same profile.
+
+  @param windowCounts (dict)              Number of label windows of each data
+                                          file.
+
+  @param tpWeight     (float)             True positive weight of the profile.
+
+  @return (dict) "categories" and "files", each mapping names to their
+                 "score", "normalized" score (None when a perfect detector
+                 would not beat the null one, e.g. without windows), "null"
+                 score, and "tp", "tn", "fp" and "fn" counts.
+  """
+  counts = ["TP", "TN", "FP", "FN"]
+  rows = resultsDF.loc[resultsDF["Detector"] != "Totals",
+                       ["File", "Score"] + counts].copy()
+  nullScores = nullDF.loc[nullDF["Detector"] != "Totals"].set_index("File")
+  rows["Null"] = rows["File"].map(nullScores["Score"])
+  rows["Windows"] = rows["File"].map(windowCounts)
+  rows["Category"] = rows["File"].str.split("/").str[0]
+
+  breakdown = {}
+  for level, key in (("categories", "Category"), ("files", "File")):
+    grouped = rows.groupby(key)[["Score", "Null", "Windows"] + counts].sum()
+    margin = grouped["Windows"] * tpWeight - grouped["Null"]
+    normalized = 100 * (grouped["Score"] - grouped["Null"]) / margin.where(
+      margin != 0)
+
+    breakdown[level] = {}
+    for name, row in grouped.iterrows():
+      breakdown[level][name] = {
+        "score": float(row["Score"]),
+        "normalized": (None if pandas.isnull(normalized[name])
+                       else float(normalized[name])),
+        "null": float(row["Null"])
+      }
+      for count in counts:
+        breakdown[level][name][count.lower()] = int(row[count])
+
+  return breakdown
+
+
 def scoreDataSet(args):
   """Function called to score each dataset in the corpus.
 
   @param args   (tuple)  Arguments to get the detection score for a dataset.
 
-  @return       (tuple)  Contains:
+  @return       (tuple)  The score row of the dataset, and a list of rows of
+                         LATENCY_COLUMNS with the detection latency of each of
+                         its windows. The score row contains:
     detectorName  (string)  Name of detector used to get anomaly scores.
 
     profileName   (string)  Name of profile used to weight each detection type.
@@ -155,19 +401,21 @@ def scoreDataSet(args):
     costMatrix=costMatrix
   )
 
-  (scores, bestRow) = scorer.scoreDataSet(
-    timestamps,
-    anomalyScores,
-    windows,
-    relativePath,
-    threshold,
-  )
+  sweepArrays = scorer.calcSweepScoreArrays(timestamps, anomalyScores, windows)
+  bestRow = scorer.calcScoreAtThreshold(sweepArrays, threshold)
+  latency = scorer.calcDetectionLatency(sweepArrays, timestamps, threshold)
 
   if scoreFlag:
     # Append scoring function values to the respective results file
     dfCSV = pandas.read_csv(outputPath, header=0, parse_dates=[0])
-    dfCSV["S(t)_%s" % profileName] = scores
+    dfCSV["S(t)_%s" % profileName] = sweepArrays.sweepScores
     dfCSV.to_csv(outputPath, index=False)
 
-  return (detectorName, profileName, relativePath, threshold, bestRow.score,
-          bestRow.tp, bestRow.tn, bestRow.fp, bestRow.fn, bestRow.total)
+  latencyRows = [
+    [detectorName, profileName, relativePath, i, str(window[0]), rows, seconds]
+    for i, (window, rows, seconds) in enumerate(zip(
+      windows, latency.rows.tolist(), latency.seconds.tolist()))]
+
+  return ((detectorName, profileName, relativePath, threshold, bestRow.score,
+           bestRow.tp, bestRow.tn, bestRow.fp, bestRow.fn, bestRow.total),
+          latencyRows)
@@ -0,0 +1,307 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Local streaming service that scores live records with NAB detectors.
+
+The service hosts named streams, each with its own detector instance, and
+speaks JSON lines over TCP or a Unix socket: every request is one JSON object
+on a line, answered by one JSON object on a line. Requests carry an "op":
+
+  {"op": "create", "stream": "cpu", "detector": "windowedGaussian",
+   "inputMin": 0, "inputMax": 100, "numRecords": 10000}
+  {"op": "score", "stream": "cpu",
+   "records": [{"timestamp": "2015-01-01 00:00:00", "value": 12.5}, ...]}
+  {"op": "score", "stream": "cpu", "timestamp": "...", "value": 12.5}
+  {"op": "snapshot", "stream": "cpu"}
+  {"op": "delete", "stream": "cpu"}
+  {"op": "stats"}
+
+Detectors are constructed knowing the range of the values and the length of
+the stream, as in NAB; "numRecords" and "probationaryPercent" set the
+probationary period. "create" can also take a "state" returned by "snapshot",
+to carry on from where a stream left off: a base64 numpy archive of arrays,
+which is checked against the detector's state before it is restored, and never
+unpickled. Every response has "ok", an "error" if not ok, and the request's
+"id" if it had one.
+
+Records are scored on the event loop, in the order they arrive, so requests to
+one stream are handled in turn.
+
+Run with `python -m nab.service --port 8765` or `--path service.sock`.
+"""
+
+import argparse
+import asyncio
+import base64
+import numpy
+import pandas
+import socket
+import time
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+from nab.detectors import getDetectorClass
+from nab.detectors.base import (deserializeState, serializeState,
+                                StreamDataSet)
+from nab.instrumentation import LatencyHistogram
+from nab.util import getProbationPeriod
+
+
+# Most bytes the arrays of a snapshot to restore may take, once decompressed.
+MAX_STATE_SIZE = 2 ** 28
+
+
+
+class Stream(object):
+  """A detector scoring one stream, with its counters."""
+
+  def __init__(self, name, detectorName, inputMin, inputMax, numRecords,
+               probationaryPercent=0.15, state=None):
+    detectorClass = getDetectorClass(detectorName)
+    self.name = name
+    self.detectorName = detectorName
+    self.detector = detectorClass(
+      dataSet=StreamDataSet(name, inputMin, inputMax),
+      probationaryPercent=probationaryPercent)
+    self.detector.probationaryPeriod = getProbationPeriod(probationaryPercent,
+                                                          numRecords)
+    self.detector.initialize()
+    if state is not None:
+      self.detector.setState(deserializeState(state, MAX_STATE_SIZE))
+
+    self.created = time.time()
+    self.requests = 0
+    self.records = 0
+    self.busyNanos = 0
+    self.latency = LatencyHistogram()
+
+
+  def score(self, timestamps, values):
+    """
+    Returns the anomaly score of each record, scoring micro-batches in one
+    call if the detector supports it.
+    """
+    began = time.perf_counter_ns()
+    if self.detector.supportsBatch:
+      scores = self.detector.handleRecords(
+        numpy.array(timestamps, dtype="datetime64[ns]"),
+        numpy.array(values, dtype=float))[0]
+    else:
+      scores = [self.detector.handleRecord({"timestamp": timestamp,
+                                            "value": value})[0]
+                for timestamp, value in zip(timestamps, values)]
+    elapsed = time.perf_counter_ns() - began
+
+    self.requests += 1
+    self.records += len(values)
+    self.busyNanos += elapsed
+    self.latency.record(elapsed)
+    return [float(score) for score in scores]
+
+
+  def stats(self):
+    busySeconds = self.busyNanos / 1e9
+    stats = {
+      "detector": self.detectorName,
+      "requests": self.requests,
+      "records": self.records,
+      "uptimeSeconds": time.time() - self.created,
+      "busySeconds": busySeconds,
+      "recordsPerSecond": self.records / busySeconds if busySeconds else None,
+    }
+    stats.update({"request" + key[0].upper() + key[1:]: value
+                  for key, value in self.latency.summary().items()
+                  if key != "count"})
+    return stats
+
+
+
+class DetectorService(object):
+  """Hosts named streams and answers requests about them."""
+
+  def __init__(self):
+    self.streams = {}
+    self.started = time.time()
+
+
+  def handleRequest(self, request):
+    """
+    Answers one request.
+
+    @param request  (dict)  Decoded request, with an "op".
+
+    @return (dict)  Response, with "ok" and, if not ok, "error".
+    """
+    try:
+      response = self._dispatch(request)
+      response["ok"] = True
+    except KeyError as e:
+      response = {"ok": False, "error": "Missing or unknown %s" % e}
+    except Exception as e:
+      # Detector errors are reported to the client rather than closing the
+      # connection.
+      response = {"ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+    if isinstance(request, dict) and "id" in request:
+      response["id"] = request["id"]
+    return response
+
+
+  def _dispatch(self, request):
+    op = request["op"]
+    if op == "create":
+      return self._create(request)
+    if op == "score":
+      return self._score(request)
+    if op == "snapshot":
+      state = self.streams[request["stream"]].detector.getState()
+      return {"state": base64.b64encode(serializeState(state)).decode("ascii")}
+    if op == "delete":
+      del self.streams[request["stream"]]
+      return {}
+    if op == "stats":
+      return self._stats()
+    raise ValueError("Unknown op '%s'" % op)
+
+
+  def _create(self, request):
+    name = request["stream"]
+    if name in self.streams:
+      raise ValueError("Stream '%s' already exists" % name)
+    state = request.get("state")
+    if state is not None:
+      state = base64.b64decode(state, validate=True)
+    self.streams[name] = Stream(
+      name,
+      request["detector"],
+      request["inputMin"],
+      request["inputMax"],
+      request["numRecords"],
+      probationaryPercent=request.get("probationaryPercent", 0.15),
+      state=state)
+    return {}
+
+
+  def _score(self, request):
+    stream = self.streams[request["stream"]]
+    records = request.get("records")
+    if records is None:
+      records = [request]
+    timestamps = [pandas.Timestamp(record["timestamp"]) for record in records]
+    values = [float(record["value"]) for record in records]
+    return {"scores": stream.score(timestamps, values)}
+
+
+  def _stats(self):
+    streams = {name: stream.stats() for name, stream in self.streams.items()}
+    records = sum(stream.records for stream in self.streams.values())
+    busySeconds = sum(stream.busyNanos
+                      for stream in self.streams.values()) / 1e9
+    return {
+      "uptimeSeconds": time.time() - self.started,
+      "requests": sum(stream.requests for stream in self.streams.values()),
+      "records": records,
+      "recordsPerSecond": records / busySeconds if busySeconds else None,
+      "streams": streams
+    }
+
+
+  async def _handleConnection(self, reader, writer):
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        if not line.strip():
+          continue
+        try:
+          request = json.loads(line)
+        except ValueError:
+          response = {"ok": False, "error": "Request is not valid JSON"}
+        else:
+          response = self.handleRequest(request)
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        await writer.drain()
+    finally:
+      writer.close()
+
+
+  async def start(self, host="127.0.0.1", port=0, path=None):
+    """
+    Start serving, on a Unix socket if `path` is given, or else on TCP.
+
+    @return (asyncio.Server) The server; for TCP, `server.sockets` has the
+                             port if 0 was asked for.
+    """
+    # Micro-batches of records can make long lines.
+    limit = 2 ** 24
+    if path is not None:
+      return await asyncio.start_unix_server(self._handleConnection, path,
+                                             limit=limit)
+    return await asyncio.start_server(self._handleConnection, host, port,
+                                      limit=limit)
+
+
+
+class ServiceClient(object):
+  """Blocking client of a DetectorService, over TCP or a Unix socket."""
+
+  def __init__(self, host="127.0.0.1", port=None, path=None, timeout=60.0):
+    if path is not None:
+      self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.socket.settimeout(timeout)
+      self.socket.connect(path)
+    else:
+      self.socket = socket.create_connection((host, port), timeout)
+    self.file = self.socket.makefile("rwb")
+
+
+  def request(self, op, **fields):
+    """Send a request and return the response."""
+    fields["op"] = op
+    self.file.write((json.dumps(fields) + "\n").encode("utf-8"))
+    self.file.flush()
+    return json.loads(self.file.readline())
+
+
+  def close(self):
+    self.file.close()
+    self.socket.close()
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    self.close()
+
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Serve NAB detectors over JSON lines.")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--path", default=None,
+                      help="Serve on this Unix socket instead of TCP")
+  args = parser.parse_args()
+
+  async def serve():
+    server = await DetectorService().start(args.host, args.port, args.path)
+    async with server:
+      await server.serve_forever()
+
+  asyncio.run(serve())
+
+
+
+if __name__ == "__main__":
+  main()
@@ -7,8 +7,11 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 from collections import namedtuple
+import heapq
 import logging
 import math
+import numpy
+import os
 
 logger = logging.getLogger(__name__)
 AnomalyPoint = namedtuple(
@@ -19,6 +22,28 @@ ThresholdScore = namedtuple(
   "ThresholdScore",
   ["threshold", "score", "tp", "tn", "fp", "fn", "total"]
 )
+SweepArrays = namedtuple(
+  "SweepArrays",
+  ["anomalyScores", "sweepScores", "windowIds", "windowLimits"]
+)
+DetectionLatency = namedtuple(
+  "DetectionLatency",
+  ["rows", "seconds"]
+)
+SweepGroups = namedtuple(
+  "SweepGroups",
+  ["groups", "falsePositiveScores"]
+)
+
+# Window ids given to rows that are not part of a scorable window.
+OUTSIDE_WINDOW = -1
+PROBATIONARY = -2
+
+# Row layout of the arrays returned by `groupSweepArrays()`.
+SWEEP_GROUP_DTYPE = numpy.dtype([("anomalyScore", "f8"),
+                                 ("sweepScore", "f8"),
+                                 ("windowId", "i8"),
+                                 ("count", "i8")])
 
 
 def sigmoid(x):
@@ -60,6 +85,34 @@ def scaledSigmoid(relativePositionInWindow):
   return val
 
 
+def scaledSigmoidArray(relativePositions):
+  """Apply `scaledSigmoid()` to an array of relative positions.
+
+  Positions beyond 3.0 are set to -1.0 directly; the others still go through
+  `scaledSigmoid()` so the results are bit-identical to the per-row version.
+
+  @param  relativePositions (numpy.ndarray) Relative positions, as described
+                                            in `scaledSigmoid()`.
+
+  @return (numpy.ndarray)
+  """
+  values = numpy.full(len(relativePositions), -1.0)
+  active = relativePositions <= 3.0
+  values[active] = [scaledSigmoid(x) for x in relativePositions[active].tolist()]
+  return values
+
+
+def _addInOrder(total, values):
+  """
+  Return `total` plus each of `values` in turn, rounding after every addition
+  as a Python loop of `+=` would. Unlike `numpy.sum()`, which adds pairwise,
+  `numpy.add.accumulate()` adds strictly in order.
+  """
+  if not len(values):
+    return total
+  return float(numpy.add.accumulate(numpy.concatenate(([total], values)))[-1])
+
+
 def prepAnomalyListForScoring(inputAnomalyList):
   """
   Sort by anomaly score and filter all rows with 'probationary' window name
@@ -69,6 +122,210 @@ def prepAnomalyListForScoring(inputAnomalyList):
     key=lambda x: x.anomalyScore,
     reverse=True)
 
+def _groupStarts(anomalyScores, windowIds):
+  """
+  Return the indices where a new (anomalyScore, windowId) run of rows begins.
+  """
+  changes = ((anomalyScores[1:] != anomalyScores[:-1]) |
+             (windowIds[1:] != windowIds[:-1]))
+  return numpy.concatenate(([0], numpy.flatnonzero(changes) + 1))
+
+
+def _aggregateGroups(starts, anomalyScores, windowIds, counts, sweepScores):
+  """
+  Combine the rows of each group beginning at `starts`, keeping the best
+  sweep score of a window's rows, and the total of those outside windows.
+  """
+  windowIds = windowIds[starts]
+  return (anomalyScores[starts],
+          windowIds,
+          numpy.add.reduceat(counts, starts),
+          numpy.where(windowIds == OUTSIDE_WINDOW,
+                      numpy.add.reduceat(sweepScores, starts),
+                      numpy.maximum.reduceat(sweepScores, starts)))
+
+
+def _saveGroups(groups, falsePositiveScores, path):
+  """
+  Save `SweepGroups` at `path`, the false positive scores next to it with an
+  `_fp` suffix, and return them memory-mapped; or return them as they are if
+  `path` is None.
+  """
+  if path is None:
+    return SweepGroups(groups, falsePositiveScores)
+
+  fpPath = "%s_fp.npy" % os.path.splitext(path)[0]
+  numpy.save(path, groups)
+  numpy.save(fpPath, falsePositiveScores)
+  return SweepGroups(numpy.load(path, mmap_mode="r"),
+                     numpy.load(fpPath, mmap_mode="r"))
+
+
+def groupSweepArrays(sweepArrays, path=None):
+  """
+  Group the scorable rows of a data set by anomaly score, highest first.
+
+  This is the per-file equivalent of `prepAnomalyListForScoring()`, except
+  that rows sharing an anomaly score are collapsed into one group of a window,
+  or one group outside windows. A group holds the number of rows it stands for
+  and, for a window, their best sweep score, or else the total of their sweep
+  scores. As the score of a threshold adds up the sweep scores of the rows
+  outside windows one by one, those are also kept row by row, in the order
+  they are added up: by group, then in row order. Rows in the probationary
+  period are dropped.
+
+  Runs of rows with the same anomaly score and window are collapsed before
+  anything is sorted, so a file with few distinct scores gives few groups
+  whatever its length: a file with a constant score gives one group outside
+  windows and one per window. The false positive scores are only gathered
+  into the order of their groups.
+
+  @param sweepArrays  (SweepArrays) Rows from `calcSweepScoreArrays()`
+  @param path         (string)      Optional `.npy` path. If given, the groups
+                                    are saved there, and the false positive
+                                    scores next to it, and returned
+                                    memory-mapped rather than held in memory.
+
+  @return (SweepGroups) Structured array of `SWEEP_GROUP_DTYPE` rows, and
+                        array of the sweep scores of the rows outside windows
+  """
+  scorable = sweepArrays.windowIds != PROBATIONARY
+  anomalyScores = sweepArrays.anomalyScores[scorable]
+  windowIds = sweepArrays.windowIds[scorable]
+  counts = numpy.ones(len(anomalyScores), dtype=int)
+  sweepScores = sweepArrays.sweepScores[scorable]
+  falsePositiveScores = sweepScores[windowIds == OUTSIDE_WINDOW]
+
+  if len(anomalyScores):
+    (anomalyScores, windowIds, counts, sweepScores) = _aggregateGroups(
+      _groupStarts(anomalyScores, windowIds),
+      anomalyScores, windowIds, counts, sweepScores)
+
+    # Runs outside windows keep their rows' order when sorted, so their false
+    # positive scores are moved along with them, run by run.
+    order = numpy.lexsort((windowIds, -anomalyScores))
+    outside = windowIds == OUTSIDE_WINDOW
+    fpCounts = numpy.where(outside, counts, 0)
+    fpStarts = numpy.cumsum(fpCounts) - fpCounts
+    fpRuns = order[outside[order]]
+    lengths = counts[fpRuns]
+    falsePositiveScores = falsePositiveScores[
+      numpy.repeat(fpStarts[fpRuns] - (numpy.cumsum(lengths) - lengths),
+                   lengths) +
+      numpy.arange(len(falsePositiveScores))]
+
+    (anomalyScores, windowIds, counts, sweepScores) = _aggregateGroups(
+      _groupStarts(anomalyScores[order], windowIds[order]),
+      anomalyScores[order], windowIds[order], counts[order],
+      sweepScores[order])
+
+  groups = numpy.empty(len(anomalyScores), dtype=SWEEP_GROUP_DTYPE)
+  groups["anomalyScore"] = anomalyScores
+  groups["sweepScore"] = sweepScores
+  groups["windowId"] = windowIds
+  groups["count"] = counts
+
+  return _saveGroups(groups, falsePositiveScores, path)
+
+
+def bucketEdges(numBuckets):
+  """
+  Return the lower edges of `numBuckets` equal-width buckets over [0, 1), and
+  of a last bucket for scores of 1.0, which binary detectors emit a lot.
+  """
+  return numpy.arange(numBuckets + 1) / float(numBuckets)
+
+
+def bucketSweepArrays(sweepArrays, numBuckets, path=None):
+  """
+  Like `groupSweepArrays()`, but with anomaly scores quantized into buckets.
+
+  Each row is placed in one of the buckets of `bucketEdges()`, and every
+  group's anomaly score is the lower edge of its bucket, so that sweeping the
+  groups gives exact scores at the bucket edges. Rows are aggregated with
+  counting passes rather than a sort, in O(rows + numBuckets * windows), and
+  the false positive scores are put in bucket order with a stable sort of
+  small integer keys.
+
+  @param sweepArrays  (SweepArrays) Rows from `calcSweepScoreArrays()`
+  @param numBuckets   (int)         Number of buckets.
+  @param path         (string)      Optional `.npy` path, as for
+                                    `groupSweepArrays()`.
+
+  @return (SweepGroups) As from `groupSweepArrays()`
+  """
+  scorable = sweepArrays.windowIds != PROBATIONARY
+  windowIds = sweepArrays.windowIds[scorable]
+  sweepScores = sweepArrays.sweepScores[scorable]
+
+  edges = bucketEdges(numBuckets)
+  numEdges = len(edges)
+  buckets = numpy.clip(
+    numpy.searchsorted(edges, sweepArrays.anomalyScores[scorable],
+                       side="right") - 1,
+    0, numEdges - 1)
+
+  outside = windowIds == OUTSIDE_WINDOW
+  fpCounts = numpy.bincount(buckets[outside], minlength=numEdges)
+  fpScores = numpy.bincount(buckets[outside], weights=sweepScores[outside],
+                            minlength=numEdges)
+
+  numWindows = len(sweepArrays.windowLimits)
+  cells = buckets[~outside] * numWindows + windowIds[~outside]
+  windowCounts = numpy.bincount(cells, minlength=numEdges * numWindows)
+  windowScores = numpy.full(numEdges * numWindows, -numpy.inf)
+  numpy.maximum.at(windowScores, cells, sweepScores[~outside])
+
+  fpBuckets = numpy.flatnonzero(fpCounts)
+  windowCells = numpy.flatnonzero(windowCounts)
+  bucketIds = numpy.concatenate((fpBuckets, windowCells // max(numWindows, 1)))
+  groupWindowIds = numpy.concatenate(
+    (numpy.full(len(fpBuckets), OUTSIDE_WINDOW),
+     windowCells % max(numWindows, 1)))
+  order = numpy.lexsort((groupWindowIds, -bucketIds))
+
+  groups = numpy.empty(len(order), dtype=SWEEP_GROUP_DTYPE)
+  groups["anomalyScore"] = edges[bucketIds[order]]
+  groups["sweepScore"] = numpy.concatenate(
+    (fpScores[fpBuckets], windowScores[windowCells]))[order]
+  groups["windowId"] = groupWindowIds[order]
+  groups["count"] = numpy.concatenate(
+    (fpCounts[fpBuckets], windowCounts[windowCells]))[order]
+
+  # Highest bucket first, then row order.
+  fpKeys = (numEdges - 1 - buckets[outside]).astype(
+    numpy.min_scalar_type(numEdges))
+  falsePositiveScores = sweepScores[outside][
+    numpy.argsort(fpKeys, kind="stable")]
+
+  return _saveGroups(groups, falsePositiveScores, path)
+
+
+def _iterGroups(sweepGroups, windowOffset, blockSize=65536):
+  """
+  Yield (anomalyScore, windowKey, count, sweepScores) tuples for the groups of
+  a `SweepGroups`, reading them one block at a time. A window's group comes
+  with its best sweep score, and a group outside windows with the array of its
+  rows' sweep scores. Window ids are shifted by `windowOffset` so they are
+  unique across data sets.
+  """
+  groups, falsePositiveScores = sweepGroups
+  fpStart = 0
+  for start in range(0, len(groups), blockSize):
+    block = groups[start:start + blockSize]
+    windowIds = block["windowId"]
+    windowKeys = numpy.where(windowIds >= 0, windowIds + windowOffset,
+                             OUTSIDE_WINDOW)
+    for anomalyScore, windowKey, count, sweepScore in zip(
+        block["anomalyScore"].tolist(), windowKeys.tolist(),
+        block["count"].tolist(), block["sweepScore"].tolist()):
+      if windowKey == OUTSIDE_WINDOW:
+        sweepScore = falsePositiveScores[fpStart:fpStart + count]
+        fpStart += count
+      yield (anomalyScore, windowKey, count, sweepScore)
+
+
+
 class Sweeper(object):
   """Class used to iterate over all anomaly scores in a data set, generating
   threshold-score pairs for use in threshold optimization or dataset scoring.
@@ -204,6 +461,236 @@ class Sweeper(object):
     return anomalyList
 
 
+  def calcSweepScoreArrays(self, timestamps, anomalyScores, windowLimits):
+    """
+    Vectorized counterpart of `calcSweepScore()`.
+
+    Instead of one `AnomalyPoint` per row, return a `SweepArrays` tuple of
+    numpy arrays holding each row's anomaly score, its weighted NAB score
+    (identical to `AnomalyPoint.sweepScore`) and the index of the window it
+    belongs to. Rows outside any window get `OUTSIDE_WINDOW`, and rows in the
+    probationary period get `PROBATIONARY`. `windowLimits` holds the first and
+    last row index of each window.
+
+    @param timestamps:    (list)  `datetime` objects
+    @param anomalyScores: (list)  `float` objects in the range [0.0, 1.0]
+    @param windowLimits:  (list)  `tuple` objects of window limits
+
+    @return   (SweepArrays)
+    """
+    assert len(timestamps) == len(anomalyScores), \
+      "timestamps and anomalyScores should not be different lengths!"
+    timestamps = list(timestamps)
+    numRows = len(timestamps)
+
+    limits = numpy.array(
+      [(timestamps.index(t1), timestamps.index(t2)) for t1, t2 in windowLimits],
+      dtype=int).reshape(-1, 2)
+
+    sweepScores = numpy.empty(numRows)
+    windowIds = numpy.full(numRows, OUTSIDE_WINDOW)
+    maxTP = scaledSigmoid(-1.0)
+
+    def scoreFalsePositives(start, end, prevRightIndex, prevWidth):
+      if prevRightIndex is None:
+        # No preceding window, so score as if we were really far away from
+        # the nearest window.
+        unweightedScores = numpy.full(end - start, -1.0)
+      else:
+        rows = numpy.arange(start, end)
+        with numpy.errstate(divide="ignore"):
+          positions = numpy.abs(prevRightIndex - rows) / float(prevWidth - 1)
+        unweightedScores = scaledSigmoidArray(positions)
+      sweepScores[start:end] = unweightedScores * self.fpWeight
+
+    prevRightIndex = None
+    prevWidth = None
+    start = 0
+    for windowId, (leftIndex, rightIndex) in enumerate(limits.tolist()):
+      scoreFalsePositives(start, leftIndex, prevRightIndex, prevWidth)
+
+      width = float(rightIndex - leftIndex + 1)
+      rows = numpy.arange(leftIndex, rightIndex + 1)
+      positions = -(rightIndex - rows + 1) / width
+      sweepScores[leftIndex:rightIndex + 1] = (
+        scaledSigmoidArray(positions) * self.tpWeight / maxTP)
+      windowIds[leftIndex:rightIndex + 1] = windowId
+
+      prevRightIndex = rightIndex
+      prevWidth = width
+      start = rightIndex + 1
+
+    scoreFalsePositives(start, numRows, prevRightIndex, prevWidth)
+
+    probationaryLength = self._getProbationaryLength(numRows)
+    windowIds[numpy.arange(numRows) < probationaryLength] = PROBATIONARY
+
+    return SweepArrays(numpy.asarray(anomalyScores, dtype=float),
+                       sweepScores,
+                       windowIds,
+                       limits)
+
+
+  def calcScoreAtThreshold(self, sweepArrays, threshold):
+    """
+    Find the NAB score of a data set at a single threshold.
+
+    This gives the same counts and score as the matching entry of
+    `calcScoreByThreshold()`, but without the curve of all the other
+    thresholds. The detected false positives are still sorted by anomaly
+    score, to add their scores up in the same order, so that the score is the
+    same to the bit; the rest is one pass over the rows.
+
+    @param sweepArrays  (SweepArrays) Rows from `calcSweepScoreArrays()`
+    @param threshold    (float)       Anomaly scores at or above this value are
+                                      anomaly predictions.
+
+    @return (ThresholdScore)
+    """
+    anomalyScores = sweepArrays.anomalyScores
+    sweepScores = sweepArrays.sweepScores
+    windowIds = sweepArrays.windowIds
+
+    inWindow = windowIds >= 0
+    outsideWindow = windowIds == OUTSIDE_WINDOW
+    detected = anomalyScores >= threshold
+    truePositives = detected & inWindow
+    falsePositives = detected & outsideWindow
+
+    tp = int(numpy.count_nonzero(truePositives))
+    fp = int(numpy.count_nonzero(falsePositives))
+    fn = int(numpy.count_nonzero(inWindow)) - tp
+    tn = int(numpy.count_nonzero(outsideWindow)) - fp
+
+    # A window only counts if it has rows outside the probationary period. It
+    # scores as a false negative unless detected, in which case it takes the
+    # best score among its detections.
+    numWindows = len(sweepArrays.windowLimits)
+    windowScores = numpy.full(numWindows, -float(self.fnWeight))
+    numpy.maximum.at(windowScores,
+                     windowIds[truePositives],
+                     sweepScores[truePositives])
+    bestAnomalyScores = numpy.full(numWindows, -numpy.inf)
+    numpy.maximum.at(bestAnomalyScores,
+                     windowIds[inWindow],
+                     anomalyScores[inWindow])
+    scoredWindows = numpy.unique(windowIds[inWindow])
+
+    # Add up the score as `calcScoreByThreshold()` does: the false positives
+    # one by one from the highest anomaly score down, then each window in the
+    # order its best row is reached. Rows of equal anomaly score are taken in
+    # order.
+    falsePositives = numpy.flatnonzero(falsePositives)
+    falsePositives = falsePositives[
+      numpy.argsort(-anomalyScores[falsePositives], kind="stable")]
+    fpScore = _addInOrder(0.0, sweepScores[falsePositives])
+    scoredWindows = scoredWindows[
+      numpy.lexsort((scoredWindows, -bestAnomalyScores[scoredWindows]))]
+    score = sum([fpScore] + windowScores[scoredWindows].tolist())
+
+    return ThresholdScore(threshold, score, tp, tn, fp, fn, tp + tn + fp + fn)
+
+
+  def calcCorpusScoreAtThreshold(self, sweepGroups, threshold):
+    """
+    Find the NAB score of several data sets at a single threshold.
+
+    This gives the same counts and score as the matching entry of
+    `iterScoreByThreshold()` over the same data sets, in the same order, to
+    the bit: the detected false positives of all the data sets are sorted by
+    anomaly score, ties kept in data set order, and added up one by one, and
+    then the windows in the order their best rows are.
+
+    @param sweepGroups  (list)  `SweepGroups` from `groupSweepArrays()`
+    @param threshold    (float) Anomaly scores at or above this value are
+                                anomaly predictions.
+
+    @return (ThresholdScore)
+    """
+    tn = 0
+    fn = 0
+    tp = 0
+    fp = 0
+    fpAnomalyScores = []
+    fpSweepScores = []
+    windowOrder = []
+    for i, (groups, falsePositiveScores) in enumerate(sweepGroups):
+      anomalyScores = numpy.asarray(groups["anomalyScore"])
+      windowIds = numpy.asarray(groups["windowId"])
+      counts = numpy.asarray(groups["count"])
+      sweepScores = numpy.asarray(groups["sweepScore"])
+      outside = windowIds == OUTSIDE_WINDOW
+      detected = anomalyScores >= threshold
+
+      # Groups are sorted by anomaly score, so the detected false positives
+      # are the first of the data set's.
+      detectedCounts = counts[detected & outside]
+      numDetected = int(detectedCounts.sum())
+      fpAnomalyScores.append(
+        numpy.repeat(anomalyScores[detected & outside], detectedCounts))
+      fpSweepScores.append(numpy.asarray(falsePositiveScores[:numDetected]))
+      fp += numDetected
+      tn += int(counts[outside].sum()) - numDetected
+      tp += int(counts[detected & ~outside].sum())
+      fn += int(counts[~detected & ~outside].sum())
+
+      inWindow = ~outside
+      windows, first = numpy.unique(windowIds[inWindow], return_index=True)
+      windowScores = numpy.full(len(windows), -float(self.fnWeight))
+      numpy.maximum.at(windowScores,
+                       numpy.searchsorted(windows,
+                                          windowIds[detected & inWindow]),
+                       sweepScores[detected & inWindow])
+      windowOrder.extend(zip((-anomalyScores[inWindow][first]).tolist(),
+                             [i] * len(windows),
+                             windows.tolist(),
+                             windowScores.tolist()))
+
+    fpAnomalyScores = numpy.concatenate([[]] + fpAnomalyScores)
+    fpSweepScores = numpy.concatenate([[]] + fpSweepScores)
+    fpScore = _addInOrder(0.0, fpSweepScores[
+      numpy.argsort(-fpAnomalyScores, kind="stable")])
+    windowOrder.sort()
+    score = sum([fpScore] + [windowScore for _, _, _, windowScore
+                             in windowOrder])
+
+    return ThresholdScore(threshold, score, tp, tn, fp, fn, tp + tn + fp + fn)
+
+
+  def calcDetectionLatency(self, sweepArrays, timestamps, threshold):
+    """
+    Find how long after its start each label window is first detected.
+
+    This uses the window indices from `calcSweepScoreArrays()`, so, as when
+    scoring, detections in the probationary period do not count.
+
+    @param sweepArrays  (SweepArrays) Rows from `calcSweepScoreArrays()`
+    @param timestamps   (list)        `datetime` objects of the rows
+    @param threshold    (float)       Anomaly scores at or above this value are
+                                      anomaly predictions.
+
+    @return (DetectionLatency)  Arrays holding, for each window, the number of
+                                rows and of seconds from its first row to its
+                                first detection; NaN if it is not detected.
+    """
+    windowIds = sweepArrays.windowIds
+    starts = sweepArrays.windowLimits[:, 0]
+    detectedRows = numpy.flatnonzero(
+      (windowIds >= 0) & (sweepArrays.anomalyScores >= threshold))
+    # Rows are in order, so the first row of each window is its earliest.
+    windows, first = numpy.unique(windowIds[detectedRows], return_index=True)
+    firstRows = detectedRows[first]
+
+    times = numpy.asarray(timestamps, dtype="datetime64[ns]")
+    rows = numpy.full(len(starts), numpy.nan)
+    rows[windows] = firstRows - starts[windows]
+    seconds = numpy.full(len(starts), numpy.nan)
+    seconds[windows] = ((times[firstRows] - times[starts[windows]]) /
+                        numpy.timedelta64(1, "s"))
+
+    return DetectionLatency(rows, seconds)
+
+
   def calcScoreByThreshold(self, anomalyList):
     """
     Find NAB scores for each threshold in `anomalyList`.
@@ -271,17 +758,102 @@ class Sweeper(object):
     return scoresByThreshold
 
 
+  def iterScoreByThreshold(self, sweepGroups):
+    """
+    Generate the NAB scores for each threshold over several data sets.
+
+    The data sets are given as `SweepGroups` from `groupSweepArrays()`, and
+    are combined with a streaming, heap-based k-way merge. Besides the arrays
+    themselves, which may be memory-mapped, memory use is proportional to the
+    number of data sets and their windows, and the Python work to the number
+    of groups rather than rows. The thresholds, counts and scores match
+    `calcScoreByThreshold()` on all the data sets' AnomalyPoints exactly: the
+    score of a threshold is added up in the same order, the false positives
+    of a group one by one with `numpy.add.accumulate()`, and then the windows
+    in the order their best rows are.
+
+    @param sweepGroups  (list)  `SweepGroups` from `groupSweepArrays()`
+
+    @return (generator) `ThresholdScore` objects, highest threshold first
+    """
+    tn = 0
+    fn = 0
+    tp = 0
+    fp = 0
+    numWindows = 0
+    # The order windows are first reached in: by best anomaly score, then
+    # data set, then row.
+    windowOrder = []
+    streams = []
+    for i, (groups, falsePositiveScores) in enumerate(sweepGroups):
+      anomalyScores = numpy.asarray(groups["anomalyScore"])
+      windowIds = numpy.asarray(groups["windowId"])
+      counts = numpy.asarray(groups["count"])
+      inWindow = windowIds >= 0
+      fn += int(counts[inWindow].sum())
+      tn += int(counts[~inWindow].sum())
+      # Groups are sorted by anomaly score, so a window's first is its best.
+      windows, first = numpy.unique(windowIds[inWindow], return_index=True)
+      windowOrder.extend(zip((-anomalyScores[inWindow][first]).tolist(),
+                             [i] * len(windows),
+                             (windows + numWindows).tolist()))
+
+      streams.append(
+        _iterGroups(SweepGroups(groups, falsePositiveScores), numWindows))
+      if inWindow.any():
+        numWindows += int(windowIds[inWindow].max()) + 1
+
+    # The parts the score of a threshold adds up: the false positives, then
+    # every window, which starts out as a false negative and takes the best
+    # score of its true positives as the threshold drops.
+    windowOrder.sort()
+    windowParts = [None] * numWindows
+    for part, (_, _, windowKey) in enumerate(windowOrder):
+      windowParts[windowKey] = part + 1
+    scoreParts = [0.0] + [-self.fnWeight] * len(windowOrder)
+    curThreshold = 1.1
+
+    for anomalyScore, windowKey, count, sweepScore in heapq.merge(
+        *streams, key=lambda group: -group[0]):
+      if anomalyScore != curThreshold:
+        totalCount = tp + tn + fp + fn
+        yield ThresholdScore(curThreshold, sum(scoreParts), tp, tn, fp, fn,
+                             totalCount)
+        curThreshold = anomalyScore
+
+      if windowKey == OUTSIDE_WINDOW:
+        fp += count
+        tn -= count
+        scoreParts[0] = _addInOrder(scoreParts[0], sweepScore)
+      else:
+        tp += count
+        fn -= count
+        part = windowParts[windowKey]
+        scoreParts[part] = max(scoreParts[part], sweepScore)
+
+    totalCount = tp + tn + fp + fn
+    yield ThresholdScore(curThreshold, sum(scoreParts), tp, tn, fp, fn,
+                         totalCount)
+
+
   def scoreDataSet(
       self, timestamps, anomalyScores, windowLimits, dataSetName, threshold):
     """Function called to score each dataset in the corpus.
 
+    Scoring at a known threshold does not need the full score-by-threshold
+    curve, so this goes through `calcScoreAtThreshold()`. For scores that
+    match `calcScoreByThreshold()` to the bit, two per-row costs remain: the
+    scaled sigmoid of each row within or shortly after a window is computed
+    with `scaledSigmoid()`, one Python call per row, and the detected false
+    positives are sorted by anomaly score to add their scores up in the same
+    order, in O(fp log fp).
+
     @param timestamps     (tuple) tuple of timestamps
     @param anomalyScores  (tuple) tuple of anomaly scores (floats [0, 1.0])
     @param windowLimits   (tuple) tuple of window limit tuples
     @param dataSetName    (string) name of this dataset, usually a file path.
-      Used to name the windows in this dataset, which is important when scoring
-      more than one data set, as each window in all data sets needs to be
-      uniquely named.
+      Windows are identified by their position within the dataset, so this is
+      not needed for scoring; it is kept for compatibility.
     @param threshold      (float) the threshold at which an anomaly score is
       considered to be an anomaly prediction.
 
@@ -290,24 +862,12 @@ class Sweeper(object):
       scores      (list) List of per-row scores, to be saved in score file
       matchingRow (ThresholdScore)
     """
-    anomalyList = self.calcSweepScore(
-      timestamps, anomalyScores, windowLimits, dataSetName)
-    scoresByThreshold = self.calcScoreByThreshold(anomalyList)
-
-    matchingRow = None
-    prevRow = None
-    for thresholdScore in scoresByThreshold:
-      if thresholdScore.threshold == threshold:
-        matchingRow = thresholdScore
-        break
-      elif thresholdScore.threshold < threshold:
-        matchingRow = prevRow
-        break
-
-      prevRow = thresholdScore
+    sweepArrays = self.calcSweepScoreArrays(
+      timestamps, anomalyScores, windowLimits)
+    matchingRow = self.calcScoreAtThreshold(sweepArrays, threshold)
 
     # Return sweepScore for each row, to be added to score file
     return (
-      [x.sweepScore for x in anomalyList],
+      sweepArrays.sweepScores.tolist(),
       matchingRow
     )
@@ -7,6 +7,7 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
+import numpy
 import os
 import pandas
 try:
@@ -85,3 +86,38 @@ def generateWindows(timestamps, numWindows, windowSize):
     windows.append([t1, t2])
 
   return windows
+
+
+def runRecordsAndBatch(detectorClass,
+                       dataSet,
+                       probationaryPercent=0.15,
+                       chunkSize=None):
+  """
+  Run a detector that supports batches on a data set both record by record,
+  through handleRecord(), and in batch, through handleRecords(). Returns the
+  two results as a (perRecord, batch) tuple; they should be identical.
+  @param detectorClass        (type)      AnomalyDetector subclass.
+  @param dataSet              (DataFile)  Data set to run the detector on.
+  @param probationaryPercent  (float)     Passed to the detector.
+  @param chunkSize            (int)       Feed handleRecords() this many records
+                                          at a time instead of all at once.
+  """
+  results = []
+  for batch in (False, True):
+    detector = detectorClass(dataSet=dataSet,
+                             probationaryPercent=probationaryPercent)
+    detector.supportsBatch = batch
+    detector.initialize()
+
+    if batch and chunkSize:
+      handleRecords = detector.handleRecords
+      def handleChunks(timestamps, values):
+        chunks = [handleRecords(timestamps[i:i + chunkSize],
+                                values[i:i + chunkSize])
+                  for i in range(0, len(values), chunkSize)]
+        return [numpy.concatenate(columns) for columns in zip(*chunks)]
+      detector.handleRecords = handleChunks
+
+    results.append(detector.run())
+
+  return tuple(results)
@@ -0,0 +1,201 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Incremental writing of detector results files.
+
+A detector's output is written in fixed-size blocks as records are processed,
+so memory stays bounded by the block size on long streams. Blocks go to a
+temporary file next to the results file, which is renamed into place once
+complete: readers such as `Runner.watch()` never see a partial results file.
+"""
+
+import inspect
+import os
+import pandas
+
+from nab.util import createPath
+
+
+
+DEFAULT_BLOCK_SIZE = 10000
+
+# Timestamps are written in full in every block, whatever the block's times.
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# DataFrame.to_csv() takes the line end as `line_terminator` before pandas 1.5,
+# as in the version requirements.txt pins, and as `lineterminator` after.
+if "lineterminator" in inspect.signature(pandas.DataFrame.to_csv).parameters:
+  _LINE_TERMINATOR = {"lineterminator": "\n"}
+else:
+  _LINE_TERMINATOR = {"line_terminator": "\n"}
+
+
+
+class ResultsWriter(object):
+  """
+  Writes the rows of a results file, one block at a time.
+
+  Use as a context manager; the results file appears only if the block exits
+  without an exception:
+
+    with ResultsWriter(outputPath, headers, labels) as writer:
+      detector.run(writer)
+  """
+
+  def __init__(self,
+               outputPath,
+               headers,
+               labels=None,
+               blockSize=DEFAULT_BLOCK_SIZE):
+    """
+    @param outputPath (string)    Path of the results file.
+    @param headers    (list)      Names of the columns passed to write().
+    @param labels     (sequence)  If given, appended to each row as a "label"
+                                  column. Only the slice for each block is
+                                  copied.
+    @param blockSize  (int)       Number of rows callers should pass to each
+                                  write().
+    """
+    self.outputPath = outputPath
+    self.headers = list(headers)
+    self.labels = labels
+    self.blockSize = blockSize
+    self.numRows = 0
+
+    createPath(outputPath)
+    # Hidden, so that Corpus and Runner.watch() skip it.
+    outputDir, fileName = os.path.split(outputPath)
+    self.tempPath = os.path.join(outputDir,
+                                 ".%s.%d.tmp" % (fileName, os.getpid()))
+    self._file = open(self.tempPath, "w", newline="")
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, excType, excValue, traceback):
+    if excType is None:
+      self.close()
+    else:
+      self.abort()
+
+
+  def write(self, columns, inputRows=None):
+    """
+    Append a block of rows.
+
+    @param columns   (list)   One sequence of values for each of the headers,
+                              all of the same length.
+    @param inputRows (tuple)  The text of the block's input columns and
+                              labels from formatInputs(), if already
+                              formatted for another results file of the same
+                              data set. `columns` then only has the values of
+                              the headers that follow the inputs.
+    """
+    if inputRows is not None:
+      self._writeRows(columns, *inputRows)
+      return
+
+    numRows = len(columns[0]) if columns else 0
+    if any(len(column) != numRows for column in columns):
+      raise ValueError("Columns of a block must all have the same length")
+
+    block = pandas.DataFrame(dict(zip(self.headers, columns)),
+                             columns=self.headers)
+    if self.labels is not None:
+      # label=1 for relaxed windows, 0 otherwise
+      block["label"] = self._nextLabels(numRows)
+
+    block.to_csv(self._file,
+                 index=False,
+                 header=(self.numRows == 0),
+                 date_format=DATE_FORMAT)
+    self.numRows += numRows
+
+
+  def formatInputs(self, inputs):
+    """
+    Returns the text of the next block's input columns, and of its labels,
+    for write(). Results files of several detectors on the same data set, with
+    the same labels, can share it rather than each format the same values.
+
+    @param inputs (list)  Values of the block for each of the leading headers,
+                          e.g. timestamp and value.
+    """
+    labels = self._nextLabels(len(inputs[0]))
+    return (formatRows(inputs),
+            None if labels is None else formatRows([labels]))
+
+
+  def _nextLabels(self, numRows):
+    if self.labels is None:
+      return None
+    labels = self.labels[self.numRows:self.numRows + numRows]
+    if len(labels) != numRows:
+      raise ValueError("More rows were written than there are labels")
+    return getattr(labels, "values", labels)
+
+
+  def _writeRows(self, columns, inputText, labelText):
+    numRows = len(inputText)
+    if any(len(column) != numRows for column in columns):
+      raise ValueError("Columns of a block must all have the same length")
+    if (labelText is None) != (self.labels is None):
+      raise ValueError("Labels must be formatted if and only if the results "
+                       "have labels")
+    self._nextLabels(numRows)
+
+    if self.numRows == 0:
+      headers = self.headers + ([] if self.labels is None else ["label"])
+      pandas.DataFrame(columns=headers).to_csv(self._file, index=False)
+    parts = [inputText, formatRows(columns)]
+    if labelText is not None:
+      parts.append(labelText)
+    self._file.write("".join([",".join(row) + os.linesep
+                              for row in zip(*parts)]))
+    self.numRows += numRows
+
+
+  def close(self):
+    """Flush the remaining rows and move the results file into place."""
+    if self.numRows == 0:
+      # Write the header of an empty results file.
+      self.write([[] for _ in self.headers])
+    if self.labels is not None and self.numRows != len(self.labels):
+      self.abort()
+      raise ValueError("Wrote %d rows for %d labels" %
+                       (self.numRows, len(self.labels)))
+
+    self._file.close()
+    os.replace(self.tempPath, self.outputPath)
+
+
+  def abort(self):
+    """Discard the rows written so far."""
+    self._file.close()
+    if os.path.exists(self.tempPath):
+      os.remove(self.tempPath)
+
+
+
+def formatRows(columns):
+  """
+  Returns the text of each row of a block of columns, as in a results file,
+  without line ends.
+
+  @param columns (list) Sequences of values, all of the same length.
+  """
+  text = pandas.DataFrame(dict(enumerate(columns))).to_csv(
+    index=False, header=False, date_format=DATE_FORMAT, **_LINE_TERMINATOR)
+  rows = text.split("\n")[:-1]
+  if len(columns) == 1:
+    # A row of one empty field is written as "", but not amongst others.
+    rows = ["" if row == '""' else row for row in rows]
+  return rows
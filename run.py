@@ -44,33 +44,73 @@ def main(args):
   profilesFile = os.path.join(root, args.profilesFile)
   thresholdsFile = os.path.join(root, args.thresholdsFile)
 
-  runner = Runner(dataDir=dataDir,
-                  labelPath=windowsFile,
-                  resultsDir=resultsDir,
-                  profilesPath=profilesFile,
-                  thresholdPath=thresholdsFile,
-                  numCPUs=numCPUs)
-
-  runner.initialize()
-
-  if args.detect:
-    detectorConstructors = getDetectorClassConstructors(args.detectors)
-    runner.detect(detectorConstructors)
-
-  if args.optimize:
-    runner.optimize(args.detectors)
-
-  if args.score:
-    with open(args.thresholdsFile) as thresholdConfigFile:
-      detectorThresholds = json.load(thresholdConfigFile)
-    runner.score(args.detectors, detectorThresholds)
-
-  if args.normalize:
-    try:
-      runner.normalize()
-    except AttributeError("Error: you must run the scoring step with the "
-                          "normalization step."):
-      return
+  memoryBudget = None
+  if args.memoryBudget is not None:
+    memoryBudget = int(args.memoryBudget * 2 ** 20)
+
+  stageExecutors = {}
+  if args.detectExecutor is not None:
+    stageExecutors["detect"] = args.detectExecutor
+
+  with Runner(dataDir=dataDir,
+              labelPath=windowsFile,
+              resultsDir=resultsDir,
+              profilesPath=profilesFile,
+              thresholdPath=thresholdsFile,
+              numCPUs=numCPUs,
+              executor=args.executor,
+              stageExecutors=stageExecutors) as runner:
+    runner.initialize()
+
+    fanOut = {"auto": None, "on": True, "off": False}[args.fanOut]
+    if (args.detect and args.optimize and args.score and
+        not args.noPipeline):
+      runner.pipeline(getDetectorClassConstructors(args.detectors),
+                      numBuckets=args.optimizeBuckets,
+                      timing=args.timing,
+                      sampleInterval=args.timingSampleInterval,
+                      fanOut=fanOut,
+                      segmentLength=args.segmentLength,
+                      memoryBudget=memoryBudget)
+    else:
+      if args.detect:
+        detectorConstructors = getDetectorClassConstructors(args.detectors)
+        runner.detect(detectorConstructors,
+                      timing=args.timing,
+                      sampleInterval=args.timingSampleInterval,
+                      fanOut=fanOut,
+                      segmentLength=args.segmentLength,
+                      memoryBudget=memoryBudget)
+
+      if args.optimize:
+        runner.optimize(args.detectors, numBuckets=args.optimizeBuckets)
+
+      if args.score:
+        with open(args.thresholdsFile) as thresholdConfigFile:
+          detectorThresholds = json.load(thresholdConfigFile)
+        runner.score(args.detectors, detectorThresholds)
+
+    if args.normalize:
+      try:
+        runner.normalize()
+      except AttributeError("Error: you must run the scoring step with the "
+                            "normalization step."):
+        return
+
+    if args.bootstrap:
+      runner.bootstrap(args.detectors,
+                       numResamples=args.bootstrap,
+                       byWindow=args.bootstrapWindows)
+
+    if args.crossValidate or args.leaveOneCategoryOut:
+      runner.crossValidate(args.detectors,
+                           numFolds=args.crossValidate,
+                           byCategory=args.leaveOneCategoryOut)
+
+    if args.watch:
+      runner.watch(args.detectors,
+                   interval=args.watchInterval,
+                   normalize=args.normalize)
 
 
 if __name__ == "__main__":
@@ -83,12 +123,116 @@ if __name__ == "__main__":
                     default=False,
                     action="store_true")
 
+  parser.add_argument("--timing",
+                    help="When detecting, also record the latency of each "
+                    "record, written to timing/ and timing_results.json in "
+                    "the results directory",
+                    default=False,
+                    action="store_true")
+
+  parser.add_argument("--timingSampleInterval",
+                    help="When timing, only time one in this many records",
+                    type=int,
+                    default=1)
+
+  parser.add_argument("--fanOut",
+                    help="When detecting, whether to run all detectors over "
+                    "each file in one task. By default only detectors known "
+                    "to be cheap are, as measured on the first data file",
+                    choices=["auto", "on", "off"],
+                    default="auto")
+
+  parser.add_argument("--segmentLength",
+                    help="When detecting, run detectors that support it over "
+                    "each file in parallel segments of this many records",
+                    type=int,
+                    default=None)
+
+  parser.add_argument("--memoryBudget",
+                    help="When detecting, only run as many tasks at once as "
+                    "their estimated peak memory fits in this many MB, beyond "
+                    "that of the idle workers, and report the peaks measured",
+                    type=float,
+                    default=None)
+
+  parser.add_argument("--executor",
+                    help="What the tasks of each step run on: worker "
+                    "processes, threads of this process, or one after the "
+                    "other in it, for profiling and debugging. Detection "
+                    "runs in processes if a detector is not thread-safe",
+                    choices=["process", "thread", "serial"],
+                    default="process")
+
+  parser.add_argument("--detectExecutor",
+                    help="What the tasks of the detection step run on, if "
+                    "not the same as for the other steps. Threads suit "
+                    "thread-safe detectors that spend their time outside "
+                    "Python, not ARTime. Only "
+                    "used with --noPipeline when also optimizing and "
+                    "scoring",
+                    choices=["process", "thread", "serial"],
+                    default=None)
+
+  parser.add_argument("--noPipeline",
+                    help="When detecting, optimizing and scoring, finish each "
+                    "step for every detector before starting the next, "
+                    "rather than start a detector's next step as soon as its "
+                    "last is done",
+                    default=False,
+                    action="store_true")
+
   parser.add_argument("--optimize",
                     help="Optimize the thresholds for each detector and user "
                     "profile combination",
                     default=False,
                     action="store_true")
 
+  parser.add_argument("--optimizeBuckets",
+                    default=None,
+                    type=int,
+                    help="Optimize thresholds approximately, by quantizing "
+                    "anomaly scores into this many buckets. The optimizer "
+                    "reports a bound on how far the score may be from the "
+                    "exact optimum.")
+
+  parser.add_argument("--bootstrap",
+                    default=None,
+                    type=int,
+                    help="Compute bootstrap confidence intervals of the raw "
+                    "and normalized scores from this many resamples of the "
+                    "data files.")
+
+  parser.add_argument("--bootstrapWindows",
+                    help="Resample label windows, and the data outside them, "
+                    "rather than whole data files when bootstrapping",
+                    default=False,
+                    action="store_true")
+
+  parser.add_argument("--crossValidate",
+                    default=None,
+                    type=int,
+                    help="Score each detector with thresholds optimized on "
+                    "other data files, using this many folds.")
+
+  parser.add_argument("--leaveOneCategoryOut",
+                    help="Cross-validate by holding out one data category at "
+                    "a time",
+                    default=False,
+                    action="store_true")
+
+  parser.add_argument("--watch",
+                    help="After the other steps, keep polling the results "
+                    "directories, re-optimizing and re-scoring a detector "
+                    "whenever its results files change",
+                    default=False,
+                    action="store_true")
+
+  parser.add_argument("--watchInterval",
+                    default=10.0,
+                    type=float,
+                    help="Seconds between polls of the results directories "
+                    "in watch mode")
+
   parser.add_argument("--score",
                     help="Analyze results in the results directory",
                     default=False,
@@ -147,7 +291,11 @@ if __name__ == "__main__":
   if (not args.detect
       and not args.optimize
       and not args.score
-      and not args.normalize):
+      and not args.normalize
+      and not args.bootstrap
+      and not args.crossValidate
+      and not args.leaveOneCategoryOut
+      and not args.watch):
     args.detect = True
     args.optimize = True
     args.score = True
@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Compares detection with the single-process Runner against scoring the same
+data files as live streams in a `nab.partition.PartitionedService`, with
+varying numbers of worker processes.
+
+    python scripts/benchmark_partition.py -d windowedGaussian --workers 1 2 4
+
+Each data file becomes a stream, and the streams are fed together, a batch of
+records from every stream at a time. The scores of the service are checked
+against the results files the Runner wrote.
+"""
+
+import argparse
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import time
+
+from nab.detectors import getDetectorClass
+from nab.partition import PartitionedService
+from nab.runner import Runner
+from nab.util import recur
+
+depth = 2
+root = recur(os.path.dirname, os.path.realpath(__file__), depth)
+
+
+
+def runRunner(args, resultsDir):
+  with Runner(dataDir=os.path.join(root, args.dataDir),
+              resultsDir=resultsDir,
+              labelPath=os.path.join(root, args.windowsFile),
+              profilesPath=os.path.join(root, args.profilesFile),
+              thresholdPath=os.path.join(root, args.thresholdsFile),
+              numCPUs=1) as runner:
+    runner.initialize()
+    began = time.time()
+    runner.detect({args.detector: getDetectorClass(args.detector)})
+    seconds = time.time() - began
+  return runner, seconds
+
+
+def runPartitioned(args, dataFiles, numWorkers):
+  """Returns the scores of each data file, and the seconds they took."""
+  names, timestamps, values = [], [], []
+  for relativePath, dataSet in dataFiles.items():
+    names.append(numpy.full(len(dataSet.data), relativePath, dtype=object))
+    timestamps.append(dataSet.data["timestamp"].values)
+    values.append(dataSet.data["value"].values)
+  # Batches of records from every stream, each stream's in order
+  positions = numpy.concatenate([numpy.arange(len(v)) // args.batchSize
+                                 for v in values])
+  order = numpy.argsort(positions, kind="stable")
+  bounds = numpy.flatnonzero(numpy.diff(positions[order])) + 1
+  names = numpy.concatenate(names)[order]
+  timestamps = numpy.concatenate(timestamps)[order]
+  values = numpy.concatenate(values)[order]
+
+  scores = numpy.empty(len(values))
+  with PartitionedService(numWorkers) as service:
+    began = time.time()
+    for relativePath, dataSet in dataFiles.items():
+      service.createStream(relativePath, args.detector,
+                           dataSet.data["value"].min(),
+                           dataSet.data["value"].max(), len(dataSet.data))
+    for batch in numpy.split(numpy.arange(len(values)), bounds):
+      scores[batch] = service.score(list(names[batch]), timestamps[batch],
+                                    values[batch])
+    seconds = time.time() - began
+
+  unshuffled = numpy.empty(len(scores))
+  unshuffled[order] = scores
+  return dict(zip(dataFiles, numpy.split(unshuffled, numpy.cumsum(
+    [len(dataSet.data) for dataSet in dataFiles.values()])[:-1]))), seconds
+
+
+def main(args):
+  resultsDir = tempfile.mkdtemp()
+  try:
+    runner, runnerSeconds = runRunner(args, resultsDir)
+    dataFiles = {relativePath: dataSet
+                 for relativePath, dataSet in runner.corpus.dataFiles.items()
+                 if relativePath in runner.corpusLabel.labels}
+    numRecords = sum(len(dataSet.data) for dataSet in dataFiles.values())
+    print("%-12s %10s %12s %12s" % ("", "seconds", "records/s", "max diff"))
+    print("%-12s %10.2f %12d %12s" % ("Runner", runnerSeconds,
+                                      numRecords / runnerSeconds, "-"))
+
+    for numWorkers in args.workers:
+      scores, seconds = runPartitioned(args, dataFiles, numWorkers)
+      maxDiff = 0.0
+      for relativePath, fileScores in scores.items():
+        category, fileName = os.path.split(relativePath)
+        results = pandas.read_csv(os.path.join(
+          resultsDir, args.detector, category,
+          args.detector + "_" + fileName))
+        maxDiff = max(maxDiff, numpy.abs(
+          results["anomaly_score"].values - fileScores).max())
+      print("%-12s %10.2f %12d %12.3g" % ("%d workers" % numWorkers, seconds,
+                                          numRecords / seconds, maxDiff))
+  finally:
+    shutil.rmtree(resultsDir)
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--detector", default="windowedGaussian",
+                      help="Detector to benchmark")
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                      help="Numbers of worker processes to try")
+  parser.add_argument("--batchSize", type=int, default=100,
+                      help="Records per stream in each batch sent")
+  parser.add_argument("--dataDir", default="data",
+                      help="This holds all the label windows for the corpus.")
+  parser.add_argument("--windowsFile",
+                      default=os.path.join("labels", "combined_windows.json"),
+                      help="JSON file containing ground truth labels for the "
+                      "corpus.")
+  parser.add_argument("--profilesFile",
+                      default=os.path.join("config", "profiles.json"),
+                      help="The configuration file to use while running the "
+                      "benchmark.")
+  parser.add_argument("--thresholdsFile",
+                      default=os.path.join("config", "thresholds.json"),
+                      help="The configuration file that stores thresholds for "
+                      "each combination of detector and username")
+  main(parser.parse_args())
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Compares the wall time of detecting, optimizing and scoring one step after
+the other against `Runner.pipeline()`, which starts each detector's next step
+as soon as its last is done.
+
+    python scripts/benchmark_pipeline.py -d null windowedGaussian \\
+      bayesChangePt --numCPUs 4
+
+The results files and thresholds of the pipeline are checked to be the same
+as those of the steps.
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from nab.detectors import getDetectorClass
+from nab.runner import Runner
+from nab.util import recur
+
+depth = 2
+root = recur(os.path.dirname, os.path.realpath(__file__), depth)
+
+
+
+def run(args, resultsDir, pipeline):
+  """Returns the thresholds, and the seconds the run took."""
+  detectors = {detectorName: getDetectorClass(detectorName)
+               for detectorName in args.detectors}
+  with Runner(dataDir=os.path.join(root, args.dataDir),
+              resultsDir=resultsDir,
+              labelPath=os.path.join(root, args.windowsFile),
+              profilesPath=os.path.join(root, args.profilesFile),
+              thresholdPath=os.path.join(resultsDir, "thresholds.json"),
+              numCPUs=args.numCPUs) as runner:
+    runner.initialize()
+    began = time.time()
+    if pipeline:
+      thresholds = runner.pipeline(detectors)
+    else:
+      runner.detect(detectors)
+      thresholds = runner.optimize(list(detectors))
+      runner.score(list(detectors), thresholds)
+    return thresholds, time.time() - began
+
+
+def sameResults(expectedDir, actualDir):
+  for dirPath, _, fileNames in os.walk(expectedDir):
+    for fileName in fileNames:
+      expected = os.path.join(dirPath, fileName)
+      actual = os.path.join(actualDir, os.path.relpath(expected, expectedDir))
+      if not (os.path.exists(actual) and
+              filecmp.cmp(expected, actual, shallow=False)):
+        return False
+  return True
+
+
+def main(args):
+  tempDir = tempfile.mkdtemp()
+  try:
+    stepsDir = os.path.join(tempDir, "steps")
+    pipelineDir = os.path.join(tempDir, "pipeline")
+    thresholds, stepsSeconds = run(args, stepsDir, False)
+    pipelineThresholds, pipelineSeconds = run(args, pipelineDir, True)
+    print("%-10s %10s" % ("", "seconds"))
+    print("%-10s %10.2f" % ("Steps", stepsSeconds))
+    print("%-10s %10.2f" % ("Pipeline", pipelineSeconds))
+    print("Same results: %s" % (pipelineThresholds == thresholds and
+                                sameResults(stepsDir, pipelineDir)))
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--detectors", nargs="+",
+                      default=["null", "windowedGaussian", "bayesChangePt"],
+                      help="Detectors to run")
+  parser.add_argument("-n", "--numCPUs", type=int, default=None,
+                      help="The number of CPUs to use; all by default")
+  parser.add_argument("--dataDir", default="data",
+                      help="This holds all the label windows for the corpus.")
+  parser.add_argument("--windowsFile",
+                      default=os.path.join("labels", "combined_windows.json"),
+                      help="JSON file containing ground truth labels for the "
+                      "corpus.")
+  parser.add_argument("--profilesFile",
+                      default=os.path.join("config", "profiles.json"),
+                      help="The configuration file to use while running the "
+                      "benchmark.")
+  main(parser.parse_args())
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Compares detection over whole files against detection over segments of each
+file in parallel, for detectors that support segments.
+
+    python scripts/benchmark_segments.py -d windowedGaussian \\
+      --segmentLengths 10000 20000 --numCPUs 4
+
+The results files of each segmented run are checked to be identical to those
+of the run over whole files.
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from nab.detectors import getDetectorClass
+from nab.runner import Runner
+from nab.util import recur
+
+depth = 2
+root = recur(os.path.dirname, os.path.realpath(__file__), depth)
+
+
+
+def runDetect(args, resultsDir, segmentLength):
+  with Runner(dataDir=os.path.join(root, args.dataDir),
+              resultsDir=resultsDir,
+              labelPath=os.path.join(root, args.windowsFile),
+              profilesPath=os.path.join(root, args.profilesFile),
+              thresholdPath=os.path.join(root, args.thresholdsFile),
+              numCPUs=args.numCPUs) as runner:
+    runner.initialize()
+    began = time.time()
+    runner.detect({args.detector: getDetectorClass(args.detector)},
+                  segmentLength=segmentLength)
+    return time.time() - began
+
+
+def sameResults(expectedDir, actualDir):
+  for dirPath, _, fileNames in os.walk(expectedDir):
+    for fileName in fileNames:
+      expected = os.path.join(dirPath, fileName)
+      actual = os.path.join(actualDir, os.path.relpath(expected, expectedDir))
+      if not (os.path.exists(actual) and
+              filecmp.cmp(expected, actual, shallow=False)):
+        return False
+  return True
+
+
+def main(args):
+  tempDir = tempfile.mkdtemp()
+  try:
+    wholeDir = os.path.join(tempDir, "whole")
+    seconds = runDetect(args, wholeDir, None)
+    print("%-16s %10s %10s" % ("", "seconds", "identical"))
+    print("%-16s %10.2f %10s" % ("Whole files", seconds, "-"))
+
+    for segmentLength in args.segmentLengths:
+      resultsDir = os.path.join(tempDir, str(segmentLength))
+      seconds = runDetect(args, resultsDir, segmentLength)
+      print("%-16s %10.2f %10s" % ("Segments of %d" % segmentLength, seconds,
+                                   sameResults(wholeDir, resultsDir)))
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--detector", default="windowedGaussian",
+                      help="Detector to benchmark")
+  parser.add_argument("--segmentLengths", type=int, nargs="+",
+                      default=[10000, 20000],
+                      help="Numbers of records per segment to try")
+  parser.add_argument("-n", "--numCPUs", type=int, default=None,
+                      help="The number of CPUs to use; all by default")
+  parser.add_argument("--dataDir", default="data",
+                      help="This holds all the label windows for the corpus.")
+  parser.add_argument("--windowsFile",
+                      default=os.path.join("labels", "combined_windows.json"),
+                      help="JSON file containing ground truth labels for the "
+                      "corpus.")
+  parser.add_argument("--profilesFile",
+                      default=os.path.join("config", "profiles.json"),
+                      help="The configuration file to use while running the "
+                      "benchmark.")
+  parser.add_argument("--thresholdsFile",
+                      default=os.path.join("config", "thresholds.json"),
+                      help="The configuration file that stores thresholds for "
+                      "each combination of detector and username")
+  main(parser.parse_args())
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+"""
+Measures the memory each stream takes, for every detector that runs in this
+Python: with one detector object per stream, as `nab.service` hosts them, and
+in a `nab.multistream.MultiStreamRuntime`.
+
+    python scripts/benchmark_stream_memory.py --streams 100 --records 1000
+
+Kernels allocate their ring buffers when a stream is added, so windowedGaussian
+streams take less memory in the runtime only once they are longer than its
+window; detector objects keep growing with every record. Tracing allocations
+slows the detectors down severalfold, so the times are only comparable with
+each other.
+"""
+
+import argparse
+import gc
+import numpy
+import time
+import tracemalloc
+
+from nab.detectors import DETECTOR_MODULES, getDetectorClass
+from nab.detectors.base import StreamDataSet
+from nab.multistream import KERNELS, MultiStreamRuntime
+from nab.util import getProbationPeriod
+
+
+
+def streamValues(numStreams, numRecords, seed=0):
+  """Noisy sine waves, one row per stream."""
+  randomState = numpy.random.RandomState(seed)
+  phases = randomState.uniform(0, 2 * numpy.pi, (numStreams, 1))
+  return (10 * numpy.sin(numpy.arange(numRecords) / 20.0 + phases) +
+          randomState.normal(0, 1, (numStreams, numRecords)))
+
+
+def measure(build, feed):
+  """
+  Returns the bytes held after build() and feed(state), and the seconds feed
+  took.
+  """
+  gc.collect()
+  tracemalloc.start()
+  state = build()
+  began = time.time()
+  feed(state)
+  seconds = time.time() - began
+  gc.collect()
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return size, seconds
+
+
+def benchmarkDetectorObjects(detectorName, values, timestamps):
+  detectorClass = getDetectorClass(detectorName)
+  numRecords = values.shape[1]
+
+  def build():
+    detectors = []
+    for i, streamValues in enumerate(values):
+      detector = detectorClass(
+        dataSet=StreamDataSet(str(i), streamValues.min(), streamValues.max()),
+        probationaryPercent=0.15)
+      detector.probationaryPeriod = getProbationPeriod(0.15, numRecords)
+      detector.initialize()
+      detectors.append(detector)
+    return detectors
+
+  def feed(detectors):
+    for j, timestamp in enumerate(timestamps):
+      for detector, streamValues in zip(detectors, values):
+        detector.handleRecord({"timestamp": timestamp,
+                               "value": streamValues[j]})
+
+  return measure(build, feed)
+
+
+def benchmarkRuntime(detectorName, values, timestamps):
+  numStreams, numRecords = values.shape
+
+  def build():
+    runtime = MultiStreamRuntime()
+    for i, streamValues in enumerate(values):
+      runtime.addStream(str(i), detectorName, streamValues.min(),
+                        streamValues.max(), numRecords)
+    return runtime
+
+  def feed(runtime):
+    # A record from every stream at each timestamp, as from a fleet of hosts
+    streamIds = numpy.arange(numStreams)
+    for j, timestamp in enumerate(timestamps):
+      runtime.handleRecords(streamIds, numpy.repeat(timestamp, numStreams),
+                            values[:, j])
+
+  return measure(build, feed)
+
+
+def main(args):
+  values = streamValues(args.streams, args.records)
+  timestamps = numpy.arange(
+    "2015-01-01", args.records * 5, 5, dtype="datetime64[m]").astype(
+      "datetime64[ns]")
+
+  print("%-18s %14s %14s %10s %10s" % ("detector", "object B/stream",
+                                       "runtime B/stream", "object s",
+                                       "runtime s"))
+  for detectorName in args.detectors or sorted(DETECTOR_MODULES):
+    try:
+      getDetectorClass(detectorName)
+    except ImportError as e:
+      print("%-18s skipped: %s" % (detectorName, e))
+      continue
+
+    objectBytes, objectSeconds = benchmarkDetectorObjects(
+      detectorName, values, timestamps)
+    if detectorName in KERNELS:
+      runtimeBytes, runtimeSeconds = benchmarkRuntime(
+        detectorName, values, timestamps)
+      print("%-18s %14d %14d %10.2f %10.2f" % (
+        detectorName, objectBytes / args.streams,
+        runtimeBytes / args.streams, objectSeconds, runtimeSeconds))
+    else:
+      # The runtime hosts these as detector objects too.
+      print("%-18s %14d %14s %10.2f %10s" % (
+        detectorName, objectBytes / args.streams, "(objects)",
+        objectSeconds, "-"))
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--streams", type=int, default=100,
+                      help="Number of concurrent streams")
+  parser.add_argument("--records", type=int, default=1000,
+                      help="Records fed to each stream before measuring")
+  parser.add_argument("--detectors", nargs="*", default=None,
+                      help="Detectors to measure; all by default")
+  main(parser.parse_args())
@@ -0,0 +1,113 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+import random
+
+import numpy
+import pytest
+
+from nab.bootstrap import (bootstrapScores,
+                           calcUnitCurves,
+                           drawWeights,
+                           scoreResamples)
+from nab.optimizer import CorpusCurve, optimizeSweepArrays
+from nab.sweeper import Sweeper
+
+
+def _fakeSweepArrays(sweeper, numDataSets, seed, constant=None):
+  """Return `SweepArrays` for data sets of random anomaly scores."""
+  rng = random.Random(seed)
+  sweepArraysList = []
+  for _ in range(numDataSets):
+    numRows = rng.randint(300, 600)
+    anomalyScores = [rng.random() ** 3 for _ in range(numRows)]
+    windowLimits = []
+    for start in (100, 250):
+      windowLimits.append((start, start + 29))
+      for i in range(start, start + 30, 5):
+        anomalyScores[i] = rng.uniform(0.5, 1.0)
+    if constant is not None:
+      anomalyScores = [constant] * numRows
+    sweepArraysList.append(sweeper.calcSweepScoreArrays(
+      list(range(numRows)), anomalyScores, windowLimits))
+  return sweepArraysList
+
+
+def _units(sweeper, sweepArraysList, byWindow):
+  units = []
+  for sweepArrays in sweepArraysList:
+    units.extend(calcUnitCurves(sweeper, sweepArrays, byWindow))
+  return units
+
+
+class TestBootstrap(object):
+  costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+
+  @pytest.mark.parametrize("byWindow", [False, True])
+  def testWholeCorpusMatchesOptimizer(self, byWindow):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 5, 1)
+    contributions = [c for _, c, _ in
+                     _units(sweeper, sweepArraysList, byWindow)]
+
+    scores, thresholds = scoreResamples(
+      contributions, numpy.ones((1, len(contributions))))
+    best = optimizeSweepArrays(sweeper, sweepArraysList)
+
+    assert thresholds[0] == best["threshold"]
+    assert scores[0] == pytest.approx(best["score"])
+
+  def testResamplesMatchBruteForce(self):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    contributions = [c for _, c, _ in
+                     _units(sweeper, _fakeSweepArrays(sweeper, 6, 2), True)]
+    weights = drawWeights([numpy.arange(len(contributions))],
+                          len(contributions), 20,
+                          numpy.random.RandomState(3))
+
+    scores, thresholds = scoreResamples(contributions, weights, blockSize=7)
+
+    for row, score, threshold in zip(weights, scores, thresholds):
+      curve = CorpusCurve()
+      for i, count in enumerate(row):
+        for copy in range(count):
+          curve.setDataSet((i, copy), contributions[i])
+      best = curve.best()
+      assert threshold == best.threshold
+      assert score == pytest.approx(best.score)
+
+  def testDrawWeightsKeepsStrataSizes(self):
+    strata = [numpy.array([0, 2, 4]), numpy.array([1, 3])]
+    weights = drawWeights(strata, 5, 50, numpy.random.RandomState(0))
+
+    assert (weights[:, strata[0]].sum(axis=1) == 3).all()
+    assert (weights[:, strata[1]].sum(axis=1) == 2).all()
+
+  @pytest.mark.parametrize("byWindow", [False, True])
+  def testBootstrapScores(self, byWindow):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 8, 4)
+    nullSweepArraysList = _fakeSweepArrays(sweeper, 8, 4, constant=0.5)
+
+    results = bootstrapScores(None,
+                              _units(sweeper, sweepArraysList, byWindow),
+                              _units(sweeper, nullSweepArraysList, byWindow),
+                              self.costMatrix["tpWeight"],
+                              numResamples=200,
+                              seed=5,
+                              chunkSize=64)
+
+    raw = optimizeSweepArrays(sweeper, sweepArraysList)["score"]
+    null = optimizeSweepArrays(sweeper, nullSweepArraysList)["score"]
+    perfect = 2 * len(sweepArraysList) * self.costMatrix["tpWeight"]
+    assert results["raw"]["score"] == pytest.approx(raw)
+    assert results["normalized"]["score"] == pytest.approx(
+      100 * (raw - null) / (perfect - null))
+    for scores in (results["raw"], results["normalized"]):
+      assert scores["low"] < scores["score"] < scores["high"]
+      assert scores["stdev"] > 0
@@ -0,0 +1,90 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+import random
+
+import numpy
+import pytest
+
+from nab.crossvalidation import crossValidateScores, makeFolds
+from nab.optimizer import calcCurveContribution, optimizeSweepArrays
+from nab.sweeper import Sweeper
+
+
+def _fakeSweepArrays(sweeper, numDataSets, seed, constant=None):
+  """Return `SweepArrays` for data sets of random anomaly scores."""
+  rng = random.Random(seed)
+  sweepArraysList = []
+  for _ in range(numDataSets):
+    numRows = rng.randint(300, 600)
+    anomalyScores = [rng.random() ** 3 for _ in range(numRows)]
+    windowLimits = []
+    for start in (100, 250):
+      windowLimits.append((start, start + 29))
+      for i in range(start, start + 30, 5):
+        anomalyScores[i] = rng.uniform(0.5, 1.0)
+    if constant is not None:
+      anomalyScores = [constant] * numRows
+    sweepArraysList.append(sweeper.calcSweepScoreArrays(
+      list(range(numRows)), anomalyScores, windowLimits))
+  return sweepArraysList
+
+
+class TestCrossValidation(object):
+  costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+  relativePaths = ["a/1.csv", "a/2.csv", "b/1.csv", "c/1.csv", "c/2.csv",
+                   "c/3.csv", "d/1.csv"]
+
+  @pytest.mark.parametrize("numFolds, byCategory", [(3, False), (10, False),
+                                                    (None, True)])
+  def testFoldsPartitionFiles(self, numFolds, byCategory):
+    folds = makeFolds(self.relativePaths, numFolds, byCategory, seed=0)
+
+    heldOut = numpy.concatenate([test for _, test in folds])
+    assert sorted(heldOut.tolist()) == list(range(len(self.relativePaths)))
+    if byCategory:
+      assert [name for name, _ in folds] == ["a", "b", "c", "d"]
+      assert folds[2][1].tolist() == [3, 4, 5]
+    else:
+      assert len(folds) == min(numFolds, len(self.relativePaths))
+
+  @pytest.mark.parametrize("byCategory", [False, True])
+  def testFoldsMatchOptimizer(self, byCategory):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, len(self.relativePaths), 1)
+    nullSweepArraysList = _fakeSweepArrays(
+      sweeper, len(self.relativePaths), 1, constant=0.5)
+    folds = makeFolds(self.relativePaths, 3, byCategory, seed=2)
+
+    results = crossValidateScores(
+      None,
+      [calcCurveContribution(sweeper, x) for x in sweepArraysList],
+      [calcCurveContribution(sweeper, x) for x in nullSweepArraysList],
+      [2] * len(self.relativePaths),
+      folds,
+      self.costMatrix["tpWeight"])
+
+    totalScore = 0
+    for foldName, test in folds:
+      train = [x for i, x in enumerate(sweepArraysList) if i not in test]
+      best = optimizeSweepArrays(sweeper, train)
+      heldOutScore = sum(
+        sweeper.calcScoreAtThreshold(sweepArraysList[i],
+                                     best["threshold"]).score
+        for i in test)
+      totalScore += heldOutScore
+
+      fold = results["folds"][foldName]
+      assert fold["threshold"] == best["threshold"]
+      assert fold["trainScore"] == pytest.approx(best["score"])
+      assert fold["score"] == pytest.approx(heldOutScore)
+
+    assert results["score"] == pytest.approx(totalScore)
+    assert results["inSampleScore"] == pytest.approx(
+      optimizeSweepArrays(sweeper, sweepArraysList)["score"])
+    assert results["score"] <= results["inSampleScore"] + 1e-9
@@ -0,0 +1,296 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import math
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+from nab.detectors.bayes_changept.bayes_changept_detector import (
+  BayesChangePtDetector)
+from nab.detectors.context_ose.context_ose_detector import (
+  ContextOSEDetector)
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.detectors.null.null_detector import NullDetector
+from nab.detectors.random.random_detector import RandomDetector
+from nab.executor import ProcessExecutor, ThreadExecutor
+from nab.runner import Runner
+
+TEST_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+
+
+
+class FailingDetector(NullDetector):
+
+  def handleRecord(self, inputData):
+    raise RuntimeError("Detector failed")
+
+
+  def handleRecords(self, timestamps, values):
+    raise RuntimeError("Detector failed")
+
+
+
+class ExternalDetector(NullDetector):
+  """Stands for a detector whose model lives in an external runtime, as
+  ARTime's does in Julia."""
+
+  supportsCostProbe = False
+
+  threadSafe = False
+
+  def initialize(self):
+    raise AssertionError("Detector should not have been built")
+
+
+
+class DetectTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.dataDir = os.path.join(TEST_DIR, "test_data")
+    self.labelPath = os.path.join(self.tempDir, "windows.json")
+    # A label window over 60-65% of each data file
+    windows = {}
+    for category in os.listdir(self.dataDir):
+      for fileName in os.listdir(os.path.join(self.dataDir, category)):
+        timestamps = pandas.read_csv(
+          os.path.join(self.dataDir, category, fileName))["timestamp"]
+        windows[category + "/" + fileName] = [[
+          timestamps.iloc[int(len(timestamps) * 0.6)] + ".000000",
+          timestamps.iloc[int(len(timestamps) * 0.65)] + ".000000"]]
+    with open(self.labelPath, "w") as f:
+      json.dump(windows, f)
+    self.runners = []
+
+
+  def tearDown(self):
+    for runner in self.runners:
+      runner.close()
+    shutil.rmtree(self.tempDir)
+
+
+  def _runner(self, resultsDir, numCPUs=1, **kwargs):
+    runner = Runner(dataDir=self.dataDir,
+                    resultsDir=os.path.join(self.tempDir, resultsDir),
+                    labelPath=self.labelPath,
+                    profilesPath=os.path.join(ROOT_DIR, "config",
+                                              "profiles.json"),
+                    thresholdPath=os.path.join(self.tempDir,
+                                               "thresholds.json"),
+                    numCPUs=numCPUs,
+                    **kwargs)
+    self.runners.append(runner)
+    runner.initialize()
+    return runner
+
+
+  def _readResults(self, resultsDir):
+    results = {}
+    for dirPath, _, fileNames in os.walk(resultsDir):
+      for fileName in fileNames:
+        path = os.path.join(dirPath, fileName)
+        with open(path) as f:
+          results[os.path.relpath(path, resultsDir)] = f.read()
+    return results
+
+
+  def testFanOutMatchesSplit(self):
+    detectors = {"null": NullDetector,
+                 "random": RandomDetector,
+                 "windowedGaussian": WindowedGaussianDetector,
+                 "contextOSE": ContextOSEDetector}
+    results = []
+    for fanOut in (False, True):
+      runner = self._runner("results%s" % fanOut)
+      runner.detect(detectors, fanOut=fanOut)
+      results.append(self._readResults(runner.resultsDir))
+
+    self.assertEqual(len(results[0]), 12)
+    self.assertEqual(results[0], results[1])
+
+
+  def testSegmentsMatchWholeFiles(self):
+    detectors = {"null": NullDetector,
+                 "windowedGaussian": WindowedGaussianDetector}
+    results = []
+    for segmentLength in (None, 997):
+      runner = self._runner("results%s" % segmentLength)
+      runner.detect(detectors, segmentLength=segmentLength)
+      results.append(self._readResults(runner.resultsDir))
+
+    self.assertEqual(len(results[0]), 6)
+    self.assertEqual(results[0], results[1])
+
+
+  def testExecutorsMatch(self):
+    detectors = {"random": RandomDetector,
+                 "windowedGaussian": WindowedGaussianDetector}
+    results = []
+    for executor in ("process", "thread", "serial"):
+      runner = self._runner("results-" + executor, executor=executor,
+                            numCPUs=2)
+      runner.detect(detectors, fanOut=False)
+      self.assertEqual(list(runner.executors), [executor])
+      results.append(self._readResults(runner.resultsDir))
+
+    self.assertEqual(len(results[0]), 6)
+    self.assertEqual(results[0], results[1])
+    self.assertEqual(results[0], results[2])
+
+
+  def testThreadsOnlyForThreadSafeDetectors(self):
+    """Detection falls back to processes for detectors that can't share one,
+    such as ARTime."""
+    with self._runner("results", executor="thread") as runner:
+      self.assertIsInstance(
+        runner.getExecutor("detect", {"null": NullDetector,
+                                      "random": RandomDetector}),
+        ThreadExecutor)
+      self.assertIsInstance(
+        runner.getExecutor("detect", {"null": NullDetector,
+                                      "external": ExternalDetector}),
+        ProcessExecutor)
+      self.assertIsInstance(runner.getExecutor("score"), ThreadExecutor)
+      self.assertEqual(sorted(runner.executors), ["process", "thread"])
+
+
+  def testStageExecutors(self):
+    with self._runner("results", stageExecutors={"detect": "serial"}) as runner:
+      self.assertEqual(runner.executors, {})
+      runner.detect({"null": NullDetector})
+      self.assertEqual(list(runner.executors), ["serial"])
+      self.assertIs(runner.getExecutor("score"),
+                    runner.getExecutor("bootstrap"))
+      self.assertEqual(sorted(runner.executors), ["process", "serial"])
+    self.assertEqual(runner.executors, {})
+
+
+  def testPipelineMatchesSteps(self):
+    detectors = {"null": NullDetector,
+                 "random": RandomDetector,
+                 "windowedGaussian": WindowedGaussianDetector}
+    runner = self._runner("steps")
+    runner.detect(detectors, segmentLength=700)
+    thresholds = runner.optimize(list(detectors))
+    runner.score(list(detectors), thresholds)
+    expected = self._readResults(runner.resultsDir)
+    self.assertEqual(len(expected), 3 * 3 + 3 * 3 + 1)
+
+    for executor in ("process", "serial"):
+      runner = self._runner("pipeline-" + executor, numCPUs=2,
+                            executor=executor)
+      self.assertEqual(runner.pipeline(detectors, segmentLength=700),
+                       thresholds)
+      self.assertEqual(self._readResults(runner.resultsDir), expected)
+      self.assertEqual(list(runner.executors), [executor])
+      self.assertEqual(len(runner.resultsFiles), 3 * 3)
+
+
+  def testPipelineError(self):
+    runner = self._runner("results")
+    with self.assertRaises(RuntimeError):
+      runner.pipeline({"failing": FailingDetector, "null": NullDetector},
+                      fanOut=False)
+
+
+  def testFanOutWithTiming(self):
+    runner = self._runner("results")
+    runner.detect({"null": NullDetector, "random": RandomDetector},
+                  timing=True, sampleInterval=3, fanOut=True)
+    with open(os.path.join(runner.resultsDir, "timing_results.json")) as f:
+      timing = json.load(f)
+    for detectorName in ("null", "random"):
+      self.assertEqual(len(timing[detectorName]["files"]), 3)
+      self.assertGreater(timing[detectorName]["count"], 0)
+
+
+  def testMemoryBudget(self):
+    detectors = {"null": NullDetector,
+                 "random": RandomDetector,
+                 "windowedGaussian": WindowedGaussianDetector}
+    runner = self._runner("results")
+    runner.detect(detectors, fanOut=True, segmentLength=997)
+    expected = self._readResults(runner.resultsDir)
+
+    runner = self._runner("budget", numCPUs=2)
+    runner.detect(detectors, fanOut=True, segmentLength=997,
+                  memoryBudget=8 * 2 ** 20)
+    memoryPath = os.path.join(runner.resultsDir, "memory_results.json")
+    with open(memoryPath) as f:
+      memory = json.load(f)
+    os.remove(memoryPath)
+    self.assertEqual(self._readResults(runner.resultsDir), expected)
+
+    self.assertEqual(sorted(memory), sorted(detectors))
+    self.assertEqual(memory["null"]["numTasks"], 3)
+    self.assertGreater(memory["windowedGaussian"]["numTasks"], 3)
+    for detectorName in detectors:
+      self.assertEqual(len(memory[detectorName]["tasks"]),
+                       memory[detectorName]["numTasks"])
+      self.assertGreater(memory[detectorName]["maxEstimate"], 0)
+      if os.path.exists("/proc/self/clear_refs"):
+        self.assertGreater(memory[detectorName]["maxPeakRSS"], 0)
+
+
+  def testMeasureCost(self):
+    runner = self._runner("results")
+    for detectorClass in (NullDetector, WindowedGaussianDetector):
+      cost = runner._measureCost(detectorClass)
+      self.assertGreater(cost, 0)
+      self.assertTrue(math.isfinite(cost))
+    self.assertEqual(runner._measureCost(FailingDetector), float("inf"))
+
+    # Detectors that don't support it are taken to be costly, unrun.
+    for detectorClass in (ExternalDetector, BayesChangePtDetector):
+      self.assertEqual(runner._measureCost(detectorClass), float("inf"))
+
+
+  def testFanOutFollowsCost(self):
+    """Detectors cheaper than fanOutMaxMicros per record run together, if
+    there are at least two of them."""
+    detectors = {"null": NullDetector,
+                 "random": RandomDetector,
+                 "windowedGaussian": WindowedGaussianDetector,
+                 "bayesChangePt": BayesChangePtDetector,
+                 "failing": FailingDetector}
+    runner = self._runner("results")
+    runner.fanOutMaxMicros = 100.0
+
+    def jobNames(costs):
+      # Fixed costs in place of timings.
+      runner._measureCost = costs.get
+      jobs = runner._detectionJobs(detectors, False, 1, None, None)
+      return sorted(names for names, _, _, _, _ in jobs)
+
+    self.assertEqual(
+      jobNames({NullDetector: 1.0, RandomDetector: 2.0,
+                WindowedGaussianDetector: 99.0, BayesChangePtDetector: 100.0,
+                FailingDetector: float("inf")}),
+      [["bayesChangePt"], ["failing"],
+       ["null", "random", "windowedGaussian"]])
+    self.assertEqual(
+      jobNames({NullDetector: 1.0, RandomDetector: 500.0,
+                WindowedGaussianDetector: 500.0, BayesChangePtDetector: 500.0,
+                FailingDetector: float("inf")}),
+      [["bayesChangePt"], ["failing"], ["null"], ["random"],
+       ["windowedGaussian"]])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,235 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+import json
+import os
+import random
+
+import pandas
+import pytest
+
+from nab.optimizer import (CorpusCurve,
+                           calcCurveContribution,
+                           optimizeSweepArrays)
+from nab.runner import Runner
+from nab.sweeper import Sweeper, groupSweepArrays
+
+TEST_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+ROOT_DIR = os.path.dirname(TEST_DIR)
+
+
+def _fakeSweepArrays(sweeper, numDataSets, seed):
+  """Return `SweepArrays` for data sets of random anomaly scores."""
+  rng = random.Random(seed)
+  sweepArraysList = []
+  for _ in range(numDataSets):
+    numRows = rng.randint(300, 600)
+    anomalyScores = [rng.random() ** 3 for _ in range(numRows)]
+    windowLimits = []
+    for start in (100, 250):
+      windowLimits.append((start, start + 29))
+      # Make detections likelier inside windows.
+      for i in range(start, start + 30, 5):
+        anomalyScores[i] = rng.uniform(0.5, 1.0)
+    sweepArraysList.append(sweeper.calcSweepScoreArrays(
+      list(range(numRows)), anomalyScores, windowLimits))
+  return sweepArraysList
+
+
+class TestOptimizer(object):
+  costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+
+  def testOptimizeSweepArraysFindsBestThreshold(self):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 4, 1)
+
+    best = optimizeSweepArrays(sweeper, iter(sweepArraysList))
+
+    # Brute force: score the corpus at every distinct anomaly score.
+    thresholds = set([1.1])
+    for sweepArrays in sweepArraysList:
+      thresholds.update(sweepArrays.anomalyScores.tolist())
+    corpusScores = {
+      t: sum(sweeper.calcScoreAtThreshold(x, t).score for x in sweepArraysList)
+      for t in thresholds}
+    bestThreshold = max(corpusScores, key=corpusScores.get)
+
+    assert best["threshold"] == bestThreshold
+    assert best["score"] == pytest.approx(corpusScores[bestThreshold])
+    assert "errorBound" not in best
+
+  @pytest.mark.parametrize("numBuckets", [5, 20, 100])
+  def testApproximateScoreIsWithinBound(self, numBuckets):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 6, numBuckets)
+
+    exact = optimizeSweepArrays(sweeper, sweepArraysList)
+    approximate = optimizeSweepArrays(sweeper, sweepArraysList, numBuckets)
+
+    # The approximate threshold is a real threshold, scored exactly.
+    approximateScore = sum(
+      sweeper.calcScoreAtThreshold(x, approximate["threshold"]).score
+      for x in sweepArraysList)
+    assert approximate["score"] == pytest.approx(approximateScore)
+
+    assert approximate["score"] <= exact["score"] + 1e-9
+    assert exact["score"] - approximate["score"] <= (
+      approximate["errorBound"] + 1e-9)
+
+  def testApproximateIsExactForBinaryScores(self):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = []
+    for sweepArrays in _fakeSweepArrays(sweeper, 3, 5):
+      binaryScores = (sweepArrays.anomalyScores > 0.7).astype(float)
+      sweepArraysList.append(sweepArrays._replace(anomalyScores=binaryScores))
+
+    exact = optimizeSweepArrays(sweeper, sweepArraysList)
+    approximate = optimizeSweepArrays(sweeper, sweepArraysList, 10)
+
+    assert approximate["threshold"] == exact["threshold"]
+    assert approximate["score"] == pytest.approx(exact["score"])
+
+
+  def testCorpusCurveMatchesIterScoreByThreshold(self):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 4, 2)
+
+    curve = CorpusCurve()
+    for i, sweepArrays in enumerate(sweepArraysList):
+      curve.setDataSet(i, calcCurveContribution(sweeper, sweepArrays))
+
+    expected = list(sweeper.iterScoreByThreshold(
+      [groupSweepArrays(x) for x in sweepArraysList]))
+    actual = curve.scoresByThreshold()
+
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+      assert a.threshold == e.threshold
+      assert a.score == pytest.approx(e.score)
+      assert a[2:] == e[2:]
+
+  def testCorpusCurveReplaceMatchesRecompute(self):
+    sweeper = Sweeper(probationPercent=0.15, costMatrix=self.costMatrix)
+    sweepArraysList = _fakeSweepArrays(sweeper, 5, 3)
+    replacements = _fakeSweepArrays(sweeper, 2, 4)
+
+    curve = CorpusCurve()
+    for i, sweepArrays in enumerate(sweepArraysList):
+      curve.setDataSet(i, calcCurveContribution(sweeper, sweepArrays))
+    curve.setDataSet(1, calcCurveContribution(sweeper, replacements[0]))
+    curve.setDataSet(3, calcCurveContribution(sweeper, replacements[1]))
+    curve.removeDataSet(4)
+
+    recomputed = CorpusCurve()
+    for i, sweepArrays in enumerate([sweepArraysList[0], replacements[0],
+                                     sweepArraysList[2], replacements[1]]):
+      recomputed.setDataSet(i, calcCurveContribution(sweeper, sweepArrays))
+
+    actual = curve.scoresByThreshold()
+    expected = recomputed.scoresByThreshold()
+    assert [x.threshold for x in actual] == [x.threshold for x in expected]
+    assert [x.score for x in actual] == pytest.approx(
+      [x.score for x in expected])
+    assert [x[2:] for x in actual] == [x[2:] for x in expected]
+    assert curve.best().threshold == recomputed.best().threshold
+
+
+
+class TestWatch(object):
+
+  def _writeResults(self, resultsDir, runner, seed, binary=False):
+    """Write random results for every labeled data file, or with `binary`,
+    results of 1 in each window and 0 elsewhere."""
+    rng = random.Random(seed)
+    for relativePath, labels in runner.corpusLabel.labels.items():
+      category, fileName = relativePath.split("/")
+      path = os.path.join(resultsDir, "fake", category, "fake_" + fileName)
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      if binary:
+        anomalyScores = labels["label"]
+      else:
+        anomalyScores = [rng.random() ** 4 for _ in range(len(labels))]
+      pandas.DataFrame({
+        "timestamp": labels["timestamp"],
+        "value": 0.0,
+        "anomaly_score": anomalyScores,
+        "label": labels["label"]
+      }).to_csv(path, index=False)
+      yield path
+
+  def _assertThresholdsMatch(self, actual, expected):
+    for profileName, params in expected["fake"].items():
+      assert actual["fake"][profileName] == params
+      assert (type(actual["fake"][profileName]["threshold"]) is
+              type(params["threshold"]))
+
+  def _writeWindows(self, dataDir, labelPath):
+    """Write a label window over 60-65% of each data file."""
+    windows = {}
+    for category in os.listdir(dataDir):
+      for fileName in os.listdir(os.path.join(dataDir, category)):
+        timestamps = pandas.read_csv(
+          os.path.join(dataDir, category, fileName))["timestamp"]
+        windows[category + "/" + fileName] = [[
+          timestamps.iloc[int(len(timestamps) * 0.6)] + ".000000",
+          timestamps.iloc[int(len(timestamps) * 0.65)] + ".000000"]]
+    with open(labelPath, "w") as f:
+      json.dump(windows, f)
+
+  def _runner(self, tmp_path):
+    dataDir = os.path.join(TEST_DIR, "test_data")
+    labelPath = str(tmp_path / "windows.json")
+    self._writeWindows(dataDir, labelPath)
+    return Runner(dataDir=dataDir,
+                  resultsDir=str(tmp_path / "results"),
+                  labelPath=labelPath,
+                  profilesPath=os.path.join(ROOT_DIR, "config",
+                                            "profiles.json"),
+                  thresholdPath=str(tmp_path / "thresholds.json"),
+                  numCPUs=1)
+
+  def testIntegerScoresKeepIntegerThresholds(self, tmp_path):
+    runner = self._runner(tmp_path)
+    try:
+      runner.initialize()
+      list(self._writeResults(runner.resultsDir, runner, 1, binary=True))
+      runner.optimize(["fake"])
+      with open(runner.thresholdPath) as f:
+        thresholds = json.load(f)
+      for params in thresholds["fake"].values():
+        assert params["threshold"] == 1
+        assert isinstance(params["threshold"], int)
+
+      # Watch mode keeps them too.
+      self._assertThresholdsMatch(runner.pollResults(["fake"]), thresholds)
+    finally:
+      runner.close()
+
+  def testPollResultsMatchesOptimize(self, tmp_path):
+    runner = self._runner(tmp_path)
+    resultsDir = runner.resultsDir
+    try:
+      runner.initialize()
+      paths = list(self._writeResults(resultsDir, runner, 1))
+
+      self._assertThresholdsMatch(runner.pollResults(["fake"]),
+                                  runner.optimize(["fake"]))
+      assert runner.pollResults(["fake"]) == {}
+
+      # Rewrite one file as if its detector was run again.
+      newResults = pandas.read_csv(paths[0])
+      newResults["anomaly_score"] = newResults["anomaly_score"].iloc[::-1].values
+      newResults.to_csv(paths[0], index=False)
+      mtime = os.path.getmtime(paths[0]) + 10
+      os.utime(paths[0], (mtime, mtime))
+
+      self._assertThresholdsMatch(runner.pollResults(["fake"]),
+                                  runner.optimize(["fake"]))
+    finally:
+      runner.close()
@@ -0,0 +1,158 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import datetime
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from nab.corpus import DataFile
+from nab.detectors import getDetectorClass
+from nab.partition import HashRing, PartitionedService
+from nab.test_helpers import generateTimestamps, writeCorpus
+
+
+
+class HashRingTest(unittest.TestCase):
+
+  def testMovesOnlyAffectedKeys(self):
+    keys = ["stream-%d" % i for i in range(1000)]
+    ring = HashRing(["a", "b", "c"])
+    before = {key: ring.getNode(key) for key in keys}
+    counts = [list(before.values()).count(node) for node in "abc"]
+    self.assertGreater(min(counts), 200)
+
+    # Keys only move to the added node, or from the removed one.
+    ring.add("d")
+    added = {key: ring.getNode(key) for key in keys}
+    for key in keys:
+      self.assertIn(added[key], (before[key], "d"))
+    self.assertGreater(list(added.values()).count("d"), 100)
+
+    ring.remove("a")
+    removed = {key: ring.getNode(key) for key in keys}
+    for key in keys:
+      if added[key] != "a":
+        self.assertEqual(removed[key], added[key])
+    self.assertEqual(len(ring), 3)
+
+    with self.assertRaises(ValueError):
+      ring.add("b")
+    with self.assertRaises(ValueError):
+      HashRing().getNode("x")
+
+
+
+class PartitionedServiceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    randomState = numpy.random.RandomState(0)
+    corpusData = {}
+    for i in range(6):
+      timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                      datetime.timedelta(minutes=5), 400)
+      values = (10 * numpy.sin(numpy.arange(400) / (10.0 + i)) +
+                randomState.normal(0, 1, 400))
+      values[300 + i] += 30
+      corpusData["s%d.csv" % i] = pandas.DataFrame(
+        {"timestamp": timestamps, "value": values})
+    writeCorpus(self.tempDir, corpusData)
+    self.dataSets = {"s%d" % i: DataFile(os.path.join(self.tempDir,
+                                                      "s%d.csv" % i))
+                     for i in range(6)}
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def _create(self, service, detectorName):
+    for name, dataSet in self.dataSets.items():
+      service.createStream(name, detectorName, dataSet.data["value"].min(),
+                           dataSet.data["value"].max(), len(dataSet.data))
+
+
+  def _score(self, service, start, stop):
+    """Score records [start, stop) of every stream, in one batch."""
+    names = []
+    timestamps = []
+    values = []
+    for name, dataSet in self.dataSets.items():
+      data = dataSet.data.iloc[start:stop]
+      names += [name] * len(data)
+      timestamps.append(data["timestamp"].values)
+      values.append(data["value"].values)
+    scores = service.score(names, numpy.concatenate(timestamps),
+                           numpy.concatenate(values))
+    return {name: list(scores[numpy.array(names) == name])
+            for name in self.dataSets}
+
+
+  def _expected(self, detectorName):
+    expected = {}
+    for name, dataSet in self.dataSets.items():
+      detector = getDetectorClass(detectorName)(dataSet=dataSet,
+                                                probationaryPercent=0.15)
+      detector.initialize()
+      expected[name] = list(detector.run()["anomaly_score"])
+    return expected
+
+
+  def testMigrationKeepsScores(self):
+    for detectorName in ("windowedGaussian", "bayesChangePt"):
+      with PartitionedService(2, capacity=100) as service:
+        self._create(service, detectorName)
+        scores = self._score(service, 0, 150)
+
+        newWorker = service.addWorker()
+        self.assertIn(newWorker, [service.workerOf(name)
+                                  for name in self.dataSets])
+        for name, moreScores in self._score(service, 150, 250).items():
+          scores[name] += moreScores
+
+        service.removeWorker("worker-0")
+        self.assertNotIn("worker-0", [service.workerOf(name)
+                                      for name in self.dataSets])
+        for name, moreScores in self._score(service, 250, 400).items():
+          scores[name] += moreScores
+
+      self.assertEqual(scores, self._expected(detectorName), detectorName)
+
+
+  def testErrors(self):
+    with PartitionedService(1) as service:
+      dataSet = self.dataSets["s0"]
+      args = (dataSet.data["value"].min(), dataSet.data["value"].max(),
+              len(dataSet.data))
+      service.createStream("a", "null", *args)
+      with self.assertRaises(ValueError):
+        service.createStream("a", "null", *args)
+      with self.assertRaises(RuntimeError):
+        service.createStream("b", "noSuchDetector", *args)
+      with self.assertRaises(KeyError):
+        service.score(["c"], dataSet.data["timestamp"].values[:1], [1.0])
+      with self.assertRaises(ValueError):
+        service.removeWorker("worker-0")
+
+      # The worker still serves after errors.
+      service.createStream("b", "null", *args)
+      numpy.testing.assert_array_equal(
+        service.score(["a", "b"], dataSet.data["timestamp"].values[:2],
+                      [1.0, 2.0]), [0.5, 0.5])
+      service.deleteStream("a")
+      self.assertEqual(list(service.streams), ["b"])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -9,10 +9,14 @@
 
 import copy
 import datetime
+import numpy
 import pandas
 import random
 import unittest
 
+import nab
+from nab.optimizer import optimizeSweepArrays
+from nab.scorer import LATENCY_COLUMNS, scoreNullDetector, summarizeLatency
 from nab.sweeper import Sweeper
 from nab.test_helpers import generateTimestamps, generateWindows
 
@@ -236,6 +240,103 @@ class ScorerTest(unittest.TestCase):
     self.assertAlmostEqual(matchingRow.score, -0.9540, 4)
     self._checkCounts(matchingRow, length-windowSize*numWindows-1, 2, 1, 8)
 
+  def testScoreArrays(self):
+    """
+    Scoring arrays in memory should give the same thresholds, scores and S(t)
+    values as the Sweeper and optimizer used on results files.
+    """
+    start = datetime.datetime(2015, 1, 1)
+    increment = datetime.timedelta(minutes=5)
+    rng = random.Random(42)
+    streams = {}
+    for i, length in enumerate([200, 300, 250]):
+      timestamps = generateTimestamps(start, increment, length)
+      windows = generateWindows(timestamps, i, 10)
+      anomalyScores = numpy.array([rng.random() ** 2 for _ in range(length)])
+      streams["stream%d" % i] = (timestamps.values, anomalyScores, windows)
+    profiles = {"standard": {"CostMatrix": {"tpWeight": 1.0,
+                                            "fnWeight": 1.0,
+                                            "fpWeight": 0.11}}}
+
+    results = nab.scoreArrays(streams, profiles)["standard"]
+
+    sweeper = Sweeper(probationPercent=0.15,
+                      costMatrix=profiles["standard"]["CostMatrix"])
+    sweepArrays = [sweeper.calcSweepScoreArrays(timestamps, scores, windows)
+                   for timestamps, scores, windows in streams.values()]
+    best = optimizeSweepArrays(sweeper, sweepArrays)
+    nullBest = optimizeSweepArrays(
+      sweeper, [x._replace(anomalyScores=numpy.full(len(x.anomalyScores), 0.5))
+                for x in sweepArrays])
+
+    self.assertEqual(results["threshold"], best["threshold"])
+    self.assertAlmostEqual(results["score"], best["score"])
+    self.assertAlmostEqual(results["nullScore"], nullBest["score"])
+    self.assertAlmostEqual(
+      results["normalized"],
+      100 * (best["score"] - nullBest["score"]) / (3 - nullBest["score"]))
+
+    totalScore = 0
+    for name, (timestamps, anomalyScores, windows) in streams.items():
+      (scores, matchingRow) = sweeper.scoreDataSet(
+        timestamps, anomalyScores, windows, name, best["threshold"])
+      streamResults = results["streams"][name]
+      self.assertEqual(streamResults["sweepScores"].tolist(), scores)
+      self.assertAlmostEqual(streamResults["score"], matchingRow.score)
+      self._checkCounts(matchingRow, streamResults["tn"], streamResults["tp"],
+                        streamResults["fp"], streamResults["fn"])
+      totalScore += streamResults["score"]
+    self.assertAlmostEqual(totalScore, results["score"])
+
+  def testScoreNullDetectorMatchesOptimizer(self):
+    """
+    The null detector's analytic scores should match optimizing its constant
+    anomaly scores, whichever way the optimization goes.
+    """
+    start = datetime.datetime(2015, 1, 1)
+    increment = datetime.timedelta(minutes=5)
+    for fpWeight, expectedThreshold in ((0.11, 1.1), (0.0, 0.5)):
+      sweeper = Sweeper(probationPercent=0.15,
+                        costMatrix={"tpWeight": 1.0,
+                                    "fnWeight": 1.0,
+                                    "fpWeight": fpWeight})
+      sweepArrays = {}
+      for i, length in enumerate([200, 300]):
+        timestamps = generateTimestamps(start, increment, length)
+        sweepArrays["stream%d" % i] = sweeper.calcSweepScoreArrays(
+          timestamps, numpy.full(length, 0.5),
+          generateWindows(timestamps, i + 1, 10))
+
+      results = scoreNullDetector(sweeper, sweepArrays, "profile")
+      best = optimizeSweepArrays(sweeper, list(sweepArrays.values()))
+
+      self.assertEqual(best["threshold"], expectedThreshold)
+      self.assertEqual(results["Threshold"].iloc[0], expectedThreshold)
+      self.assertAlmostEqual(results["Score"].iloc[-1], best["score"])
+      for _, row in results.iloc[:-1].iterrows():
+        matchingRow = sweeper.calcScoreAtThreshold(sweepArrays[row["File"]],
+                                                   expectedThreshold)
+        self.assertAlmostEqual(row["Score"], matchingRow.score)
+        self._checkCounts(matchingRow, row["TN"], row["TP"], row["FP"],
+                          row["FN"])
+
+  def testSummarizeLatency(self):
+    """Missed windows are counted, but not in the latency percentiles."""
+    rows = [["d", "p", "f", i, "", latency, latency * 60.0]
+            for i, latency in enumerate([4, 0, float("nan"), 10, 2, 1])]
+    summary = summarizeLatency(pandas.DataFrame(rows, columns=LATENCY_COLUMNS))
+
+    self.assertEqual(summary["windows"], 6)
+    self.assertEqual(summary["detected"], 5)
+    self.assertEqual(summary["medianRows"], 2.0)
+    self.assertEqual(summary["medianSeconds"], 120.0)
+    self.assertAlmostEqual(summary["p90Rows"], 7.6)
+
+    summary = summarizeLatency(pandas.DataFrame(rows[2:3],
+                                                columns=LATENCY_COLUMNS))
+    self.assertEqual(summary["detected"], 0)
+    self.assertIsNone(summary["p90Seconds"])
+
 
 if __name__ == '__main__':
   unittest.main()
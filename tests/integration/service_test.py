@@ -0,0 +1,192 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import base64
+import datetime
+import math
+import os
+import pandas
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+
+from nab.corpus import DataFile
+from nab.detectors import getDetectorClass
+from nab.service import DetectorService, ServiceClient
+from nab.test_helpers import generateTimestamps, writeCorpus
+
+
+
+class DetectorServiceTest(unittest.TestCase):
+  """Runs the service on an event loop in a thread, with local clients."""
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), 300)
+    values = [10 * math.sin(i / 20.0) + (i % 7) + 30 * (i == 250)
+              for i in range(300)]
+    writeCorpus(self.tempDir, {"test.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": values})})
+    self.dataSet = DataFile(os.path.join(self.tempDir, "test.csv"))
+    # The values as read back, for scores identical to a run on the file.
+    data = self.dataSet.data
+    self.records = [{"timestamp": str(timestamp), "value": value}
+                    for timestamp, value in zip(data["timestamp"],
+                                                data["value"].tolist())]
+
+    self.service = DetectorService()
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever)
+    self.thread.start()
+    self.servers = []
+
+
+  def tearDown(self):
+    for server in self.servers:
+      server.close()
+      asyncio.run_coroutine_threadsafe(server.wait_closed(),
+                                       self.loop).result()
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    self.loop.close()
+    shutil.rmtree(self.tempDir)
+
+
+  def _start(self, **kwargs):
+    server = asyncio.run_coroutine_threadsafe(self.service.start(**kwargs),
+                                              self.loop).result()
+    self.servers.append(server)
+    return server
+
+
+  def _tcpClient(self):
+    port = self._start(port=0).sockets[0].getsockname()[1]
+    return ServiceClient(port=port)
+
+
+  def _expectedScores(self, detectorName):
+    detector = getDetectorClass(detectorName)(dataSet=self.dataSet,
+                                              probationaryPercent=0.15)
+    detector.initialize()
+    return list(detector.run()["anomaly_score"])
+
+
+  def _create(self, client, stream, detectorName, **fields):
+    return client.request("create", stream=stream, detector=detectorName,
+                          inputMin=self.dataSet.data["value"].min(),
+                          inputMax=self.dataSet.data["value"].max(),
+                          numRecords=len(self.records), **fields)
+
+
+  def testScoresMatchRun(self):
+    with self._tcpClient() as client:
+      for detectorName in ("windowedGaussian", "bayesChangePt", "random"):
+        expected = self._expectedScores(detectorName)
+        self.assertTrue(self._create(client, detectorName, detectorName)["ok"])
+
+        # A single record, then micro-batches.
+        scores = client.request("score", stream=detectorName,
+                                **self.records[0])["scores"]
+        for start in range(1, len(self.records), 64):
+          response = client.request("score", stream=detectorName,
+                                    records=self.records[start:start + 64])
+          self.assertTrue(response["ok"])
+          scores += response["scores"]
+
+        self.assertEqual(scores, expected, detectorName)
+
+
+  def testUnixSocketAndStats(self):
+    path = os.path.join(self.tempDir, "service.sock")
+    self._start(path=path)
+    with ServiceClient(path=path) as client:
+      self._create(client, "a", "null")
+      self._create(client, "b", "windowedGaussian")
+      for start in range(0, 100, 10):
+        client.request("score", stream="a",
+                       records=self.records[start:start + 10])
+      client.request("score", stream="b", records=self.records[:5])
+
+      stats = client.request("stats", id=7)
+    self.assertEqual(stats["id"], 7)
+    self.assertEqual(stats["records"], 105)
+    self.assertEqual(stats["requests"], 11)
+    self.assertEqual(stats["streams"]["a"]["records"], 100)
+    self.assertEqual(stats["streams"]["a"]["requests"], 10)
+    self.assertEqual(stats["streams"]["b"]["detector"], "windowedGaussian")
+    self.assertGreater(stats["recordsPerSecond"], 0)
+    self.assertLessEqual(stats["streams"]["a"]["requestP50Micros"],
+                         stats["streams"]["a"]["requestMaxMicros"])
+
+
+  def testSnapshotAndRestore(self):
+    expected = self._expectedScores("relativeEntropy")
+    with self._tcpClient() as client:
+      self._create(client, "cpu", "relativeEntropy")
+      scores = client.request("score", stream="cpu",
+                              records=self.records[:200])["scores"]
+      state = client.request("snapshot", stream="cpu")["state"]
+      client.request("delete", stream="cpu")
+
+      # As after a restart of the service.
+      self._create(client, "cpu", "relativeEntropy", state=state)
+      scores += client.request("score", stream="cpu",
+                               records=self.records[200:])["scores"]
+    self.assertEqual(scores, expected)
+
+
+  def testPickledStateRejected(self):
+    """A crafted pickle as the state of a new stream is refused unloaded."""
+    path = os.path.join(self.tempDir, "unpickled")
+    class Payload(object):
+      def __reduce__(self):
+        return (os.mkdir, (path,))
+
+    state = base64.b64encode(pickle.dumps(Payload())).decode("ascii")
+    with self._tcpClient() as client:
+      response = self._create(client, "cpu", "relativeEntropy", state=state)
+      self.assertFalse(response["ok"])
+      self.assertIn("Not a detector snapshot", response["error"])
+      self.assertFalse(os.path.exists(path))
+
+      # Nor is a snapshot of another detector restored.
+      self._create(client, "other", "windowedGaussian")
+      client.request("score", stream="other", records=self.records[:10])
+      state = client.request("snapshot", stream="other")["state"]
+      self.assertFalse(
+        self._create(client, "cpu", "relativeEntropy", state=state)["ok"])
+      self.assertTrue(self._create(client, "cpu", "relativeEntropy")["ok"])
+
+
+  def testErrors(self):
+    with self._tcpClient() as client:
+      response = client.request("score", stream="missing",
+                                **self.records[0])
+      self.assertFalse(response["ok"])
+      self.assertIn("missing", response["error"])
+
+      response = self._create(client, "x", "noSuchDetector")
+      self.assertFalse(response["ok"])
+
+      self.assertTrue(self._create(client, "x", "null")["ok"])
+      self.assertFalse(self._create(client, "x", "null")["ok"])
+      self.assertFalse(client.request("bogus")["ok"])
+
+      # The connection is still usable after errors.
+      self.assertEqual(client.request("score", stream="x",
+                                      **self.records[0])["scores"], [0.5])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
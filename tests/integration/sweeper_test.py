@@ -6,16 +6,48 @@
 # Use of this source code is governed by the MIT
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
+import datetime
+import math
+import random
+
 import pytest
 
 from nab.sweeper import (
   AnomalyPoint,
+  OUTSIDE_WINDOW,
+  PROBATIONARY,
   Sweeper,
   ThresholdScore,
-  prepAnomalyListForScoring
+  prepAnomalyListForScoring,
+  groupSweepArrays,
+  _iterGroups
 )
 
 
+def _matchCurveRow(scoresByThreshold, threshold):
+  """Look up the curve entry that applies at `threshold`, as scoring used to."""
+  prevRow = None
+  for thresholdScore in scoresByThreshold:
+    if thresholdScore.threshold == threshold:
+      return thresholdScore
+    elif thresholdScore.threshold < threshold:
+      return prevRow
+    prevRow = thresholdScore
+
+
+def _fakeDataSets(numDataSets, seed):
+  """Return (name, timestamps, anomalyScores, windowLimits) tuples."""
+  rng = random.Random(seed)
+  dataSets = []
+  for i in range(numDataSets):
+    numRows = rng.randint(150, 400)
+    timestamps = list(range(numRows))
+    anomalyScores = [round(rng.random(), 2) for _ in range(numRows)]
+    windowLimits = [(60, 79), (numRows - 50, numRows - 31)]
+    dataSets.append(("dataSet%d" % i, timestamps, anomalyScores, windowLimits))
+  return dataSets
+
+
 class TestSweeper(object):
   def testOptimizerInit(self):
     o = Sweeper()
@@ -184,3 +216,211 @@ class TestSweeper(object):
     actual = o.calcScoreByThreshold(fakeInput)
 
     assert actual == expectedScoresByThreshold
+
+  def testCalcSweepScoreArraysMatchesCalcSweepScore(self):
+    numRows = 300
+    rng = random.Random(11)
+    timestamps = list(range(numRows))
+    anomalyScores = [rng.random() for _ in range(numRows)]
+    windowLimits = [(20, 49), (120, 121), (200, 259)]
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 2.0, "fpWeight": 0.22}
+
+    o = Sweeper(probationPercent=0.1, costMatrix=costMatrix)
+    anomalyList = o.calcSweepScore(
+      timestamps, anomalyScores, windowLimits, "TestDataSet")
+    sweepArrays = o.calcSweepScoreArrays(
+      timestamps, anomalyScores, windowLimits)
+
+    assert sweepArrays.sweepScores.tolist() == [
+      x.sweepScore for x in anomalyList]
+    assert sweepArrays.windowLimits.tolist() == [[20, 49], [120, 121],
+                                                 [200, 259]]
+    for point, windowId in zip(anomalyList, sweepArrays.windowIds):
+      if point.windowName == "probationary":
+        assert windowId == PROBATIONARY
+      elif point.windowName is None:
+        assert windowId == OUTSIDE_WINDOW
+      else:
+        start = windowLimits[windowId][0]
+        assert point.windowName == "TestDataSet|%s" % start
+
+  @pytest.mark.parametrize("threshold", [0.0, 0.25, 0.3, 0.5, 0.55, 1.0, 1.05])
+  def testCalcScoreAtThresholdMatchesCurve(self, threshold):
+    numRows = 400
+    rng = random.Random(7)
+    timestamps = list(range(numRows))
+    # Round scores so that several rows share each threshold.
+    anomalyScores = [round(rng.random(), 1) for _ in range(numRows)]
+    windowLimits = [(30, 69), (150, 189), (300, 339)]
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+    anomalyList = o.calcSweepScore(
+      timestamps, anomalyScores, windowLimits, "TestDataSet")
+    expected = _matchCurveRow(o.calcScoreByThreshold(anomalyList), threshold)
+
+    actual = o.calcScoreAtThreshold(
+      o.calcSweepScoreArrays(timestamps, anomalyScores, windowLimits),
+      threshold)
+
+    assert actual[1:] == expected[1:]
+
+  @pytest.mark.parametrize("threshold", [0.3, 0.8, 0.97])
+  def testCalcDetectionLatency(self, threshold):
+    numRows = 400
+    rng = random.Random(5)
+    start = datetime.datetime(2015, 1, 1)
+    timestamps = [start + datetime.timedelta(minutes=5 * i)
+                  for i in range(numRows)]
+    anomalyScores = [rng.random() for _ in range(numRows)]
+    # The first window starts inside the probationary period.
+    windowLimits = [(timestamps[a], timestamps[b])
+                    for a, b in [(40, 79), (150, 189), (300, 339)]]
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+    latency = o.calcDetectionLatency(
+      o.calcSweepScoreArrays(timestamps, anomalyScores, windowLimits),
+      timestamps, threshold)
+
+    probationaryLength = o._getProbationaryLength(numRows)
+    for i, (t1, t2) in enumerate(windowLimits):
+      first, last = timestamps.index(t1), timestamps.index(t2)
+      detections = [row for row in range(max(first, probationaryLength),
+                                          last + 1)
+                    if anomalyScores[row] >= threshold]
+      if detections:
+        assert latency.rows[i] == detections[0] - first
+        assert latency.seconds[i] == 300 * (detections[0] - first)
+      else:
+        assert math.isnan(latency.rows[i]) and math.isnan(latency.seconds[i])
+
+  def testCalcScoreAtThresholdSkipsProbationaryWindows(self):
+    """A window entirely inside the probationary period is never scored."""
+    numRows = 100
+    timestamps = list(range(numRows))
+    anomalyScores = [0.0] * numRows
+    windowLimits = [(2, 5), (60, 69)]
+    fnWeight = 3.0
+
+    o = Sweeper(probationPercent=0.15,
+                costMatrix={"tpWeight": 1.0, "fnWeight": fnWeight,
+                            "fpWeight": 1.0})
+    row = o.calcScoreAtThreshold(
+      o.calcSweepScoreArrays(timestamps, anomalyScores, windowLimits), 0.5)
+
+    assert row.score == -fnWeight
+    assert (row.tp, row.fn) == (0, 10)
+
+  @pytest.mark.parametrize("memoryMapped", [False, True])
+  def testIterScoreByThresholdMatchesCalcScoreByThreshold(
+      self, memoryMapped, tmp_path):
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+
+    allAnomalyRows = []
+    sweepGroups = []
+    for name, timestamps, anomalyScores, windowLimits in _fakeDataSets(5, 3):
+      allAnomalyRows.extend(
+        o.calcSweepScore(timestamps, anomalyScores, windowLimits, name))
+      path = str(tmp_path / ("%s.npy" % name)) if memoryMapped else None
+      sweepGroups.append(groupSweepArrays(
+        o.calcSweepScoreArrays(timestamps, anomalyScores, windowLimits), path))
+
+    expected = o.calcScoreByThreshold(allAnomalyRows)
+    actual = list(o.iterScoreByThreshold(sweepGroups))
+
+    assert actual == expected
+
+  def testCalcCorpusScoreAtThresholdMatchesIterScoreByThreshold(self):
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+    sweepGroups = [
+      groupSweepArrays(
+        o.calcSweepScoreArrays(timestamps, anomalyScores, windowLimits))
+      for _, timestamps, anomalyScores, windowLimits in _fakeDataSets(5, 3)]
+
+    for expected in o.iterScoreByThreshold(sweepGroups):
+      assert o.calcCorpusScoreAtThreshold(
+        sweepGroups, expected.threshold) == expected
+
+  def testGroupSweepArrays(self):
+    o = Sweeper(probationPercent=0.2, costMatrix={"tpWeight": 1.0,
+                                                  "fnWeight": 1.0,
+                                                  "fpWeight": 1.0})
+    sweepArrays = o.calcSweepScoreArrays(
+      list(range(10)),
+      [0.9, 0.9, 0.1, 0.5, 0.1, 0.5, 0.5, 0.0, 0.5, 0.2],
+      [(4, 6)])
+
+    groups, falsePositiveScores = groupSweepArrays(sweepArrays)
+
+    # Probationary rows are dropped, and rows sharing a score are collapsed
+    # into one group of a window, or one group outside windows.
+    assert groups["anomalyScore"].tolist() == [0.5, 0.5, 0.2, 0.1, 0.1, 0.0]
+    assert groups["windowId"].tolist() == [OUTSIDE_WINDOW, 0, OUTSIDE_WINDOW,
+                                           OUTSIDE_WINDOW, 0, OUTSIDE_WINDOW]
+    assert groups["count"].tolist() == [2, 2, 1, 1, 1, 1]
+
+    # The rows outside windows keep their own sweep scores, by group and then
+    # in row order.
+    sweepScores = sweepArrays.sweepScores
+    assert falsePositiveScores.tolist() == sweepScores[[3, 8, 9, 2, 7]].tolist()
+    assert groups["sweepScore"][1] == max(sweepScores[5], sweepScores[6])
+    assert groups["sweepScore"][4] == sweepScores[4]
+
+    assert [(group[:3], group[3].tolist() if group[1] == OUTSIDE_WINDOW
+             else group[3])
+            for group in _iterGroups((groups, falsePositiveScores), 10,
+                                     blockSize=4)] == [
+      ((0.5, OUTSIDE_WINDOW, 2), [sweepScores[3], sweepScores[8]]),
+      ((0.5, 10, 2), groups["sweepScore"][1]),
+      ((0.2, OUTSIDE_WINDOW, 1), [sweepScores[9]]),
+      ((0.1, OUTSIDE_WINDOW, 1), [sweepScores[2]]),
+      ((0.1, 10, 1), sweepScores[4]),
+      ((0.0, OUTSIDE_WINDOW, 1), [sweepScores[7]])]
+
+  def testGroupSweepArraysCollapsesConstantScores(self):
+    """A constant-score data set shrinks to one group per window, and is
+    swept in a step per score."""
+    numRows = 1000
+    timestamps = list(range(numRows))
+    windowLimits = [(300, 349), (700, 749)]
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+
+    anomalyScores = [0.0] * numRows
+    anomalyScores[320] = 1.0
+    sweepArrays = o.calcSweepScoreArrays(
+      timestamps, anomalyScores, windowLimits)
+    sweepGroups = groupSweepArrays(sweepArrays)
+    groups = sweepGroups.groups
+
+    assert (groups["windowId"] >= 0).sum() == 3
+    assert groups["count"].sum() == numRows - o._getProbationaryLength(numRows)
+    assert len(list(_iterGroups(sweepGroups, 0))) == 4
+
+    expected = o.calcScoreByThreshold(
+      o.calcSweepScore(timestamps, anomalyScores, windowLimits, "constant"))
+    assert list(o.iterScoreByThreshold([sweepGroups])) == expected
+
+  def testGroupSweepArraysScalesWithWindows(self):
+    """However long a constant-score data set is, it gives one group outside
+    windows and one per window."""
+    numRows = 200000
+    timestamps = list(range(numRows))
+    windowLimits = [(start, start + 99) for start in range(2000, numRows, 4000)]
+    costMatrix = {"tpWeight": 1.0, "fnWeight": 1.0, "fpWeight": 0.11}
+    o = Sweeper(probationPercent=0.15, costMatrix=costMatrix)
+
+    anomalyScores = [0.5] * numRows
+    sweepGroups = groupSweepArrays(o.calcSweepScoreArrays(
+      timestamps, anomalyScores, windowLimits))
+
+    assert len(sweepGroups.groups) == len(windowLimits) + 1
+    assert len(sweepGroups.falsePositiveScores) == (
+      numRows - o._getProbationaryLength(numRows) - 100 * len(windowLimits))
+
+    expected = o.calcScoreByThreshold(
+      o.calcSweepScore(timestamps, anomalyScores, windowLimits, "constant"))
+    assert list(o.iterScoreByThreshold([sweepGroups])) == expected
@@ -0,0 +1,230 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""Tests that AnomalyDetector.run() matches a plain per-row loop, and that
+batch detectors match their per-record implementation."""
+
+import datetime
+import math
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from nab.corpus import DataFile
+from nab.detectors.base import AnomalyDetector
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.detectors.null.null_detector import NullDetector
+from nab.detectors.random.random_detector import RandomDetector
+from nab.test_helpers import (generateTimestamps, runRecordsAndBatch,
+                              writeCorpus)
+
+
+
+def referenceRun(detector):
+  """The original row-by-row implementation of AnomalyDetector.run()."""
+  rows = []
+  for _, row in detector.dataSet.data.iterrows():
+    detectorValues = detector.handleRecord(row.to_dict())
+    rows.append(list(row) + list(detectorValues))
+  return pandas.DataFrame(rows, columns=detector.getHeader())
+
+
+
+class ExtraColumnsDetector(AnomalyDetector):
+  """Scores records by their position and also reports the raw value."""
+
+  def __init__(self, *args, **kwargs):
+    super(ExtraColumnsDetector, self).__init__(*args, **kwargs)
+    self.count = 0
+
+  def getAdditionalHeaders(self):
+    return ["raw", "weekday"]
+
+  def handleRecord(self, inputData):
+    self.count += 1
+    return (1.0 / self.count, inputData["value"],
+            inputData["timestamp"].weekday())
+
+
+
+class OutOfRangeDetector(AnomalyDetector):
+
+  def handleRecord(self, inputData):
+    return (2.0, )
+
+
+
+class SmallWindowGaussianDetector(WindowedGaussianDetector):
+  """Slides its window within the test data."""
+
+  def __init__(self, *args, **kwargs):
+    super(SmallWindowGaussianDetector, self).__init__(*args, **kwargs)
+    self.windowSize = 50
+    self.stepSize = 10
+
+
+
+class BadBatchDetector(NullDetector):
+
+  def handleRecords(self, timestamps, values):
+    return [numpy.full(len(values) - 1, 0.5)]
+
+
+
+class OutOfRangeBatchDetector(NullDetector):
+
+  def handleRecords(self, timestamps, values):
+    return [numpy.full(len(values), 2.0)]
+
+
+
+class DetectorRunTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), 600)
+    values = [10 * math.sin(i / 40.0) + (i % 7) for i in range(600)]
+    writeCorpus(self.tempDir, {"test.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": values})})
+    self.dataSet = DataFile(os.path.join(self.tempDir, "test.csv"))
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def _assertSameResults(self, expected, actual, message):
+    self.assertEqual(list(actual.dtypes), list(expected.dtypes))
+    self.assertTrue(actual.equals(expected), message)
+    self.assertEqual(actual.to_csv(index=False), expected.to_csv(index=False))
+
+
+  def _writeDataSet(self, values):
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), len(values))
+    writeCorpus(self.tempDir, {"other.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": values})})
+    return DataFile(os.path.join(self.tempDir, "other.csv"))
+
+
+  def _checkRun(self, detectorClass):
+    results = []
+    for run in (referenceRun, AnomalyDetector.run):
+      detector = detectorClass(dataSet=self.dataSet, probationaryPercent=0.15)
+      detector.initialize()
+      results.append(run(detector))
+    expected, actual = results
+    self._assertSameResults(expected, actual,
+                            "%s results differ" % detectorClass.__name__)
+
+
+  def testRunMatchesReference(self):
+    for detectorClass in (NullDetector,
+                          RandomDetector,
+                          WindowedGaussianDetector,
+                          ExtraColumnsDetector):
+      self._checkRun(detectorClass)
+
+
+  def testBatchMatchesPerRecord(self):
+    for detectorClass in (NullDetector,
+                          RandomDetector,
+                          WindowedGaussianDetector,
+                          SmallWindowGaussianDetector):
+      for chunkSize in (None, 1, 37):
+        perRecord, batch = runRecordsAndBatch(detectorClass, self.dataSet,
+                                              chunkSize=chunkSize)
+        self._assertSameResults(
+          perRecord, batch, "%s batch results differ with chunks of %s" %
+          (detectorClass.__name__, chunkSize))
+
+
+  def testBatchIntegerAndConstantValues(self):
+    """Constant stretches exercise the zero standard deviation case."""
+    dataSet = self._writeDataSet([3] * 120 + [i % 5 for i in range(180)])
+    for chunkSize in (None, 25):
+      perRecord, batch = runRecordsAndBatch(SmallWindowGaussianDetector,
+                                            dataSet, chunkSize=chunkSize)
+      self._assertSameResults(perRecord, batch,
+                              "Batch results differ with chunks of %s" %
+                              chunkSize)
+
+
+  def testRandomDetectorsIndependent(self):
+    """Random detectors interleaved, as in threads, draw their own sequences."""
+    detectors = [RandomDetector(dataSet=self.dataSet, probationaryPercent=0.15)
+                 for _ in range(3)]
+    for detector in detectors:
+      detector.initialize()
+    expected = list(detectors.pop().run()["anomaly_score"])
+    scores = [[], []]
+    for i in range(20):
+      for detector, detectorScores in zip(detectors, scores):
+        detectorScores.append(detector.handleRecord({})[0])
+    self.assertEqual(scores, [expected[:20]] * 2)
+
+
+  def testSegmentsMatchRun(self):
+    """Segments of a file, each warmed up on its own, stitch into the output
+    of a run over the whole file, per record and in batches."""
+    dataSet = self._writeDataSet([3] * 120 + [i % 5 for i in range(480)])
+    for detectorClass in (WindowedGaussianDetector,
+                          SmallWindowGaussianDetector):
+      for supportsBatch in (False, True):
+        detector = detectorClass(dataSet=dataSet, probationaryPercent=0.15)
+        detector.supportsBatch = supportsBatch
+        detector.initialize()
+        expected = list(detector.run()["anomaly_score"])
+        for segmentLength in (1, 43, 100, 600):
+          actual = []
+          for start in range(0, 600, segmentLength):
+            detector = detectorClass(dataSet=dataSet, probationaryPercent=0.15)
+            detector.supportsBatch = supportsBatch
+            detector.initialize()
+            scores, = detector.runSegment(start, min(start + segmentLength,
+                                                     600))
+            actual += list(scores)
+          self.assertEqual(actual, expected,
+                           "%s segments of %d differ" %
+                           (detectorClass.__name__, segmentLength))
+
+    detector = NullDetector(dataSet=dataSet, probationaryPercent=0.15)
+    detector.initialize()
+    with self.assertRaises(NotImplementedError):
+      detector.runSegment(100, 200)
+
+
+  def testBatchWrongLength(self):
+    detector = BadBatchDetector(dataSet=self.dataSet, probationaryPercent=0.15)
+    with self.assertRaises(ValueError):
+      detector.run()
+
+
+  def testBatchAnomalyScoreOutOfRange(self):
+    detector = OutOfRangeBatchDetector(dataSet=self.dataSet,
+                                       probationaryPercent=0.15)
+    with self.assertRaises(ValueError):
+      detector.run()
+
+
+  def testAnomalyScoreOutOfRange(self):
+    detector = OutOfRangeDetector(dataSet=self.dataSet,
+                                  probationaryPercent=0.15)
+    with self.assertRaises(ValueError):
+      detector.run()
+
+
+
+if __name__ == '__main__':
+  unittest.main()
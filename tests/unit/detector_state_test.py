@@ -0,0 +1,192 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""Tests that detectors restored from a snapshot carry on where they left."""
+
+import datetime
+import io
+import math
+import numpy
+import os
+import pandas
+import pickle
+import shutil
+import tempfile
+import unittest
+import zlib
+from contextlib import redirect_stdout
+
+from nab.corpus import DataFile
+from nab.detectors.base import deserializeState, serializeState
+from nab.detectors.bayes_changept.bayes_changept_detector import (
+  BayesChangePtDetector)
+from nab.detectors.context_ose.context_ose_detector import ContextOSEDetector
+from nab.detectors.earthgecko_skyline.earthgecko_skyline_detector import (
+  EarthgeckoSkylineDetector)
+from nab.detectors.expose.expose_detector import ExposeDetector
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.detectors.knncad.knncad_detector import KnncadDetector
+from nab.detectors.null.null_detector import NullDetector
+from nab.detectors.random.random_detector import RandomDetector
+from nab.detectors.relative_entropy.relative_entropy_detector import (
+  RelativeEntropyDetector)
+from nab.detectors.skyline.skyline_detector import SkylineDetector
+from nab.test_helpers import generateTimestamps, writeCorpus
+
+
+
+class DetectorStateTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), 250)
+    values = [10 * math.sin(i / 20.0) + (i % 7) + 30 * (i == 200)
+              for i in range(250)]
+    writeCorpus(self.tempDir, {"test.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": values})})
+    self.dataSet = DataFile(os.path.join(self.tempDir, "test.csv"))
+    data = self.dataSet.data
+    self.records = [dict(zip(data.columns, record)) for record in
+                    zip(*[data[name].tolist() for name in data.columns])]
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def _newDetector(self, detectorClass):
+    # A long enough probationary period for knncad to train on.
+    detector = detectorClass(dataSet=self.dataSet, probationaryPercent=0.3)
+    detector.initialize()
+    return detector
+
+
+  def _scores(self, detector, records, batch):
+    if batch:
+      return list(detector.handleRecords(
+        [record["timestamp"] for record in records],
+        [record["value"] for record in records])[0])
+    return [detector.handleRecord(record)[0] for record in records]
+
+
+  def _checkRestore(self, detectorClass, split=150, batch=False):
+    with redirect_stdout(io.StringIO()):
+      expected = self._scores(self._newDetector(detectorClass), self.records,
+                              batch)
+
+      detector = self._newDetector(detectorClass)
+      actual = self._scores(detector, self.records[:split], batch)
+      data = serializeState(detector.getState())
+      self.assertIsInstance(data, bytes)
+      # The detector going on doesn't change its snapshot.
+      self._scores(detector, self.records[split:], batch)
+
+      restored = self._newDetector(detectorClass)
+      restored.setState(deserializeState(data))
+      actual += self._scores(restored, self.records[split:], batch)
+
+    self.assertEqual(actual, expected,
+                     "%s differs after restoring" % detectorClass.__name__)
+
+
+  def testRestoreMidStream(self):
+    for detectorClass in (NullDetector,
+                          RandomDetector,
+                          WindowedGaussianDetector,
+                          BayesChangePtDetector,
+                          RelativeEntropyDetector,
+                          KnncadDetector,
+                          SkylineDetector,
+                          EarthgeckoSkylineDetector,
+                          ContextOSEDetector):
+      self._checkRestore(detectorClass)
+
+
+  def testRestoreBatch(self):
+    for detectorClass in (NullDetector,
+                          RandomDetector,
+                          WindowedGaussianDetector):
+      self._checkRestore(detectorClass, batch=True)
+
+
+  def testRestoreFresh(self):
+    self._checkRestore(BayesChangePtDetector, split=0)
+
+
+  def testRandomStateIncluded(self):
+    """Restoring a random detector rewinds its random generator."""
+    detector = self._newDetector(RandomDetector)
+    state = detector.getState()
+    first = detector.handleRecord(self.records[0])
+    detector.setState(state)
+    self.assertEqual(detector.handleRecord(self.records[0]), first)
+
+
+  def testExposeStateLeavesOutKernel(self):
+    state = self._newDetector(ExposeDetector).getState()
+    self.assertEqual(set(state), {"previousExposeModel", "timestep"})
+
+
+  def testStateIsArrays(self):
+    detector = self._newDetector(ContextOSEDetector)
+    with redirect_stdout(io.StringIO()):
+      self._scores(detector, self.records[:100], False)
+    for value in deserializeState(serializeState(
+        detector.getState())).values():
+      self.assertIsInstance(value, numpy.ndarray)
+      self.assertFalse(value.dtype.hasobject)
+
+
+  def testPickleRejected(self):
+    """A pickle is refused without being loaded, whatever it would run."""
+    path = os.path.join(self.tempDir, "unpickled")
+    class Payload(object):
+      def __reduce__(self):
+        return (os.mkdir, (path,))
+
+    payload = pickle.dumps(Payload())
+    for data in (payload, zlib.compress(payload), b"", b"not a snapshot"):
+      with self.assertRaises(ValueError):
+        deserializeState(data)
+    self.assertFalse(os.path.exists(path))
+
+
+  def testMaxSize(self):
+    data = serializeState(self._newDetector(RandomDetector).getState())
+    self.assertEqual(len(deserializeState(data, maxSize=2 ** 20)), 2)
+    with self.assertRaises(ValueError):
+      deserializeState(data, maxSize=1000)
+
+
+  def testInvalidStateRejected(self):
+    detector = self._newDetector(WindowedGaussianDetector)
+    state = detector.getState()
+    for invalid in (
+        {name: value for name, value in state.items() if name != "mean"},
+        dict(state, extra=numpy.zeros(1)),
+        dict(state, windowData=numpy.zeros((2, 2))),
+        dict(state, mean=numpy.array("0")),
+        dict(state, std=[1.0])):
+      with self.assertRaises(ValueError):
+        detector.setState(invalid)
+
+    detector = self._newDetector(ContextOSEDetector)
+    with redirect_stdout(io.StringIO()):
+      self._scores(detector, self.records[:100], False)
+    state = detector.getState()
+    state["crossedSemiContexts0"] = numpy.array([10 ** 6])
+    with self.assertRaises(ValueError):
+      self._newDetector(ContextOSEDetector).setState(state)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
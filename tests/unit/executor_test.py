@@ -0,0 +1,131 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import threading
+import time
+import unittest
+
+from nab.executor import (EXECUTORS,
+                          ProcessExecutor,
+                          SerialExecutor,
+                          TaskQueue,
+                          ThreadExecutor,
+                          getExecutor)
+
+
+
+def whereRun(x):
+  return x * x, os.getpid(), threading.current_thread().ident
+
+
+
+def holdMemory(args):
+  """Notes the estimates of the tasks running alongside this one."""
+  estimate, state = args
+  with state["lock"]:
+    state["running"].append(estimate)
+    state["seen"].append(list(state["running"]))
+  time.sleep(0.02)
+  with state["lock"]:
+    state["running"].remove(estimate)
+  return estimate
+
+
+
+class ExecutorTest(unittest.TestCase):
+
+  def testExecutors(self):
+    here = (os.getpid(), threading.current_thread().ident)
+    for name in ("process", "thread", "serial"):
+      with getExecutor(name, 2) as executor:
+        self.assertIsInstance(executor, EXECUTORS[name])
+        results = executor.map(whereRun, range(20))
+        self.assertEqual([square for square, _, _ in results],
+                         [x * x for x in range(20)])
+        processes = {pid for _, pid, _ in results}
+        threads = {thread for _, _, thread in results}
+
+      if name == "process":
+        self.assertNotIn(here[0], processes)
+      elif name == "thread":
+        self.assertEqual(processes, {here[0]})
+        self.assertNotIn(here[1], threads)
+      else:
+        self.assertEqual((processes, threads), ({here[0]}, {here[1]}))
+      self.assertIsNone(executor._pool)
+
+
+  def testCreatedOnFirstUse(self):
+    executor = ProcessExecutor(1)
+    self.assertIsNone(executor._pool)
+    executor.close()
+    self.assertEqual(executor.map_async(abs, [-1, 2]).get(10), [1, 2])
+    self.assertIsNotNone(executor._pool)
+    executor.terminate()
+    self.assertIsNone(executor._pool)
+
+
+  def testTaskQueue(self):
+    """Sets of tasks submitted as others finish all run, without a budget."""
+    results = []
+
+    def then(squares):
+      results.append(squares)
+      if len(results) == 1:
+        tasks.submit(abs, [-x for x in squares], results.append)
+        tasks.submit(abs, [], results.append)
+
+    for name in ("thread", "serial"):
+      results = []
+      with getExecutor(name, 2) as executor:
+        tasks = TaskQueue(executor)
+        tasks.submit(lambda x: x * x, range(5), then)
+        tasks.run()
+      self.assertEqual(sorted(results),
+                       [[], [0, 1, 4, 9, 16], [0, 1, 4, 9, 16]])
+
+      with getExecutor(name, 2) as executor:
+        tasks = TaskQueue(executor, memoryBudget=10)
+        tasks.submit(int, ["1", "x"])
+        with self.assertRaises(ValueError):
+          tasks.run()
+
+
+  def testMemoryBudget(self):
+    """Tasks run at once only while their estimates fit in the budget, and one
+    over the whole budget runs alone."""
+    state = {"lock": threading.Lock(), "running": [], "seen": []}
+    estimates = [4, 4, 4, 2, 12, 4, 4, 2, 2, 2]
+    results = []
+    measured = []
+    with ThreadExecutor(4) as executor:
+      tasks = TaskQueue(executor, memoryBudget=10)
+      tasks.submit(holdMemory, [(estimate, state) for estimate in estimates],
+                   results.append, estimates,
+                   lambda i, peakRSS, baselineRSS: measured.append(i))
+      tasks.run()
+
+    self.assertEqual(results, [estimates])
+    self.assertEqual(sorted(measured), list(range(len(estimates))))
+    for running in state["seen"]:
+      self.assertTrue(sum(running) <= 10 or running == [12], running)
+    self.assertGreater(max(len(running) for running in state["seen"]), 1)
+
+
+  def testGetExecutor(self):
+    executor = SerialExecutor()
+    self.assertIs(getExecutor(executor), executor)
+    with self.assertRaises(ValueError):
+      getExecutor("cluster")
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,144 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import datetime
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+try:
+  import simplejson as json
+except ImportError:
+  import json
+
+from nab.corpus import DataFile
+from nab.detectors.base import detectDataSet
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.instrumentation import (getTimingPath,
+                                 LatencyHistogram,
+                                 LatencyRecorder,
+                                 summarizeTiming)
+from nab.test_helpers import generateTimestamps, writeCorpus
+
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+  def testPercentilesWithinPrecision(self):
+    values = numpy.random.RandomState(0).lognormal(10, 2, 20000).astype(int)
+    histogram = LatencyHistogram(significantDigits=2)
+    for value in values:
+      histogram.record(value)
+
+    for percentile in (1, 50, 90, 99, 99.9):
+      expected = numpy.percentile(values, percentile, method="inverted_cdf")
+      self.assertAlmostEqual(histogram.percentile(percentile) / expected, 1,
+                             delta=0.01)
+    self.assertEqual(histogram.percentile(100), values.max())
+    self.assertEqual(histogram.min, values.min())
+    self.assertEqual(histogram.count, len(values))
+    # Memory is bounded by the range of values, not their number.
+    self.assertLess(len(histogram.counts), 2000)
+
+
+  def testSmallValuesExact(self):
+    histogram = LatencyHistogram(significantDigits=2)
+    for value in range(200):
+      histogram.record(value)
+    self.assertEqual(histogram.percentile(50), 99)
+
+
+  def testAddAndRoundTrip(self):
+    first, second, both = [LatencyHistogram() for _ in range(3)]
+    for value in range(0, 100000, 7):
+      first.record(value)
+      both.record(value)
+    for value in range(50, 5000000, 1001):
+      second.record(value)
+      both.record(value)
+
+    merged = LatencyHistogram.fromDict(
+      json.loads(json.dumps(first.toDict())))
+    merged.add(second)
+    self.assertEqual(merged.toDict(), both.toDict())
+    self.assertEqual(merged.summary(), both.summary())
+
+
+  def testEmpty(self):
+    summary = LatencyHistogram().summary()
+    self.assertEqual(summary["count"], 0)
+    self.assertIsNone(summary["p99Micros"])
+
+
+
+class LatencyRecorderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), 500)
+    writeCorpus(self.tempDir, {"data/test.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": numpy.sin(numpy.arange(500.0))})})
+    self.dataSet = DataFile(os.path.join(self.tempDir, "data", "test.csv"))
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def testRunWithRecorder(self):
+    detector = WindowedGaussianDetector(dataSet=self.dataSet,
+                                        probationaryPercent=0.15)
+    expected = detector.run()
+
+    detector = WindowedGaussianDetector(dataSet=self.dataSet,
+                                        probationaryPercent=0.15)
+    recorder = LatencyRecorder(sampleInterval=3, segmentSize=100)
+    actual = detector.run(recorder=recorder)
+
+    self.assertTrue(actual.equals(expected))
+    self.assertEqual(recorder.numRecords, 500)
+    self.assertEqual(recorder.histogram.count, 167)
+    trace = recorder.toDict()["trace"]
+    self.assertEqual([segment["start"] for segment in trace],
+                     [0, 100, 200, 300, 400])
+    self.assertEqual(sum(segment["count"] for segment in trace), 167)
+
+
+  def testDetectDataSetWritesTiming(self):
+    timingDir = os.path.join(self.tempDir, "results", "timing")
+    labels = pandas.Series([0] * 500)
+    for relativePath in ("cat/a.csv", "cat/b.csv"):
+      detector = WindowedGaussianDetector(dataSet=self.dataSet,
+                                          probationaryPercent=0.15)
+      detectDataSet((0, detector, "gaussian", labels,
+                     os.path.join(self.tempDir, "results"), relativePath,
+                     (timingDir, 1)))
+
+    path = getTimingPath(timingDir, "gaussian", "cat/a.csv")
+    self.assertEqual(path, os.path.join(timingDir, "gaussian", "cat",
+                                        "gaussian_a.json"))
+    with open(path) as f:
+      result = json.load(f)
+    self.assertEqual(result["file"], "cat/a.csv")
+    self.assertEqual(result["count"], 500)
+    self.assertLessEqual(result["p50Micros"], result["p99Micros"])
+    self.assertLessEqual(result["p99Micros"], result["maxMicros"])
+
+    summary = summarizeTiming(timingDir, "gaussian")
+    self.assertEqual(summary["count"], 1000)
+    self.assertEqual(sorted(summary["files"]), ["cat/a.csv", "cat/b.csv"])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
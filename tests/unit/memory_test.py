@@ -0,0 +1,109 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+from nab.memory import (MB,
+                        MemoryEstimator,
+                        _statusBytes,
+                        measureTask,
+                        resetPeakRSS)
+from nab.util import writeJSON
+
+
+
+class SmallDetector(object):
+  memoryBase = MB
+  memoryPerRecord = 100
+
+
+
+class LargeDetector(object):
+  memoryBase = 3 * MB
+  memoryPerRecord = 300
+
+
+
+def allocate(numBytes):
+  return int(numpy.ones(numBytes // 8).sum())
+
+
+
+class MemoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempDir, "memory_results.json")
+    self.detectors = {"small": SmallDetector, "large": LargeDetector}
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def testEstimates(self):
+    estimator = MemoryEstimator(self.detectors, self.path)
+    self.assertEqual(estimator.estimate("small", 1000), MB + 100000)
+    self.assertEqual(estimator.estimate("large", 1000), 3 * MB + 300000)
+
+
+  def testRefinedByEarlierRuns(self):
+    """Estimates scale by the largest ratio measured before, with a margin."""
+    writeJSON(self.path, {"small": {"tasks": [
+      {"records": 1000, "growth": 2 * (MB + 100000)},
+      {"records": 0, "growth": MB // 2},
+      {"records": 10, "growth": None}]}})
+    estimator = MemoryEstimator(self.detectors, self.path, margin=1.5)
+    self.assertEqual(estimator.scales, {"small": 3.0, "large": 1.0})
+    self.assertEqual(estimator.estimate("small", 0), 3 * MB)
+    self.assertEqual(estimator.estimate("large", 0), 3 * MB)
+
+
+  def testRecord(self):
+    """The growth of a task of several detectors is shared by estimate, and
+    written as the summary of each detector."""
+    estimator = MemoryEstimator(self.detectors, self.path)
+    estimator.record(["small", "large"], "a.csv", 0, [MB, 3 * MB],
+                     100 * MB, 92 * MB)
+    estimator.record(["small"], "b.csv", 0, [MB], None, None)
+    estimator.write()
+
+    summary = MemoryEstimator(self.detectors).summary("small")
+    self.assertEqual(summary["numTasks"], 0)
+    self.assertIsNone(summary["maxGrowth"])
+
+    summary = estimator.summary("small")
+    self.assertEqual(summary["numTasks"], 2)
+    self.assertEqual(summary["maxPeakRSS"], 100 * MB)
+    self.assertEqual(summary["maxGrowth"], 2 * MB)
+    self.assertEqual(summary["maxGrowthToEstimate"], 2.0)
+    self.assertEqual(estimator.summary("large")["maxGrowth"], 6 * MB)
+
+    # Refined by this run in the next
+    estimator = MemoryEstimator(self.detectors, self.path, margin=1.0)
+    self.assertEqual(estimator.scales, {"small": 2.0, "large": 2.0})
+
+
+  def testMeasureTask(self):
+    if not resetPeakRSS():
+      self.skipTest("The peak RSS can only be reset on Linux")
+    before = _statusBytes("VmRSS")
+    result, peakRSS, baselineRSS = measureTask((allocate, 64 * MB))
+    self.assertEqual(result, 8 * MB)
+    self.assertGreaterEqual(peakRSS, before + 60 * MB)
+    self.assertIsNotNone(baselineRSS)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
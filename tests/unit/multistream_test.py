@@ -0,0 +1,183 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import datetime
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from nab.corpus import DataFile
+from nab.detectors import getDetectorClass
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.multistream import (_roundOfRecords,
+                             MultiStreamRuntime,
+                             WindowedGaussianKernel)
+from nab.test_helpers import generateTimestamps, writeCorpus
+from nab.util import getProbationPeriod
+
+
+
+class MultiStreamRuntimeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    randomState = numpy.random.RandomState(0)
+    corpusData = {}
+    for i in range(4):
+      length = 300 + 50 * i
+      timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                      datetime.timedelta(minutes=5), length)
+      values = (10 * numpy.sin(numpy.arange(length) / (10.0 + i)) +
+                randomState.normal(0, 1 + i, length))
+      values[length - 40] += 30
+      corpusData["s%d.csv" % i] = pandas.DataFrame(
+        {"timestamp": timestamps, "value": values})
+    writeCorpus(self.tempDir, corpusData)
+    self.dataSets = [DataFile(os.path.join(self.tempDir, "s%d.csv" % i))
+                     for i in range(4)]
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def _interleave(self, streamIds):
+    """Records of all streams, shuffled but in order within each stream."""
+    ids = numpy.concatenate([numpy.full(len(dataSet.data), streamId)
+                             for streamId, dataSet in zip(streamIds,
+                                                          self.dataSets)])
+    timestamps = numpy.concatenate([dataSet.data["timestamp"].values
+                                    for dataSet in self.dataSets])
+    values = numpy.concatenate([dataSet.data["value"].values
+                                for dataSet in self.dataSets])
+    keys = numpy.random.RandomState(1).rand(len(ids))
+    # Sort each stream's keys, so its records keep their order.
+    start = 0
+    for dataSet in self.dataSets:
+      end = start + len(dataSet.data)
+      keys[start:end] = numpy.sort(keys[start:end])
+      start = end
+    order = numpy.argsort(keys)
+    return order, ids[order], timestamps[order], values[order]
+
+
+  def _runInterleaved(self, handleRecords, streamIds, batchSize=97):
+    order, ids, timestamps, values = self._interleave(streamIds)
+    scores = numpy.empty(len(ids))
+    for start in range(0, len(ids), batchSize):
+      batch = slice(start, start + batchSize)
+      scores[batch] = handleRecords(ids[batch], timestamps[batch],
+                                    values[batch])
+    # Back to the order of the data sets
+    unshuffled = numpy.empty(len(ids))
+    unshuffled[order] = scores
+    return numpy.split(unshuffled, numpy.cumsum(
+      [len(dataSet.data) for dataSet in self.dataSets])[:-1])
+
+
+  def _expected(self, detectorClass):
+    expected = []
+    for dataSet in self.dataSets:
+      detector = detectorClass(dataSet=dataSet, probationaryPercent=0.15)
+      detector.initialize()
+      expected.append(detector.run()["anomaly_score"].values)
+    return expected
+
+
+  def _checkRuntime(self, detectorName):
+    runtime = MultiStreamRuntime()
+    streamIds = [runtime.addStream("s%d" % i, detectorName,
+                                   dataSet.data["value"].min(),
+                                   dataSet.data["value"].max(),
+                                   len(dataSet.data))
+                 for i, dataSet in enumerate(self.dataSets)]
+    actual = self._runInterleaved(runtime.handleRecords, streamIds)
+
+    for scores, expected in zip(actual,
+                                self._expected(getDetectorClass(detectorName))):
+      self.assertEqual(list(scores), list(expected), detectorName)
+
+
+  def testKernelsMatchDetectors(self):
+    for detectorName in ("bayesChangePt", "null", "random", "relativeEntropy",
+                         "windowedGaussian"):
+      self._checkRuntime(detectorName)
+
+
+  def testDetectorKernel(self):
+    self._checkRuntime("contextOSE")
+
+
+  def testSlidingWindow(self):
+    """A small window, so that it slides within the test data."""
+    class SmallWindowDetector(WindowedGaussianDetector):
+      def __init__(self, *args, **kwargs):
+        super(SmallWindowDetector, self).__init__(*args, **kwargs)
+        self.windowSize = 50
+        self.stepSize = 10
+
+    kernel = WindowedGaussianKernel(windowSize=50, stepSize=10)
+    slots = [kernel.addStream(dataSet.data["value"].min(),
+                              dataSet.data["value"].max(),
+                              getProbationPeriod(0.15, len(dataSet.data)))
+             for dataSet in self.dataSets]
+    actual = self._runInterleaved(kernel.handleRecords, slots)
+    for scores, expected in zip(actual, self._expected(SmallWindowDetector)):
+      self.assertEqual(list(scores), list(expected))
+
+
+  def testRemoveAndReuse(self):
+    runtime = MultiStreamRuntime()
+    dataSet = self.dataSets[0]
+    args = ("windowedGaussian", dataSet.data["value"].min(),
+            dataSet.data["value"].max(), len(dataSet.data))
+    first = runtime.addStream("a", *args)
+    timestamps = dataSet.data["timestamp"].values[:10]
+    values = dataSet.data["value"].values[:10]
+    expected = runtime.handleRecords([first] * 10, timestamps, values)
+
+    runtime.removeStream("a")
+    with self.assertRaises(ValueError):
+      runtime.handleRecords([first], timestamps[:1], values[:1])
+
+    # The new stream reuses the freed slot, starting afresh.
+    second = runtime.addStream("b", *args)
+    self.assertEqual(second, first)
+    numpy.testing.assert_array_equal(
+      runtime.handleRecords([second] * 10, timestamps, values), expected)
+    with self.assertRaises(ValueError):
+      runtime.addStream("b", *args)
+
+
+  def testManyStreams(self):
+    """Slots are added as needed; state stays in fixed-size arrays."""
+    runtime = MultiStreamRuntime()
+    ids = [runtime.addStream("s%d" % i, "relativeEntropy", 0, 10, 1000)
+           for i in range(100)]
+    kernel = runtime.kernels["relativeEntropy"]
+    for _ in range(3):
+      runtime.handleRecords(numpy.repeat(ids, 60),
+                            numpy.zeros(6000, dtype="datetime64[ns]"),
+                            numpy.tile(numpy.arange(60) % 10, 100))
+    self.assertEqual(kernel.numStreams, 100)
+    self.assertLess(kernel.nbytes() / kernel.numStreams, 500)
+
+
+  def testRoundOfRecords(self):
+    self.assertEqual(list(_roundOfRecords(numpy.array([3, 1, 3, 3, 1, 0]))),
+                     [0, 0, 1, 2, 1, 0])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -11,7 +11,9 @@ Tests the score normalization scheme.
 """
 
 import csv
+import datetime
 import os
+import pandas
 import shutil
 import tempfile
 import unittest
@@ -21,6 +23,11 @@ except ImportError:
   import json
 
 from nab.runner import Runner
+from nab.test_helpers import (generateTimestamps,
+                              generateWindows,
+                              writeCorpus,
+                              writeCorpusLabel)
+from nab.util import strf
 
 
 def createCSV(parentDir, fileName, data):
@@ -175,6 +182,116 @@ class NormalizationTest(unittest.TestCase):
         "normalized score of %f is not the expected 10.0" % score)
 
 
+  def testScoreBreakdownFromMemory(self):
+    """Tests per-category and per-file scores, from in-memory results."""
+
+    tmpResultsDir = self._createTemporaryResultsDir()
+    os.makedirs(os.path.join(tmpResultsDir,'null'))
+    breakdownResults = os.path.join(tmpResultsDir, "breakdown_results.json")
+
+    columns = ("Detector", "Profile", "File", "Threshold", "Score", "TP", "TN",
+               "FP", "FN", "Total_Count")
+    files = ["artificialWithAnomaly/art_daily_nojump.csv",
+             "realAWSCloudwatch/ec2_cpu_utilization_5f5533.csv",
+             "realAWSCloudwatch/iio_us-east-1_i-a2eb1cd9_NetworkIn.csv"]
+    nullDF = pandas.DataFrame([
+      ["null", "standard", files[0], 0.5, -1.0, 0, 10, 0, 5, 15],
+      ["null", "standard", files[1], 0.5, -2.0, 0, 10, 0, 5, 15],
+      ["null", "standard", files[2], 0.5, -2.0, 0, 10, 0, 5, 15],
+      ["Totals", None, None, None, -5.0, 0, 30, 0, 15, 45]], columns=columns)
+    fakeDF = pandas.DataFrame([
+      ["fake", "standard", files[0], 0.7, 1.0, 2, 10, 0, 3, 15],
+      ["fake", "standard", files[1], 0.7, 0.5, 1, 9, 1, 4, 15],
+      ["fake", "standard", files[2], 0.7, -0.5, 1, 8, 2, 4, 15],
+      ["Totals", None, None, None, 1.0, 4, 27, 3, 11, 45]], columns=columns)
+
+    testRunner = createRunner(tmpResultsDir, 'standard', 'fake')
+    testRunner.resultsDFs = {
+      os.path.join(tmpResultsDir, "null", "null_standard_scores.csv"): nullDF,
+      testRunner.resultsFiles[0]: fakeDF}
+    testRunner.normalize()
+
+    with open(breakdownResults) as breakdownFile:
+      breakdown = json.load(breakdownFile)["fake"]["standard"]
+
+    self.assertAlmostEqual(
+      breakdown["categories"]["realAWSCloudwatch"]["normalized"],
+      100 * (0.0 - -4.0) / (4.0 - -4.0))
+    self.assertEqual(breakdown["categories"]["realAWSCloudwatch"]["fp"], 3)
+    self.assertEqual(breakdown["categories"]["realAWSCloudwatch"]["null"], -4.0)
+    self.assertAlmostEqual(breakdown["files"][files[0]]["normalized"], 100.0)
+    self.assertEqual(breakdown["files"][files[0]]["tp"], 2)
+
+
+  def testAnalyticNullBaseline(self):
+    """
+    Tests that an initialized runner normalizes without the null detector's
+    results, and caches the baseline.
+    """
+    tmpDir = self._createTemporaryResultsDir()
+    dataDir = os.path.join(tmpDir, "data")
+    resultsDir = os.path.join(tmpDir, "results")
+    labelPath = os.path.join(tmpDir, "labels", "windows.json")
+    profilesPath = os.path.join(tmpDir, "profiles.json")
+
+    corpusData = {}
+    corpusWindows = {}
+    for i, length in enumerate([400, 600]):
+      timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                      datetime.timedelta(minutes=5), length)
+      relativePath = "category/file%d.csv" % i
+      corpusData[relativePath] = pandas.DataFrame(
+        {"timestamp": timestamps, "value": 0.0})
+      corpusWindows[relativePath] = [
+        [strf(t1), strf(t2)]
+        for t1, t2 in generateWindows(timestamps, i + 1, 20)]
+    writeCorpus(dataDir, corpusData)
+    writeCorpusLabel(labelPath, corpusWindows)
+    with open(profilesPath, "w") as f:
+      json.dump({"standard": {"CostMatrix": {"tpWeight": 1.0,
+                                             "fnWeight": 1.0,
+                                             "fpWeight": 0.11}}}, f)
+
+    testRunner = Runner(dataDir=dataDir,
+                        resultsDir=resultsDir,
+                        labelPath=labelPath,
+                        profilesPath=profilesPath,
+                        thresholdPath=None,
+                        numCPUs=1)
+    try:
+      testRunner.initialize()
+
+      # Detecting nothing is the null detector's best option here, which
+      # misses all three windows.
+      nullResults = testRunner.scoreNullDetector()["standard"]
+      self.assertEqual(nullResults["Score"].iloc[-1], -3.0)
+      self.assertEqual(nullResults["FN"].iloc[-1], 60)
+      self.assertEqual(nullResults["Threshold"].iloc[0], 1.1)
+      cachePath = os.path.join(resultsDir, "null_baselines.json")
+      self.assertTrue(os.path.exists(cachePath))
+
+      # The cached baseline is used from then on.
+      with open(cachePath) as f:
+        cache = json.load(f)
+      for rows in cache.values():
+        rows[-1]["Score"] = -7.0
+      with open(cachePath, "w") as f:
+        json.dump(cache, f)
+
+      os.makedirs(os.path.join(resultsDir, "fake"))
+      fakeFile = createCSV(os.path.join(resultsDir, "fake"),
+                           "fake_standard_scores.csv",
+                           [self.resultsHeaders, ["fake", "standard", "1.0"]])
+      testRunner.resultsFiles = [fakeFile]
+      testRunner.normalize()
+    finally:
+      testRunner.close()
+
+    with open(os.path.join(resultsDir, "final_results.json")) as f:
+      score = json.load(f)["fake"]["standard"]
+    self.assertAlmostEqual(score, 100 * (1.0 + 7.0) / (3.0 + 7.0))
+
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,154 @@
+# Copyright 2014-2015 Numenta Inc.
+#
+# Copyright may exist in Contributors' modifications
+# and/or contributions to the work.
+#
+# Use of this source code is governed by the MIT
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import datetime
+import math
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from nab.corpus import DataFile
+from nab.detectors.base import detectDataSet
+from nab.detectors.gaussian.windowedGaussian_detector import (
+  WindowedGaussianDetector)
+from nab.detectors.random.random_detector import RandomDetector
+from nab.test_helpers import generateTimestamps, writeCorpus
+from nab.writer import ResultsWriter
+
+
+
+class ResultsWriterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    timestamps = generateTimestamps(datetime.datetime(2015, 1, 1),
+                                    datetime.timedelta(minutes=5), 500)
+    values = [10 * math.sin(i / 30.0) + (i % 3) for i in range(500)]
+    writeCorpus(self.tempDir, {"data/test.csv": pandas.DataFrame(
+      {"timestamp": timestamps, "value": values})})
+    self.dataSet = DataFile(os.path.join(self.tempDir, "data", "test.csv"))
+    self.labels = pandas.Series([int(200 <= i < 250) for i in range(500)])
+    self.outputPath = os.path.join(self.tempDir, "results", "test.csv")
+
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+
+  def _expectedCSV(self, detectorClass, supportsBatch=None):
+    detector = detectorClass(dataSet=self.dataSet, probationaryPercent=0.15)
+    if supportsBatch is not None:
+      detector.supportsBatch = supportsBatch
+    detector.initialize()
+    results = detector.run()
+    results["label"] = self.labels
+    return results.to_csv(index=False)
+
+
+  def _writtenCSV(self, detectorClass, blockSize, supportsBatch=None):
+    detector = detectorClass(dataSet=self.dataSet, probationaryPercent=0.15)
+    if supportsBatch is not None:
+      detector.supportsBatch = supportsBatch
+    detector.initialize()
+    with ResultsWriter(self.outputPath, detector.getHeader(), self.labels,
+                       blockSize=blockSize) as writer:
+      self.assertIsNone(detector.run(writer))
+    with open(self.outputPath) as f:
+      return f.read()
+
+
+  def testBlocksMatchWholeFile(self):
+    for detectorClass in (RandomDetector, WindowedGaussianDetector):
+      for supportsBatch in (False, True):
+        expected = self._expectedCSV(detectorClass, supportsBatch)
+        for blockSize in (1, 64, 500, 1000):
+          self.assertEqual(
+            self._writtenCSV(detectorClass, blockSize, supportsBatch),
+            expected, "%s differs with blocks of %d" %
+            (detectorClass.__name__, blockSize))
+
+
+  def testDetectDataSet(self):
+    expected = self._expectedCSV(WindowedGaussianDetector)
+    detector = WindowedGaussianDetector(dataSet=self.dataSet,
+                                        probationaryPercent=0.15)
+    detectDataSet((0, detector, "gaussian", self.labels,
+                   os.path.join(self.tempDir, "results"), "cat/test.csv"))
+
+    resultsDir = os.path.join(self.tempDir, "results", "gaussian", "cat")
+    self.assertEqual(os.listdir(resultsDir), ["gaussian_test.csv"])
+    with open(os.path.join(resultsDir, "gaussian_test.csv")) as f:
+      self.assertEqual(f.read(), expected)
+
+
+  def testSharedInputRows(self):
+    """Files written from shared input text match those written alone."""
+    data = self.dataSet.data
+    scores = [float("nan") if i % 50 == 0 else i / 500.0 for i in range(500)]
+    extra = [i % 7 for i in range(500)]
+    outputs = {"one": [scores], "two": [scores, extra]}
+    headers = {"one": ["timestamp", "value", "anomaly_score"],
+               "two": ["timestamp", "value", "anomaly_score", "extra"]}
+
+    expected = {}
+    for name in outputs:
+      expected[name] = os.path.join(self.tempDir, "expected", name + ".csv")
+      with ResultsWriter(expected[name], headers[name], self.labels) as writer:
+        writer.write([data["timestamp"].values, data["value"].values] +
+                     outputs[name])
+
+    paths = {name: os.path.join(self.tempDir, "shared", name + ".csv")
+             for name in outputs}
+    writers = {name: ResultsWriter(paths[name], headers[name], self.labels,
+                                   blockSize=64) for name in outputs}
+    for start in range(0, 500, 64):
+      inputRows = writers["one"].formatInputs(
+        [data["timestamp"].values[start:start + 64],
+         data["value"].values[start:start + 64]])
+      for name, writer in writers.items():
+        writer.write([column[start:start + 64] for column in outputs[name]],
+                     inputRows)
+    for writer in writers.values():
+      writer.close()
+
+    for name in outputs:
+      with open(expected[name]) as f, open(paths[name]) as g:
+        self.assertEqual(g.read(), f.read())
+
+
+  def testNothingWrittenOnError(self):
+    with self.assertRaises(RuntimeError):
+      with ResultsWriter(self.outputPath, ["timestamp", "value"]) as writer:
+        writer.write([self.dataSet.data["timestamp"].values[:10],
+                      self.dataSet.data["value"].values[:10]])
+        raise RuntimeError("Detector failed")
+
+    self.assertEqual(os.listdir(os.path.dirname(self.outputPath)), [])
+
+
+  def testTooFewRows(self):
+    with self.assertRaises(ValueError):
+      with ResultsWriter(self.outputPath, ["value"], self.labels) as writer:
+        writer.write([self.dataSet.data["value"].values[:10]])
+
+    self.assertEqual(os.listdir(os.path.dirname(self.outputPath)), [])
+
+
+  def testTooManyRows(self):
+    writer = ResultsWriter(self.outputPath, ["value"], self.labels[:5])
+    with self.assertRaises(ValueError):
+      writer.write([self.dataSet.data["value"].values[:10]])
+    writer.abort()
+
+
+
+if __name__ == "__main__":
+  unittest.main()